@@ -1,10 +1,17 @@
 import streamlit as st
+import datetime
+import threading
+
+from oonce import summary
+from oonce.jobs import queue_counts
+from oonce.workspace import select_workspace
 
 st.set_page_config(
     page_title="OONCE Enterprise",
     page_icon="🏭",
     layout="wide"
 )
+ws = select_workspace()
 
 # CSS 美化
 st.markdown("""
@@ -44,6 +51,58 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# 实时 KPI：只读各模块写入时维护的汇总表 (当前工作区)，不扫台账、不联网
+@st.cache_resource
+def refreshing():
+    """正在后台重算汇总的台账 (跨会话、跨重跑共享)，同一本台账同时只跑一个重算线程"""
+    return set(), threading.Lock()
+
+def refresh_totals(ledger):
+    paths, lock = refreshing()
+    with lock:
+        if ledger.path in paths:
+            return
+        paths.add(ledger.path)
+
+    def run():
+        try:
+            ledger.totals()
+        finally:
+            with lock: paths.discard(ledger.path)
+    threading.Thread(target=run, daemon=True).start()
+
+def ledger_total(ledger):
+    value, fresh = summary.ledger_summary(ledger.path, ledger.version(), ledger.summary_db)
+    if not fresh and ledger.exists():
+        # 汇总过期 (如 CSV 被外部改过)：后台重算，本次先显示旧值
+        refresh_totals(ledger)
+    return (value or {}).get("total", 0.0), fresh or not ledger.exists()
+
+def since(ts):
+    if not ts: return "—"
+    return datetime.datetime.fromisoformat(ts).strftime("%m-%d %H:%M")
+
+total_in, fresh_in = ledger_total(ws.ledger("input"))
+total_out, fresh_out = ledger_total(ws.ledger("output"))
+landing = summary.get("import.last_landing", db_path=ws.summary_db)
+quote_count, quote_value = summary.open_quote_totals(ws.summary_db)
+digest = summary.get("news.latest_digest")    # 新闻日报各工作区共用
+
+k1, k2, k3, k4 = st.columns(4)
+with k1:
+    st.metric("💰 Net Profit", f"R {total_out - total_in:,.2f}", help=f"Revenue R {total_out:,.2f} − Cost R {total_in:,.2f}")
+    if not (fresh_in and fresh_out): st.caption("↻ 汇总更新中")
+with k2:
+    st.metric("🚢 Last Landing Cash", f"R {landing['Landing_Cash_Required']:,.2f}" if landing else "—",
+              help=f"PRN R {landing['Total_PRN_ZAR']:,.2f} · {landing['source']}" if landing else None)
+with k3:
+    st.metric("🏗️ Open Quotes", quote_count, help=f"Total ${quote_value:,.2f}")
+with k4:
+    st.metric("📰 Latest Digest", since(digest and digest["generated_at"]),
+              help=f"{digest['item_count']} items" if digest else None)
+
+st.write("")
+
 # 仪表盘/导航区
 c1, c2, c3 = st.columns(3)
 
@@ -82,4 +141,6 @@ with c3:
     """, unsafe_allow_html=True)
 
 st.divider()
-st.caption("System Status: Online | Powered by Gemini AI | Version 3.0")
+queue = queue_counts(ws.jobs_db)
+status = f"Ingest queue: {queue.get('running', 0)} running / {queue.get('queued', 0)} queued" if queue else "Ingest queue: idle"
+st.caption(f"System Status: {status} | Powered by Gemini AI | Version 3.0")
@@ -0,0 +1 @@
+"""性能基准：合成数据 + 本地桩服务 + 各页面流水线计时，结果存 JSON 便于对比回归"""
@@ -0,0 +1,304 @@
+"""基准测试入口
+
+用法:
+    python -m bench.run                                  # 默认规模 1k/10k/100k/1M，结果写到 bench_results/
+    python -m bench.run --sizes 1000 10000 --docs 20     # 快速跑
+    python -m bench.run --latency 0.2 --error-rate 0.05  # 模拟慢网络/不稳定上游
+    python -m bench.run --compare old.json new.json      # 对比两次结果，列出回归
+    python -m bench.startup                              # 只测各页面冷启动
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import synthetic
+from bench.startup import bench_startup
+from bench.stub_servers import StubServer, HttpFX, HttpSearch
+from oonce import analytics, cassette, duplicates, gemini, news, shipments, summary
+from oonce.fx import FixedFX, RateMatrix
+from oonce.gemini import GeminiClient
+from oonce.imports import calculate_landed_cost
+from oonce.invoices import process_invoices, calculate_metrics
+from oonce.quotes import calculate_logistics_and_price
+from oonce.storage import CsvLedger, FILE_INPUT, FILE_OUTPUT
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+RESULTS_DIR = "bench_results"
+
+def _metric(name, value, unit, better, **params):
+    return {"name": name, "value": round(value, 4), "unit": unit, "better": better, "params": params}
+
+def _timed(fn, repeats):
+    """返回每次耗时 (毫秒) 的中位数"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def bench_dashboard(workdir, rows, repeats=3):
+    """Invoice Manager 首屏：侧边栏汇总 (冷：全新汇总库第一次调用，要扫台账；热：汇总已在库里) + 表格读取 (默认只读最近几行，全表按需)"""
+    summary_db = os.path.join(workdir, f"summary_{rows}.db")     # 每个规模一个全新的汇总库
+    ledger_in = CsvLedger(os.path.join(workdir, f"in_{rows}.csv"), summary_db=summary_db)
+    ledger_out = CsvLedger(os.path.join(workdir, f"out_{rows}.csv"), summary_db=summary_db)
+    synthetic.write_ledger(ledger_in.path, rows, "input", seed=1)
+    synthetic.write_ledger(ledger_out.path, rows, "output", seed=2)
+    metrics = lambda: calculate_metrics(ledger_in, ledger_out)
+    return [
+        _metric("dashboard.metrics_cold_ms", _timed(metrics, 1), "ms", "lower", ledger_rows=rows),
+        _metric("dashboard.metrics_ms", _timed(metrics, repeats), "ms", "lower", ledger_rows=rows),
+        _metric("dashboard.table_tail_ms", _timed(lambda: ledger_in.read_tail(500), repeats), "ms", "lower", ledger_rows=rows),
+        _metric("dashboard.table_read_ms", _timed(ledger_in.read, repeats), "ms", "lower", ledger_rows=rows),
+    ]
+
+def bench_invoice_ingest(workdir, rows, n_docs, gemini_url, fx_url):
+    """识别入账吞吐：含查重签名加载、模型调用、汇率、CSV 追加"""
+    ledger = CsvLedger(os.path.join(workdir, f"ingest_{rows}.csv"))
+    shutil.copyfile(os.path.join(workdir, f"in_{rows}.csv"), ledger.path)
+    llm = GeminiClient("bench-key", base_url=gemini_url)
+    uploads = synthetic.synthetic_uploads(n_docs)
+    start = time.perf_counter()
+    batch = process_invoices(uploads, "input", False, llm, HttpFX(fx_url), ledger)
+    elapsed = time.perf_counter() - start
+    return [
+        _metric("invoice_ingest.docs_per_sec", n_docs / elapsed, "docs/s", "higher", ledger_rows=rows, docs=n_docs),
+        _metric("invoice_ingest.failed", len(batch["failed"]), "docs", "lower", ledger_rows=rows, docs=n_docs),
+    ]
+
+def bench_local_extract(workdir, rows, n_docs, gemini_url, fx_url):
+    """带文字层的老供应商 PDF：本地模板识别的吞吐和命中率 (首批含模板学习)"""
+    ledger = CsvLedger(os.path.join(workdir, f"local_{rows}.csv"))
+    shutil.copyfile(os.path.join(workdir, f"in_{rows}.csv"), ledger.path)
+    llm = GeminiClient("bench-key", base_url=gemini_url)
+    uploads = synthetic.text_invoice_uploads(ledger.read(usecols=["Vendor"]), n_docs)
+    start = time.perf_counter()
+    batch = process_invoices(uploads, "input", False, llm, HttpFX(fx_url), ledger)
+    elapsed = time.perf_counter() - start
+    return [
+        _metric("local_extract.docs_per_sec", n_docs / elapsed, "docs/s", "higher", ledger_rows=rows, docs=n_docs),
+        _metric("local_extract.hit_rate", batch["local"] / n_docs, "ratio", "higher", ledger_rows=rows, docs=n_docs),
+    ]
+
+def bench_replay(workdir, rows, n_docs, gemini_url, fx_url):
+    """录制/回放：同一批发票先对着桩服务录一遍，再从 cassette 离线回放 (不联网)，比较吞吐并核对结果一致"""
+    uploads = synthetic.synthetic_uploads(n_docs, seed=7)
+    path = os.path.join(workdir, f"replay_{rows}.jsonl.gz")
+    out = []
+    for mode in ("record", "replay"):
+        ledger = CsvLedger(os.path.join(workdir, f"replay_{mode}_{rows}.csv"))
+        shutil.copyfile(os.path.join(workdir, f"in_{rows}.csv"), ledger.path)
+        gemini._model_cache.clear()
+        with cassette.use(path, mode):
+            start = time.perf_counter()
+            batch = process_invoices(uploads, "input", False, GeminiClient("bench-key", base_url=gemini_url), HttpFX(fx_url), ledger)
+            elapsed = time.perf_counter() - start
+        out.append(_metric(f"replay.{mode}_docs_per_sec", n_docs / elapsed, "docs/s", "higher", ledger_rows=rows, docs=n_docs))
+        if mode == "record": recorded = batch["rows"]
+    out.append(_metric("replay.mismatched_rows", sum(a != b for a, b in zip(recorded, batch["rows"])) + abs(len(recorded) - len(batch["rows"])),
+                       "rows", "lower", ledger_rows=rows, docs=n_docs))
+    out.append(_metric("replay.cassette_kb", os.path.getsize(path) / 1024, "KB", "lower", docs=n_docs))
+    return out
+
+def bench_duplicate_lookup(workdir, rows, n_queries=2000):
+    """近似查重：索引构建耗时、单次查询耗时、OCR 变形的召回率、全新发票的误报率"""
+    df = CsvLedger(os.path.join(workdir, f"in_{rows}.csv")).read(dtype=str)
+    index = duplicates.DuplicateIndex()
+    start = time.perf_counter()
+    index.add_frame(df, "Vendor")
+    build_ms = (time.perf_counter() - start) * 1000
+    queries = synthetic.ocr_variants(df, min(n_queries, rows), seed=3)
+    fresh = [(f"NEW-{i:06d}", "BRAND NEW TRADING", 123.45 + i, "2024-06-01") for i in range(len(queries))]
+    start = time.perf_counter()
+    found = sum(bool(index.lookup(*q)) for q in queries)
+    lookup_us = (time.perf_counter() - start) / len(queries) * 1e6
+    false_hits = sum(bool(index.lookup(*q)) for q in fresh)
+    return [
+        _metric("duplicates.build_ms", build_ms, "ms", "lower", ledger_rows=rows),
+        _metric("duplicates.lookup_us", lookup_us, "us", "lower", ledger_rows=rows),
+        _metric("duplicates.recall", found / len(queries), "ratio", "higher", ledger_rows=rows),
+        _metric("duplicates.false_positive", false_hits / len(fresh), "ratio", "lower", ledger_rows=rows),
+    ]
+
+def bench_period_close(workdir, rows):
+    """期间结账：快照刷新后一整年的 VAT 申报 + 销项断号 + 待重处理行 (合成台账的日期分布在 2022-2024)"""
+    ledgers = {"input": CsvLedger(os.path.join(workdir, f"in_{rows}.csv")), "output": CsvLedger(os.path.join(workdir, f"out_{rows}.csv"))}
+    out_dir = os.path.join(workdir, f"snapshots_{rows}")
+    start = time.perf_counter()
+    analytics.refresh_snapshots(out_dir, ledgers.get)
+    snapshot_ms = (time.perf_counter() - start) * 1000
+    close_ms = _timed(lambda: analytics.close_period("2023-01-01", "2023-12-31", 2, out_dir), 3)
+    return [
+        _metric("period_close.snapshot_ms", snapshot_ms, "ms", "lower", ledger_rows=rows),
+        _metric("period_close.year_ms", close_ms, "ms", "lower", ledger_rows=rows),
+    ]
+
+def bench_fx_revalue(workdir, rows):
+    """整本台账折算成报表币种：冷 (汇率矩阵从数据源建库) 与热 (内存里的矩阵)；快照沿用 bench_period_close 的"""
+    out_dir = os.path.join(workdir, f"snapshots_{rows}")
+    fx = RateMatrix(FixedFX(18.5, {"EUR": 0.92, "CNY": 7.2}), os.path.join(workdir, f"fx_{rows}.db"))
+    start = time.perf_counter()
+    analytics.revalue("EUR", out_dir=out_dir, fx=fx)
+    cold_ms = (time.perf_counter() - start) * 1000
+    warm_ms = _timed(lambda: analytics.revalue("EUR", out_dir=out_dir, fx=fx), 3)
+    return [
+        _metric("fx.revalue_cold_ms", cold_ms, "ms", "lower", ledger_rows=rows),
+        _metric("fx.revalue_warm_ms", warm_ms, "ms", "lower", ledger_rows=rows),
+    ]
+
+def bench_recompute(lines_list=(20, 200, 2000), repeats=20):
+    """编辑表格后每次重算的耗时"""
+    out = []
+    fees = {"Port": 6800.0, "Cargo": 4500.0, "Trans": 27500.0, "Service": 3000.0}
+    for n in lines_list:
+        packing = synthetic.synthetic_packing_list(n)
+        boq = synthetic.synthetic_boq(n)
+        out.append(_metric("import.landed_cost_ms",
+                           _timed(lambda: calculate_landed_cost(packing.copy(), 18.8, fees), repeats),
+                           "ms", "lower", lines=n))
+        out.append(_metric("quote.logistics_price_ms",
+                           _timed(lambda: calculate_logistics_and_price(boq.copy(), 500.0, 2.5, 30), repeats),
+                           "ms", "lower", lines=n))
+    return out
+
+def bench_shipments(workdir, shipment_counts=(10, 50), lines=200, repeats=10):
+    """批量货运：所有票一次算到岸成本 + 按周的落地现金时间线 (含从库里读明细)"""
+    out = []
+    fees = {"Port": 6800.0, "Cargo": 4500.0, "Trans": 27500.0, "Service": 3000.0}
+    for n in shipment_counts:
+        db_path = os.path.join(workdir, f"shipments_{n}.db")
+        for i in range(n):
+            sid = shipments.create_shipment(f"SHIP {i}", "USD", 18.8 + i % 3 / 10, 6350, fees,
+                                            f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", db_path=db_path)
+            shipments.save_lines(sid, synthetic.synthetic_packing_list(lines, seed=i), db_path)
+
+        def consolidate():
+            ships = shipments.list_shipments(db_path=db_path)
+            costs, _ = shipments.landed_costs(ships, shipments.load_lines(ships["id"], db_path=db_path))
+            shipments.cashflow_timeline(costs, "W")
+        out.append(_metric("import.batch_landed_cost_ms", _timed(consolidate, repeats), "ms", "lower", shipments=n, lines=lines))
+    return out
+
+def bench_news_scan(search_url, server):
+    """全部 10 个话题 + 使领馆：冷启动 (无缓存) 与热缓存两次扫描"""
+    factory = lambda: HttpSearch(search_url)
+    news.clear_search_cache()
+    out = []
+    for label in ("cold", "warm"):
+        before = server.requests
+        start = time.perf_counter()
+        items = news.search_news_smart(news.TOPIC_OPTIONS, news.DEFAULT_MEDIA, True, factory)
+        elapsed = (time.perf_counter() - start) * 1000
+        out.append(_metric(f"news.scan_{label}_ms", elapsed, "ms", "lower", topics=len(news.TOPIC_OPTIONS)))
+        out.append(_metric(f"news.scan_{label}_requests", server.requests - before, "calls", "lower"))
+        out.append(_metric(f"news.scan_{label}_items", len(items), "items", "higher"))
+    return out
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def run_all(args):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="oonce_bench_")
+    summary.SUMMARY_DB = os.path.join(workdir, "summary.db")  # 不污染当前目录的首页汇总
+    try:
+        with StubServer(args.latency, args.error_rate, seed=1) as gemini_srv, \
+             StubServer(args.latency, args.error_rate, seed=2) as fx_srv, \
+             StubServer(args.latency, args.error_rate, seed=3) as search_srv:
+            for rows in args.sizes:
+                print(f"📒 ledger {rows:,} rows ...", flush=True)
+                results += bench_dashboard(workdir, rows)
+                results += bench_invoice_ingest(workdir, rows, args.docs, gemini_srv.base_url, fx_srv.base_url)
+                results += bench_local_extract(workdir, rows, args.docs, gemini_srv.base_url, fx_srv.base_url)
+                if rows == args.sizes[0]: results += bench_replay(workdir, rows, args.docs, gemini_srv.base_url, fx_srv.base_url)
+                results += bench_duplicate_lookup(workdir, rows)
+                results += bench_period_close(workdir, rows)
+                results += bench_fx_revalue(workdir, rows)
+            print("🧮 recompute ...", flush=True)
+            results += bench_recompute()
+            results += bench_shipments(workdir)
+            print("📰 news scan ...", flush=True)
+            results += bench_news_scan(search_srv.base_url, search_srv)
+        if args.startup_rows:
+            print(f"🚀 cold start (ledger {args.startup_rows:,} rows) ...", flush=True)
+            startup_dir = os.path.join(workdir, "startup")
+            os.makedirs(startup_dir)
+            synthetic.write_ledger(os.path.join(startup_dir, FILE_INPUT), args.startup_rows, "input", seed=5)
+            synthetic.write_ledger(os.path.join(startup_dir, FILE_OUTPUT), args.startup_rows, "output", seed=6)
+            results += bench_startup(startup_dir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_s": args.latency,
+            "error_rate": args.error_rate,
+            "docs": args.docs,
+            "startup_rows": args.startup_rows,
+        },
+        "results": results,
+    }
+
+def _key(metric):
+    return metric["name"] + json.dumps(metric["params"], sort_keys=True)
+
+def compare(base_path, new_path, threshold):
+    """逐项对比，变差超过 threshold (比例) 的标记为回归，返回回归项数量"""
+    with open(base_path, encoding="utf-8") as f: base = {_key(m): m for m in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f: new = json.load(f)["results"]
+    regressions = 0
+    for m in new:
+        old = base.get(_key(m))
+        if not old or not old["value"]:
+            continue
+        change = (m["value"] - old["value"]) / abs(old["value"])
+        worse = change > threshold if m["better"] == "lower" else change < -threshold
+        regressions += worse
+        flag = "❌" if worse else "  "
+        params = ", ".join(f"{k}={v}" for k, v in m["params"].items())
+        print(f"{flag} {m['name']:<40} {params:<28} {old['value']:>12.3f} → {m['value']:>12.3f} {m['unit']:<7} ({change:+.1%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OONCE 流水线基准测试")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="台账行数")
+    parser.add_argument("--docs", type=int, default=50, help="每轮识别入账的文件数")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务每次请求延迟 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务随机报错比例")
+    parser.add_argument("--startup-rows", type=int, default=10_000, help="冷启动测试用的台账行数 (0 跳过)")
+    parser.add_argument("--out", help=f"结果 JSON 路径 (默认 {RESULTS_DIR}/<时间>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="对比两份结果")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回归判定阈值 (比例)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+
+    report = run_all(args)
+    out = args.out or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for m in report["results"]:
+        params = ", ".join(f"{k}={v}" for k, v in m["params"].items())
+        print(f"{m['name']:<40} {params:<28} {m['value']:>12.3f} {m['unit']}")
+    print(f"✅ 结果已保存: {out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""冷启动基准：每个页面在全新进程里测两项
+
+- import_ms:        只执行页面顶部的 import 语句
+- first_render_ms:  用 streamlit.testing 跑一次完整脚本 (首屏)，不含 streamlit 自身的导入
+
+用法:
+    python -m bench.startup                 # 直接打印
+    python -m bench.run                     # 作为完整基准的一部分
+"""
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_PROBE = """
+import ast, json, sys, time
+path = sys.argv[1]
+with open(path, encoding="utf-8") as f:
+    nodes = [n for n in ast.parse(f.read()).body if isinstance(n, (ast.Import, ast.ImportFrom))]
+start = time.perf_counter()
+exec(compile(ast.Module(nodes, []), path, "exec"), {})
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000}))
+"""
+
+_RENDER_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+at.secrets["GEMINI_KEY"] = "bench-key"
+start = time.perf_counter()
+at.run()
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000, "errors": len(at.exception)}))
+"""
+
+def page_files():
+    return [os.path.join(REPO_ROOT, "Home.py")] + sorted(glob.glob(os.path.join(REPO_ROOT, "pages", "*.py")))
+
+def page_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.split("_", 2)[-1].lower() if "_" in name else name.lower()
+
+def _probe(code, path, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.run([sys.executable, "-c", code, path], cwd=workdir, env=env,
+                         capture_output=True, text=True, timeout=300)
+    lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+    if out.returncode or not lines:
+        raise RuntimeError(f"{os.path.basename(path)}: {out.stderr.strip()[-500:]}")
+    return json.loads(lines[-1])
+
+def bench_startup(workdir=None, repeats=3):
+    """workdir 为页面运行时的当前目录 (台账/档案所在处)，默认用空的临时目录"""
+    from bench.run import _metric
+    workdir = workdir or tempfile.mkdtemp(prefix="oonce_startup_")
+    out = []
+    for path in page_files():
+        name = page_name(path)
+        imports = [_probe(_IMPORT_PROBE, path, workdir)["ms"] for _ in range(repeats)]
+        renders = [_probe(_RENDER_PROBE, path, workdir) for _ in range(repeats)]
+        out.append(_metric(f"startup.{name}.import_ms", statistics.median(imports), "ms", "lower"))
+        out.append(_metric(f"startup.{name}.first_render_ms", statistics.median(r["ms"] for r in renders), "ms", "lower"))
+        out.append(_metric(f"startup.{name}.render_errors", max(r["errors"] for r in renders), "errors", "lower"))
+    return out
+
+def main():
+    for m in bench_startup():
+        print(f"{m['name']:<44} {m['value']:>10.1f} {m['unit']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""本地桩服务：Gemini / 汇率 / 新闻搜索，可配置延迟和错误率
+
+Gemini 桩实现真实 REST 路径 (GeminiClient 只需换 base_url)；汇率和搜索桩说简单 JSON，
+由本文件的 HttpFX / HttpSearch 适配成 oonce.fx / oonce.news 需要的接口。
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from oonce.stubs import StubGemini, StubSearch
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self):
+        """按配置延迟，并按错误率随机返回 429/500"""
+        server = self.server
+        time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.error_rate
+        if fail:
+            self._send_json({"error": "stub failure"}, status=server.rng.choice([429, 500]))
+        return fail
+
+    def do_GET(self):
+        if self._maybe_fail(): return
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if parts.path.endswith("/models"):
+            self._send_json({"models": [
+                {"name": "models/gemini-stub-flash", "supportedGenerationMethods": ["generateContent"]},
+                {"name": "models/gemini-stub-pro", "supportedGenerationMethods": ["generateContent"]},
+            ]})
+        elif parts.path.startswith("/fx/"):
+            day = int(query.get("date", "2024-01-01")[-2:])
+            self._send_json({"close": 18.0 + day / 100})
+        elif parts.path.startswith("/ddg/"):
+            backend = StubSearch()
+            kind = parts.path.rsplit("/", 1)[-1]
+            fn = backend.news if kind == "news" else backend.text
+            self._send_json(fn(query.get("q", ""), max_results=int(query.get("n", 2))))
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self._maybe_fail(): return
+        parts = json.loads(body)["contents"][0]["parts"]
+        text, _ = StubGemini().generate(parts)
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in text.splitlines(keepends=True):
+                event = "data: " + json.dumps({"candidates": [{"content": {"parts": [{"text": piece}]}}]}) + "\r\n\r\n"
+                data = event.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+class StubServer:
+    """在随机端口启动一个桩服务 (后台线程)，可用作 with 上下文"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.rng = random.Random(seed)
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = 0
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class HttpFX:
+    """汇率桩客户端 (接口同 oonce.fx.YahooFX)"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def historical_zar_rate(self, date_str):
+        try:
+            response = requests.get(f"{self.base_url}/fx/ZAR=X", params={"date": date_str}, timeout=10)
+            if response.status_code == 200: return float(response.json()["close"])
+        except Exception: pass
+        return None
+
+    def live_zar_rate(self):
+        return self.historical_zar_rate("")
+
+class HttpSearch:
+    """搜索桩客户端 (接口同 DDGS)，出错时抛异常，和真实 DDGS 一样由 cached_search 兜底"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def _get(self, kind, keywords, max_results):
+        response = requests.get(f"{self.base_url}/ddg/{kind}", params={"q": keywords, "n": max_results}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def news(self, keywords, region=None, timelimit=None, max_results=2):
+        return self._get("news", keywords, max_results)
+
+    def text(self, keywords, region=None, timelimit=None, max_results=1):
+        return self._get("text", keywords, max_results)
@@ -0,0 +1,120 @@
+"""合成数据：发票台账、装箱单、工程清单、待识别文件"""
+import numpy as np
+import pandas as pd
+
+from oonce.invoices import ledger_columns
+
+def synthetic_ledger(n_rows, mode="input", seed=0):
+    """与 process_and_save 写出的台账同列同格式，约 5% USD 行、1% 算术错误行"""
+    rng = np.random.default_rng(seed)
+    entity = "Vendor" if mode == "input" else "Client"
+    subtotal = rng.uniform(50, 50000, n_rows).round(2)
+    vat = (subtotal * 0.15).round(2)
+    is_usd = rng.random(n_rows) < 0.05
+    days = pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365, n_rows), unit="D")
+    df = pd.DataFrame({
+        "Date": days.strftime("%Y-%m-%d"),
+        "Invoice No": [f"INV-{i:07d}" for i in range(n_rows)],
+        entity: [f"SUPPLIER {k:04d} (PTY) LTD" for k in rng.integers(0, 2000, n_rows)],
+        "Subtotal": subtotal,
+        "VAT": np.where(is_usd, 0.0, vat),
+        "Total": np.where(is_usd, subtotal, subtotal + vat).round(2),
+        "Currency": np.where(is_usd, "USD", "ZAR"),
+        "Validation": np.where(is_usd, "✅ USD Auto", np.where(rng.random(n_rows) < 0.01, "❌ Math Error", "✅ OK")),
+        "File Name": [f"scan_{i}.pdf" for i in range(n_rows)],
+        "Total (Original)": np.where(is_usd, (subtotal / 18.5).round(2).astype(str), ""),
+        "Exchange Rate": np.where(is_usd, "18.5", "1.0"),
+    })
+    return df[ledger_columns(mode)]
+
+def write_ledger(path, n_rows, mode="input", seed=0):
+    synthetic_ledger(n_rows, mode, seed).to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+def synthetic_packing_list(n_lines, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "description": [f"ITEM {i}" for i in range(n_lines)],
+        "quantity": rng.integers(1, 500, n_lines),
+        "hs_code": "7318.15",
+        "duty_rate": rng.choice([0, 10, 15, 20], n_lines),
+        "unit_price": rng.uniform(0.5, 200, n_lines).round(2),
+    })
+
+def synthetic_boq(n_lines, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "item": [f"Item {i}" for i in range(n_lines)],
+        "spec": "STD",
+        "quantity": rng.integers(1, 1000, n_lines),
+        "china_price": rng.uniform(1, 500, n_lines).round(2),
+        "sa_price": np.where(rng.random(n_lines) < 0.3, rng.uniform(1, 800, n_lines).round(2), 0),
+        "weight_kg": rng.uniform(0.1, 200, n_lines).round(2),
+        "volume_m3": rng.uniform(0.001, 0.5, n_lines).round(3),
+    })
+
+class FakeUpload:
+    """模拟 Streamlit UploadedFile：name + getvalue()"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+def synthetic_uploads(n_docs, size_kb=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return [FakeUpload(f"invoice_{i}.pdf", rng.bytes(size_kb * 1024)) for i in range(n_docs)]
+
+def text_pdf(lines):
+    """最小的单页文字层 PDF (Helvetica)，模拟会计软件导出的电子发票"""
+    esc = lambda s: s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    stream = "BT /F1 11 Tf 14 TL 50 800 Td " + " ".join(f"({esc(l)}) '" for l in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+def text_invoice_uploads(ledger_df, n_docs, mode="input", seed=0):
+    """按台账里已有的供应商/客户生成带文字层的 PDF 发票 (新发票号、同样的格式)"""
+    rng = np.random.default_rng(seed)
+    entity = "Vendor" if mode == "input" else "Client"
+    names = ledger_df[entity].drop_duplicates().to_numpy()
+    uploads = []
+    for i in range(n_docs):
+        subtotal = round(float(rng.uniform(50, 50000)), 2)
+        vat = round(subtotal * 0.15, 2)
+        lines = [str(rng.choice(names)), "TAX INVOICE", f"Invoice No: INV-{9_000_000 + i:07d}",
+                 f"Invoice Date: {int(rng.integers(1, 28)):02d}/{int(rng.integers(1, 13)):02d}/2024",
+                 "Description Qty Amount", f"Services rendered 1 {subtotal:,.2f}",
+                 f"Subtotal: R {subtotal:,.2f}", f"VAT (15%): R {vat:,.2f}", f"Total Due: R {subtotal + vat:,.2f}"]
+        uploads.append(FakeUpload(f"digital_{i}.pdf", text_pdf(lines)))
+    return uploads
+
+def ocr_variants(ledger_df, n, mode="input", seed=0):
+    """从台账抽 n 行做 OCR 式变形 (发票号去横杠/去前导零/O 代 0、金额差一分、名称掉字母)，用于近似查重召回率"""
+    rng = np.random.default_rng(seed)
+    entity = "Vendor" if mode == "input" else "Client"
+    sample = ledger_df.iloc[rng.choice(len(ledger_df), n, replace=False)]
+    out = []
+    for k, (_, row) in enumerate(sample.iterrows()):
+        inv, name, total = str(row["Invoice No"]), str(row[entity]), float(row["Total"])
+        variant = k % 4
+        if variant == 0: inv = inv.replace("-", "")
+        elif variant == 1: inv = inv.replace("-0", "-", 1).replace("0", "O", 1)
+        elif variant == 2: total = round(total + 0.01, 2)
+        else: inv, name = f"X{inv[-5:]}", name.replace("L", "", 1)    # 发票号认错，靠名称 + 金额 + 日期
+        out.append((inv, name, total, row["Date"]))
+    return out
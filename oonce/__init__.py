@@ -0,0 +1 @@
+"""OONCE 核心逻辑包：不依赖 Streamlit，供页面、命令行和定时任务调用"""
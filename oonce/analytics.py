@@ -0,0 +1,339 @@
+"""台账分析：按月分区的 Parquet 快照 + 查询接口 (VAT 期间汇总、客户/供应商排名、进销对账、期间结账检查、报表币种折算)
+
+快照布局 (hive 分区，查询时按日期范围裁剪分区，只读需要的列):
+
+    oonce_snapshots/input/CURRENT                       # 指向当前这一代快照目录
+    oonce_snapshots/input/v-xxxx/month=2024-10/part-0.parquet
+    oonce_snapshots/input/v-xxxx/_meta.json             # 对应的台账版本
+
+台账只有追加时只重写受影响的月份 (其余月份硬链接)，被整表覆盖过则全量重建，都写进新的一代目录，写完再原子地改 CURRENT，
+读的一方任何时候都能看到一份完整快照 (上一代保留到下次重建，正在读旧目录的查询不受影响)。定时刷新:
+
+    python -m oonce.analytics               # 刷新两本台账的快照并打印本年 VAT 汇总
+    python -m oonce.analytics --close       # 另外打印销项发票断号和待重处理的行
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from oonce import trace
+from oonce.invoices import entity_label
+from oonce.storage import get_ledger, file_lock
+
+SNAPSHOT_DIR = "oonce_snapshots"
+UNKNOWN_MONTH = "unknown"    # 日期无法解析的行
+SNAPSHOT_FORMAT = 2          # 快照列有变化时加一，旧快照自动全量重建
+MIN_SEQUENCE = 3             # 同一前缀至少这么多张才检查断号
+SCHEMA = pa.schema([
+    ("Date", pa.date32()), ("Invoice No", pa.string()), ("Party", pa.string()),
+    ("Subtotal", pa.float64()), ("VAT", pa.float64()), ("Total", pa.float64()),
+    ("Currency", pa.string()), ("Validation", pa.string()),
+    ("Exchange Rate", pa.string()), ("File Name", pa.string()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+def _snapshot_path(mode, out_dir=None):
+    return os.path.join(out_dir or SNAPSHOT_DIR, mode)
+
+def _current(base):
+    """CURRENT 指向的那一代快照目录，没有返回 None"""
+    try:
+        with open(os.path.join(base, "CURRENT"), encoding="utf-8") as f:
+            path = os.path.join(base, f.read().strip())
+    except OSError:
+        return None
+    return path if os.path.isdir(path) else None
+
+def _switch(base, gen_dir):
+    """原子地把 CURRENT 指向新一代，只保留新旧两代，其余 (含崩溃留下的半成品和旧版布局) 清掉"""
+    keep = {"CURRENT", os.path.basename(gen_dir)}
+    prev = _current(base)
+    if prev: keep.add(os.path.basename(prev))
+    tmp = os.path.join(base, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(gen_dir))
+    os.replace(tmp, os.path.join(base, "CURRENT"))
+    for name in os.listdir(base):
+        if name in keep: continue
+        path = os.path.join(base, name)
+        if os.path.isdir(path): shutil.rmtree(path, ignore_errors=True)
+        else:
+            try: os.remove(path)
+            except OSError: pass
+
+def _clean(df, mode):
+    """台账原始行 -> 快照列 (供应商/客户统一叫 Party)，附带分区键 month"""
+    df = df.rename(columns={entity_label(mode): "Party"})
+    out = pd.DataFrame(index=df.index)
+    dates = pd.to_datetime(df.get("Date"), errors="coerce")
+    out["Date"] = dates.dt.date
+    for col in ("Invoice No", "Party", "Currency", "Validation", "Exchange Rate", "File Name"):
+        out[col] = df[col].fillna("").astype(str) if col in df else ""
+    for col in ("Subtotal", "VAT", "Total"):
+        out[col] = pd.to_numeric(df[col].astype(str).str.replace(",", ""), errors="coerce") if col in df else float("nan")
+    out["month"] = dates.dt.strftime("%Y-%m").fillna(UNKNOWN_MONTH)
+    return out
+
+def _write_partition(base, month, frame, previous=None):
+    """写某个月的分区文件 (previous 为上一代快照目录时，接在上一代该月的数据后面)，先写临时文件再替换"""
+    part_dir = os.path.join(base, f"month={month}")
+    os.makedirs(part_dir, exist_ok=True)
+    target = os.path.join(part_dir, "part-0.parquet")
+    table = pa.Table.from_pandas(frame.drop(columns="month"), schema=SCHEMA, preserve_index=False)
+    old = os.path.join(previous, f"month={month}", "part-0.parquet") if previous else None
+    if old and os.path.exists(old):
+        table = pa.concat_tables([pq.read_table(old, schema=SCHEMA), table])
+    tmp = target + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, target)
+
+def _link_partitions(previous, gen_dir, skip):
+    """上一代里没变的月份直接硬链接到新一代 (不支持硬链接时复制)"""
+    for name in os.listdir(previous):
+        if not name.startswith("month=") or name[len("month="):] in skip: continue
+        src, dst = os.path.join(previous, name, "part-0.parquet"), os.path.join(gen_dir, name)
+        if not os.path.exists(src): continue
+        os.makedirs(dst, exist_ok=True)
+        try: os.link(src, os.path.join(dst, "part-0.parquet"))
+        except OSError: shutil.copy2(src, os.path.join(dst, "part-0.parquet"))
+
+def _read_meta(base):
+    try:
+        with open(os.path.join(base, "_meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            return None
+        return dict(meta, version=tuple(meta["version"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _write_meta(base, version, rows):
+    tmp = os.path.join(base, "_meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": list(version), "rows": rows, "format": SNAPSHOT_FORMAT,
+                   "built": datetime.datetime.now().isoformat(timespec="seconds")}, f)
+    os.replace(tmp, os.path.join(base, "_meta.json"))
+
+@trace.traced("analytics.snapshot")
+def refresh_snapshot(mode, ledger=None, out_dir=None):
+    """让快照跟上台账：无变化直接返回；只有追加则只重写受影响的月份 (其余月份硬链接)；否则全量重建。
+    两种情况都写进新的一代目录再切 CURRENT，中途失败不会改动当前快照。返回当前快照目录 (无台账返回 None)"""
+    ledger = ledger or get_ledger(mode)
+    base = _snapshot_path(mode, out_dir)
+    os.makedirs(base, exist_ok=True)
+    with file_lock(base):
+        current = _current(base)
+        meta = _read_meta(current) if current else None
+        with ledger.lock(shared=True):
+            version = ledger.version()
+            if version is None:
+                return None
+            if meta and meta["version"] == version:
+                return current
+            tail = ledger.read_since(meta["version"]) if meta else None
+            df = ledger.read() if tail is None else None
+
+        gen_dir = tempfile.mkdtemp(prefix="v-", dir=base)
+        if tail is not None:
+            tail = _clean(tail, mode)
+            months = tail.groupby("month")
+            _link_partitions(current, gen_dir, skip=set(months.groups))
+            for month, frame in months:
+                _write_partition(gen_dir, month, frame, previous=current)
+            _write_meta(gen_dir, version, meta["rows"] + len(tail))
+            _switch(base, gen_dir)
+            return gen_dir
+
+        df = _clean(df, mode)
+        for month, frame in df.groupby("month"):
+            _write_partition(gen_dir, month, frame)
+        _write_meta(gen_dir, version, len(df))
+        shutil.rmtree(base + ".old", ignore_errors=True)    # 旧版 rename 方案崩溃留下的目录
+        _switch(base, gen_dir)
+        return gen_dir
+
+def refresh_snapshots(out_dir=None, ledger_factory=None):
+    ledger_factory = ledger_factory or get_ledger
+    return {mode: refresh_snapshot(mode, ledger_factory(mode), out_dir) for mode in ("input", "output")}
+
+def _month_key(d):
+    return pd.Timestamp(d).strftime("%Y-%m")
+
+def _scan(mode, columns=None, start=None, end=None, out_dir=None, where=None):
+    """读快照 (Arrow 表)：只扫 [start, end] 覆盖的月份分区、只读 columns 列，where 为额外的下推过滤。没有快照返回 None"""
+    base = _current(_snapshot_path(mode, out_dir))
+    columns = list(columns or SCHEMA.names)
+    if base is None:
+        return None
+    dataset = ds.dataset(base, format="parquet", partitioning=PARTITIONING, schema=SCHEMA.append(pa.field("month", pa.string())))
+    cond = where
+    if start is not None:
+        lower = (ds.field("month") >= _month_key(start)) & (ds.field("Date") >= pa.scalar(pd.Timestamp(start).date(), pa.date32()))
+        cond = lower if cond is None else cond & lower
+    if end is not None:
+        upper = (ds.field("month") <= _month_key(end)) & (ds.field("Date") <= pa.scalar(pd.Timestamp(end).date(), pa.date32()))
+        cond = upper if cond is None else cond & upper
+    with trace.span("analytics.scan", mode=mode, columns=len(columns)) as attrs:
+        table = dataset.to_table(columns=columns, filter=cond)
+        attrs["rows"] = table.num_rows
+    return table
+
+def query(mode, columns=None, start=None, end=None, out_dir=None, where=None):
+    """读快照为 DataFrame (参数同 _scan)。没有快照返回空表"""
+    table = _scan(mode, columns, start, end, out_dir, where)
+    return table.to_pandas() if table is not None else pd.DataFrame(columns=list(columns or SCHEMA.names))
+
+def top_parties(mode, start=None, end=None, n=10, out_dir=None):
+    """按 Party (供应商/客户) 汇总金额，取前 n 名"""
+    df = query(mode, ["Party", "Total", "VAT"], start, end, out_dir)
+    if df.empty:
+        return pd.DataFrame(columns=["Party", "Invoices", "Total", "VAT"])
+    out = df.groupby("Party").agg(Invoices=("Total", "size"), Total=("Total", "sum"), VAT=("VAT", "sum"))
+    return out.sort_values("Total", ascending=False).head(n).round(2).reset_index()
+
+def _periods(table, period_months):
+    """Arrow 表的 Date 列 -> VAT 期间标签 (numpy)，按 period_months 个月一期，标签为期末月份 (如 2024-02 表示 1-2 月)"""
+    dates = table.column("Date")
+    year = pc.year(dates).to_numpy(zero_copy_only=False)
+    end_month = ((pc.month(dates).to_numpy(zero_copy_only=False) - 1) // period_months + 1) * period_months
+    keys = pd.Series(year * 100 + end_month)        # 先按整数分组，只给分组结果拼字符串
+    labels = {k: UNKNOWN_MONTH if pd.isna(k) else f"{int(k) // 100}-{int(k) % 100:02d}" for k in keys.unique()}
+    return keys.map(labels).to_numpy()
+
+def _by_period(mode, columns, start, end, period_months, out_dir, **aggs):
+    table = _scan(mode, ["Date"] + columns, start, end, out_dir)
+    if table is None or table.num_rows == 0:
+        return None
+    df = pd.DataFrame({c: table.column(c).to_numpy(zero_copy_only=False) for c in columns})
+    df["Period"] = _periods(table, period_months)
+    return df.groupby("Period").agg(**aggs)
+
+def vat_summary(start=None, end=None, period_months=1, out_dir=None):
+    """每个 VAT 期间的销项税、进项税、应缴净额"""
+    frames = []
+    for mode, prefix in (("output", "Output"), ("input", "Input")):
+        frame = _by_period(mode, ["Total", "VAT"], start, end, period_months, out_dir,
+                           **{f"{prefix} Total": ("Total", "sum"), f"{prefix} VAT": ("VAT", "sum")})
+        if frame is not None: frames.append(frame)
+    cols = ["Output Total", "Output VAT", "Input Total", "Input VAT"]
+    out = pd.concat(frames, axis=1) if frames else pd.DataFrame(columns=cols)
+    out = out.reindex(columns=cols).fillna(0.0)
+    out["Net VAT Payable"] = out["Output VAT"] - out["Input VAT"]
+    return out.sort_index().round(2).rename_axis("Period").reset_index()
+
+def reconciliation(start=None, end=None, out_dir=None):
+    """进销对账：按月比较收入与成本，附发票张数"""
+    frames = []
+    for mode, prefix in (("output", "Revenue"), ("input", "Cost")):
+        frame = _by_period(mode, ["Total"], start, end, 1, out_dir,
+                           **{prefix: ("Total", "sum"), f"{prefix} Invoices": ("Total", "size")})
+        if frame is not None: frames.append(frame)
+    cols = ["Revenue", "Revenue Invoices", "Cost", "Cost Invoices"]
+    out = pd.concat(frames, axis=1) if frames else pd.DataFrame(columns=cols)
+    out = out.reindex(columns=cols).fillna(0)
+    out["Net"] = out["Revenue"] - out["Cost"]
+    return out.sort_index().round(2).rename_axis("Month").reset_index()
+
+def sequence_gaps(start=None, end=None, out_dir=None, min_count=MIN_SEQUENCE):
+    """销项发票断号：发票号拆成 前缀 + 末尾数字，同一前缀内相邻号码不连续的区间 (拆分、排序都在 Arrow/numpy 里做)"""
+    cols = ["Prefix", "From", "To", "Missing"]
+    table = _scan("output", ["Invoice No"], start, end, out_dir)
+    if table is None or table.num_rows == 0:
+        return pd.DataFrame(columns=cols)
+    inv_nos = pc.utf8_upper(pc.utf8_trim_whitespace(table.column("Invoice No")))
+    parts = pc.extract_regex(inv_nos, r"^(?P<prefix>.*?)(?P<digits>\d{1,15})$").combine_chunks()
+    parts = parts.filter(parts.is_valid())
+    if len(parts) == 0:
+        return pd.DataFrame(columns=cols)
+    prefix = pc.dictionary_encode(parts.field("prefix"))
+    codes = prefix.indices.to_numpy(zero_copy_only=False)
+    digits = parts.field("digits")
+    numbers = pc.cast(digits, pa.int64()).to_numpy(zero_copy_only=False)
+    widths = pc.utf8_length(digits).to_numpy(zero_copy_only=False)
+    order = np.lexsort((numbers, codes))
+    codes, numbers, widths = codes[order], numbers[order], widths[order]
+    counts = np.bincount(codes)
+    same = (codes[1:] == codes[:-1]) & (counts[codes[1:]] >= min_count)
+    gap = np.flatnonzero(same & (numbers[1:] - numbers[:-1] > 1))
+    if gap.size == 0:
+        return pd.DataFrame(columns=cols)
+    names = np.asarray(prefix.dictionary.to_pylist(), dtype=object)[codes[gap + 1]]
+    first, last, width = numbers[gap] + 1, numbers[gap + 1] - 1, widths[gap + 1]
+    pad = lambda n: [p + str(v).zfill(w) for p, v, w in zip(names, n, width)]     # 保留原来的位数
+    return pd.DataFrame({"Prefix": names, "From": pad(first), "To": pad(last), "Missing": last - first + 1})
+
+def exceptions(start=None, end=None, out_dir=None):
+    """待重处理的行：外币汇率为 Error 的、校验为 ❌ Math Error 的 (两本台账，过滤下推到快照扫描)"""
+    cols = ["Ledger", "Date", "Invoice No", "Party", "Currency", "Total", "Exchange Rate", "Validation", "File Name"]
+    flagged = (ds.field("Exchange Rate") == "Error") | pc.starts_with(ds.field("Validation"), "❌")
+    frames = [query(mode, cols[1:], start, end, out_dir, where=flagged).assign(Ledger=mode)[cols] for mode in ("input", "output")]
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+
+@trace.traced("analytics.revalue")
+def revalue(currency, start=None, end=None, fx=None, out_dir=None):
+    """进销台账折算成报表币种：Total (本位币) 按每行日期的汇率整列一次换算后按月汇总；查不到汇率的行计入 Unconverted"""
+    from oonce.fx import BOOK_CURRENCY, get_rate_matrix, normalize_currency
+    currency, fx = normalize_currency(currency), fx or get_rate_matrix()
+    frames = []
+    for mode, prefix in (("output", "Revenue"), ("input", "Cost")):
+        table = _scan(mode, ["Date", "Total"], start, end, out_dir)
+        if table is None or table.num_rows == 0: continue
+        totals = table.column("Total").to_numpy(zero_copy_only=False)
+        converted = fx.convert(totals, table.column("Date").to_numpy(zero_copy_only=False), BOOK_CURRENCY, currency)
+        df = pd.DataFrame({"Period": _periods(table, 1), "Book": totals, "Converted": converted,
+                           "Missing": np.isnan(converted) & ~np.isnan(totals)})
+        frames.append(df.groupby("Period").agg(**{f"{prefix} ({BOOK_CURRENCY})": ("Book", "sum"),
+                                                  f"{prefix} ({currency})": ("Converted", "sum"),
+                                                  f"{prefix} Unconverted": ("Missing", "sum")}))
+    cols = list(dict.fromkeys([f"Revenue ({BOOK_CURRENCY})", f"Revenue ({currency})", "Revenue Unconverted",
+                               f"Cost ({BOOK_CURRENCY})", f"Cost ({currency})", "Cost Unconverted"]))   # 报表币种就是本位币时只留一列
+    out = pd.concat(frames, axis=1) if frames else pd.DataFrame(columns=cols)
+    out = out.reindex(columns=cols).fillna(0)
+    out[f"Net ({currency})"] = out[f"Revenue ({currency})"] - out[f"Cost ({currency})"]
+    out["Unconverted"] = (out.pop("Revenue Unconverted") + out.pop("Cost Unconverted")).astype(int)
+    return out.sort_index().round(2).rename_axis("Month").reset_index()
+
+@trace.traced("analytics.close")
+def close_period(start=None, end=None, period_months=1, out_dir=None):
+    """期间结账检查：{"vat": VAT 申报汇总, "gaps": 销项断号, "exceptions": 待重处理的行, "seconds": 耗时}"""
+    begin = time.perf_counter()
+    out = {"vat": vat_summary(start, end, period_months, out_dir),
+           "gaps": sequence_gaps(start, end, out_dir),
+           "exceptions": exceptions(start, end, out_dir)}
+    out["seconds"] = round(time.perf_counter() - begin, 3)
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OONCE 台账快照与报表")
+    parser.add_argument("--out-dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--year", type=int, default=datetime.date.today().year, help="打印该年的 VAT 汇总")
+    parser.add_argument("--period-months", type=int, default=1, help="VAT 期间长度 (月)")
+    parser.add_argument("--close", action="store_true", help="同时检查销项断号和待重处理的行")
+    args = parser.parse_args(argv)
+
+    for mode, path in refresh_snapshots(args.out_dir).items():
+        print(f"📦 {mode}: {path or '无台账'}")
+    summary = vat_summary(f"{args.year}-01-01", f"{args.year}-12-31", args.period_months, args.out_dir)
+    print(summary.to_string(index=False) if not summary.empty else "本年无数据")
+    if args.close:
+        closed = close_period(f"{args.year}-01-01", f"{args.year}-12-31", args.period_months, args.out_dir)
+        print(f"\n🔢 销项断号 {int(closed['gaps']['Missing'].sum()) if not closed['gaps'].empty else 0} 张")
+        if not closed["gaps"].empty: print(closed["gaps"].to_string(index=False))
+        print(f"🔁 待重处理 {len(closed['exceptions'])} 行 (耗时 {closed['seconds']}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
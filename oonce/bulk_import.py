@@ -0,0 +1,238 @@
+"""批量导入：会计系统导出的 CSV/XLSX、银行流水 -> 台账
+
+分块读取 (内存只跟块大小有关，与文件大小无关)，按列映射取字段后用与 OCR 入账相同的规则清洗
+(invoices.normalize_frame)，查重用签名哈希 (排序数组 + np.isin)，每块持台账锁入账一次。
+
+    python -m oonce.bulk_import export_2019_2024.csv --mode input
+    python -m oonce.bulk_import fnb_2023.csv --mode input --kind bank --map date="Transaction Date" total=Amount
+    python -m oonce.bulk_import sales.xlsx --mode output --workspace acme
+
+银行流水没有 VAT 信息：Subtotal = Total、VAT = 0，校验列标 "🏦 Bank"；进项取支出 (负数金额或借方)，
+销项取收入。流水没有参考号时按 (日期, 摘要, 金额) 生成固定的 BANK-xxxx 单号，重复导入会被查重拦下。
+"""
+import argparse
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from oonce import trace
+from oonce.invoices import normalize_frame, parse_amount_series, signature_hashes
+from oonce.storage import get_ledger
+
+CHUNK_ROWS = 50_000
+KINDS = ("invoices", "bank")
+BANK_VALIDATION = "🏦 Bank"
+TARGETS = {
+    "invoices": ("date", "invoice_number", "party", "subtotal", "vat", "total", "currency"),
+    "bank": ("date", "invoice_number", "party", "total", "debit", "credit", "currency"),
+}
+# 列名猜测：先找完全相同的，再找包含的 (按顺序，先到先得)
+SYNONYMS = {
+    "date": ("date", "invoice date", "transaction date", "txn date", "document date", "doc date", "posting date", "value date"),
+    "invoice_number": ("invoice no", "invoice number", "invoice #", "inv no", "document no", "document number", "doc no", "reference", "ref"),
+    "party": ("vendor", "supplier", "supplier name", "client", "customer", "customer name", "account name", "description", "narrative", "details", "name"),
+    "subtotal": ("subtotal", "sub total", "amount excl vat", "amount excl", "exclusive", "excl", "net amount", "nett"),
+    "vat": ("vat", "vat amount", "tax", "tax amount"),
+    "total": ("total", "amount incl vat", "amount incl", "inclusive", "incl", "gross", "amount"),
+    "currency": ("currency", "ccy", "cur"),
+    "debit": ("debit", "debits", "money out", "withdrawal", "withdrawals"),
+    "credit": ("credit", "credits", "money in", "deposit", "deposits"),
+}
+
+# --- 读取 ---
+
+def _xlsx_chunks(src, chunksize):
+    from openpyxl import load_workbook
+    wb = load_workbook(src, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next((r for r in rows if any(v is not None for v in r)), None)
+        if header is None:
+            return
+        columns = [str(h).strip() if h is not None else f"Column {i + 1}" for i, h in enumerate(header)]
+        width, buf = len(columns), []
+        for r in rows:
+            if not any(v is not None for v in r): continue
+            buf.append((tuple(r) + (None,) * width)[:width])
+            if len(buf) >= chunksize:
+                yield pd.DataFrame(buf, columns=columns); buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=columns)
+    finally:
+        wb.close()
+
+def read_chunks(src, name="", chunksize=CHUNK_ROWS):
+    """CSV / XLSX 分块读取，逐块产出 DataFrame。src 为路径或文件对象 (如 UploadedFile)"""
+    name = name or getattr(src, "name", "") or str(src)
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        yield from _xlsx_chunks(src, chunksize)
+    else:
+        yield from pd.read_csv(src, dtype=str, keep_default_na=False, encoding="utf-8-sig",
+                               skipinitialspace=True, chunksize=chunksize)
+
+def preview(src, name="", rows=5):
+    """前几行 (选列映射用)，读完把文件对象倒回开头"""
+    chunks = read_chunks(src, name, chunksize=rows)
+    try:
+        head = next(chunks, pd.DataFrame())
+    finally:
+        chunks.close()
+        if hasattr(src, "seek"): src.seek(0)
+    return head
+
+def _norm(column):
+    return re.sub(r"[^a-z0-9#]+", " ", str(column).lower()).strip()
+
+def guess_mapping(columns, kind="invoices"):
+    """{目标字段: 源列名}，猜不到的不放"""
+    normed = {c: _norm(c) for c in columns}
+    mapping, used = {}, set()
+    for exact in (True, False):
+        for target in TARGETS[kind]:
+            if target in mapping: continue
+            for synonym in SYNONYMS[target]:
+                hit = next((c for c, n in normed.items() if c not in used and
+                            (n == synonym if exact else re.search(rf"\b{re.escape(synonym)}\b", n))), None)
+                if hit is not None:
+                    mapping[target] = hit; used.add(hit); break
+    return mapping
+
+# --- 清洗 ---
+
+class _MemoFX:
+    """同一日期的历史汇率只查一次 (整个导入过程共用，只有 historical_zar_rate 的老 FX 对象用)"""
+
+    def __init__(self, fx):
+        self.fx = fx
+        self.memo = {}
+
+    def historical_zar_rate(self, date_str):
+        if date_str not in self.memo:
+            self.memo[date_str] = self.fx.historical_zar_rate(date_str)
+        return self.memo[date_str]
+
+def _bank_raw(chunk, mapping, mode, key_name):
+    """银行流水 -> 发票同名列：进项取支出，销项取收入 (金额一律取正)"""
+    pick = lambda t: chunk[mapping[t]] if t in mapping else pd.Series("", index=chunk.index)
+    split = "debit" in mapping or "credit" in mapping     # 借/贷分两列；否则是一列带正负号的金额
+    source = pick("debit" if mode == "input" else "credit") if split else pick("total")
+    amount, bad = parse_amount_series(source)
+    keep = ((amount != 0) if split else (amount < 0) if mode == "input" else (amount > 0)) | bad
+    # 金额认不出的行保留原文，交给 normalize_frame 记为失败
+    amount = amount.abs().astype(str).where(~bad, source.astype(str))[keep]
+    refs = pick("invoice_number")[keep].astype(str).str.strip()
+    if "invoice_number" not in mapping or (refs == "").any():
+        key = pd.DataFrame({"d": pick("date")[keep].astype(str), "p": pick("party")[keep].astype(str), "a": amount})
+        generated = "BANK-" + pd.Series(pd.util.hash_pandas_object(key, index=False).to_numpy() % 16 ** 10,
+                                        index=key.index).map("{:010X}".format)
+        refs = refs.where(refs != "", generated)
+    return pd.DataFrame({"date": pick("date")[keep], "invoice_number": refs, key_name: pick("party")[keep],
+                         "subtotal": amount, "vat": "0", "total": amount, "currency": pick("currency")[keep]})
+
+def to_raw(chunk, mapping, mode, kind="invoices"):
+    """按列映射取出与模型输出同名的列"""
+    key_name = "vendor" if mode == "input" else "client"
+    if kind == "bank":
+        return _bank_raw(chunk, mapping, mode, key_name)
+    rename = {"party": key_name}
+    return pd.DataFrame({rename.get(t, t): chunk[src] for t, src in mapping.items() if src in chunk}, index=chunk.index)
+
+# --- 入账 ---
+
+def _ledger_hashes(ledger, chunksize=200_000):
+    """台账现有签名哈希 (分块读，只读两列) 与对应版本"""
+    with ledger.lock(shared=True):
+        version = ledger.version()
+        if version is None:
+            return np.array([], dtype="uint64"), None
+        parts = [signature_hashes(c) for c in pd.read_csv(ledger.path, usecols=lambda c: c in ("Invoice No", "Total"),
+                                                          dtype=str, chunksize=chunksize)]
+    return np.unique(np.concatenate(parts)) if parts else np.array([], dtype="uint64"), version
+
+def _mark_duplicates(rows, hashes, known, allow_duplicates):
+    """与已有签名或前面的行重复的：跳过，或标记 ⚠️ DUPLICATE。返回 (保留的行, 对应哈希, 跳过数)"""
+    dup = np.isin(hashes, known) | pd.Series(hashes).duplicated().to_numpy()
+    if not allow_duplicates:
+        return rows[~dup], hashes[~dup], int(dup.sum())
+    rows = rows.copy()
+    rows.loc[dup, "Validation"] = "⚠️ DUPLICATE"
+    return rows, hashes, 0
+
+@trace.traced("bulk.import")
+def import_file(src, mode, mapping=None, kind="invoices", fx=None, ledger=None, allow_duplicates=False,
+                name="", chunksize=CHUNK_ROWS, on_progress=None):
+    """分块导入一个文件。mapping 为 {目标字段: 源列名}，不传则按列名猜。
+
+    返回 {"rows": 写入行数, "skipped": 重复跳过, "failed": 清洗失败, "read": 读取行数}
+    """
+    if kind not in KINDS:
+        raise ValueError(f"未知的文件类型: {kind}")
+    if fx is None:
+        from oonce.fx import get_rate_matrix
+        fx = get_rate_matrix()
+    if not callable(getattr(fx, "rates", None)): fx = _MemoFX(fx)    # 汇率矩阵自带缓存、整列换算；老接口的按日期记忆
+    ledger = ledger or get_ledger(mode)
+    fname = name or getattr(src, "name", "") or str(src)
+    known, version = _ledger_hashes(ledger)
+    stats = {"rows": 0, "skipped": 0, "failed": 0, "read": 0}
+
+    for chunk in read_chunks(src, fname, chunksize):
+        mapping = mapping or guess_mapping(chunk.columns, kind)
+        if "total" not in mapping and "subtotal" not in mapping and not {"debit", "credit"} & set(mapping):
+            raise ValueError("列映射里没有金额列 (Total / Subtotal / Debit / Credit)")
+        stats["read"] += len(chunk)
+        with trace.span("bulk.normalize", rows=len(chunk)):
+            rows, failed = normalize_frame(to_raw(chunk, mapping, mode, kind), mode, fx, fname)
+            if kind == "bank": rows["Validation"] = BANK_VALIDATION
+            stats["failed"] += int(failed.sum())
+            rows = rows[~failed]
+            hashes = signature_hashes(rows)
+        rows, hashes, skipped = _mark_duplicates(rows, hashes, known, allow_duplicates)
+        stats["skipped"] += skipped
+
+        with ledger.lock():
+            if ledger.version() != version:
+                # 导入期间别人写过台账：补上新签名再查一遍
+                tail = ledger.read_since(version, usecols=lambda c: c in ("Invoice No", "Total"), dtype=str)
+                fresh = signature_hashes(tail) if tail is not None else _ledger_hashes(ledger)[0]
+                known = np.union1d(known, fresh)
+                rows, hashes, skipped = _mark_duplicates(rows, hashes, known, allow_duplicates)
+                stats["skipped"] += skipped
+            if len(rows):
+                ledger.append(rows)
+            version = ledger.version()
+        known = np.union1d(known, hashes)
+        stats["rows"] += len(rows)
+        if on_progress: on_progress(stats)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OONCE 台账批量导入 (CSV / XLSX / 银行流水)")
+    parser.add_argument("file")
+    parser.add_argument("--mode", choices=("input", "output"), required=True)
+    parser.add_argument("--kind", choices=KINDS, default="invoices")
+    parser.add_argument("--map", nargs="*", default=[], metavar="FIELD=COLUMN",
+                        help=f"列映射，字段: {', '.join(sorted(set(TARGETS['invoices'] + TARGETS['bank'])))}")
+    parser.add_argument("--workspace", default=None, help="导入到哪个工作区 (默认当前目录)")
+    parser.add_argument("--allow-duplicates", action="store_true", help="重复的也导入 (标记 ⚠️ DUPLICATE)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    mapping = dict(m.split("=", 1) for m in args.map) or None
+    if mapping is None:
+        mapping = guess_mapping(preview(args.file).columns, args.kind)
+        print("🔎 列映射: " + ", ".join(f"{k}={v}" for k, v in mapping.items()))
+    ledger = None
+    if args.workspace:
+        from oonce.workspace import get_workspace
+        ledger = get_workspace(args.workspace).ledger(args.mode)
+    progress = lambda s: print(f"  … 已读 {s['read']:,} 行，写入 {s['rows']:,}", flush=True)
+    stats = import_file(args.file, args.mode, mapping, args.kind, ledger=ledger, allow_duplicates=args.allow_duplicates,
+                        chunksize=args.chunk_rows, on_progress=progress)
+    print(f"✅ 写入 {stats['rows']:,} 行 | 重复跳过 {stats['skipped']:,} | 失败 {stats['failed']:,}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
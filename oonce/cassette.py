@@ -0,0 +1,378 @@
+"""外部调用录制/回放 (cassette)：Gemini REST、yfinance、DuckDuckGo 的请求和结果存进一个本地文件，
+之后在断网的机器上按同样的请求原样回放 (不等网络、不花额度、结果确定)，用于排查问题和回归/性能测试
+
+    OONCE_CASSETTE=cassettes/demo.jsonl.gz streamlit run Home.py                              # 录制 (已录过的请求直接回放)
+    OONCE_CASSETTE=cassettes/demo.jsonl.gz OONCE_CASSETTE_MODE=replay streamlit run Home.py   # 只回放，没录过的请求报错
+    python -m oonce.cassette cassettes/demo.jsonl.gz                                          # 查看录了什么
+
+模式: auto (默认，录过的回放、没录过的真实调用并录下) / record (全部真实调用并录下) / replay (只回放)。
+代码里也可以 with cassette.use(path, "replay"): ...
+
+文件为 gzip 压缩的 JSONL，每行一次交互 {"kind", "key", "req", "res"}。key 为请求内容 (方法、去掉 API Key 的地址、
+请求体 / 调用参数) 的哈希，请求体本身不落盘 (装箱单、发票图片很大)；同一请求录了多次时按顺序回放，放完后一直用最后一次。
+API Key 不写进文件。record 模式下调用出错也会录下，回放时抛同样说明的 CassetteError (调用方原有的兜底逻辑照常生效)。
+"""
+import argparse
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from oonce import trace
+
+FORMAT = 1
+MODES = ("auto", "record", "replay")
+SAVE_EVERY = 20     # 长时间运行的进程 (Streamlit) 每录这么多条落盘一次，退出时再存一次
+_KEY_PARAM = re.compile(r"([?&]key=)[^&]*")
+
+class CassetteError(RuntimeError):
+    """回放录下的异常"""
+
+class CassetteMiss(CassetteError):
+    """replay 模式下请求没录过"""
+
+def redact(url):
+    return _KEY_PARAM.sub(r"\1REDACTED", str(url))
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else json.dumps(p, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:20]
+
+class Cassette:
+    def __init__(self, path, mode="auto"):
+        if mode not in MODES:
+            raise ValueError(f"未知的 cassette 模式: {mode} (可选 {', '.join(MODES)})")
+        self.path = path
+        self.mode = mode
+        self.entries = []       # 按录制顺序
+        self._by_key = {}       # key -> [entry]
+        self._cursor = Counter()
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if mode != "record" and os.path.exists(path):
+            self._load()
+        elif mode == "replay":
+            raise FileNotFoundError(path)
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("format") != FORMAT:
+                raise ValueError(f"{self.path} 不是 cassette 文件或版本不符")
+            for line in f:
+                if line.strip(): self._add(json.loads(line))
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self._by_key.setdefault(entry["key"], []).append(entry)
+
+    def save(self):
+        """原子写入 (先写临时文件再改名)"""
+        with self._lock:
+            entries, self._unsaved = list(self.entries), 0
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"format": FORMAT}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+
+    def lookup(self, kind, key, req):
+        """录过的结果 (录下的是异常则抛 CassetteError)；没录过或 record 模式返回 None，replay 模式没录过抛 CassetteMiss"""
+        if self.mode == "record":
+            return None
+        with self._lock:
+            recorded = self._by_key.get(key)
+            if recorded:
+                entry = recorded[min(self._cursor[key], len(recorded) - 1)]
+                self._cursor[key] += 1
+        if recorded:
+            trace.incr("cassette_hits")
+            if "error" in entry["res"]: raise CassetteError(entry["res"]["error"])
+            return entry["res"]
+        if self.mode == "replay":
+            trace.incr("cassette_misses")
+            raise CassetteMiss(f"cassette 里没有这次 {kind} 调用: {req}")
+        return None
+
+    def record(self, kind, key, req, res):
+        """录下一次真实调用的结果 (可 JSON 序列化的 dict)"""
+        with self._lock:
+            self._add({"kind": kind, "key": key, "req": req, "res": res})
+            self._cursor[key] = len(self._by_key[key])
+            self._unsaved += 1
+            flush = self._unsaved >= SAVE_EVERY
+        trace.incr("cassette_recorded")
+        if flush: self.save()
+
+    def real_call(self, kind, key, req, real):
+        """真实调用 real()；出错时 record 模式录下异常说明并抛 CassetteError，auto 模式原样抛出 (偶发的网络错误不录，下次还会真实调用)"""
+        try:
+            return real()
+        except Exception as e:
+            if self.mode == "auto": raise
+            error = f"{type(e).__name__}: {e}"
+            self.record(kind, key, req, {"error": error})
+            raise CassetteError(error) from e
+
+    def call(self, kind, key, req, real):
+        """回放 key 对应的结果；没录过 (或 record 模式) 时调用 real() 得到可 JSON 序列化的结果并录下"""
+        res = self.lookup(kind, key, req)
+        if res is not None:
+            return res
+        res = self.real_call(kind, key, req, real)
+        self.record(kind, key, req, res)
+        return res
+
+    def summary(self):
+        """{kind: 条数}"""
+        return dict(Counter(e["kind"] for e in self.entries))
+
+# --- 当前生效的 cassette ---
+
+_active = None
+_env_checked = False
+_active_lock = threading.Lock()
+
+def current():
+    """当前生效的 cassette；第一次调用时按环境变量 OONCE_CASSETTE / OONCE_CASSETTE_MODE 打开，没设置返回 None"""
+    global _active, _env_checked
+    if not _env_checked:
+        with _active_lock:
+            if not _env_checked:
+                path = os.environ.get("OONCE_CASSETTE", "")
+                if path and _active is None:
+                    _active = Cassette(path, os.environ.get("OONCE_CASSETTE_MODE", "auto"))
+                    if _active.mode != "replay": atexit.register(_active.save)
+                _env_checked = True
+    return _active
+
+@contextmanager
+def use(path, mode="auto"):
+    """在 with 块内启用 cassette (覆盖环境变量的设置)，退出时保存录下的内容"""
+    global _active, _env_checked
+    cassette = Cassette(path, mode)
+    with _active_lock:
+        previous, _active, _env_checked = _active, cassette, True
+    try:
+        yield cassette
+    finally:
+        with _active_lock:
+            _active = previous
+        if mode != "replay": cassette.save()
+
+# --- HTTP (requests 接口) ---
+
+class Response:
+    """录下的 HTTP 响应 (requests.Response 用到的那部分接口)"""
+
+    def __init__(self, status_code, text="", lines=None):
+        self.status_code = status_code
+        self.text = text
+        self._lines = lines
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        for line in self._lines if self._lines is not None else self.text.splitlines():
+            yield line if decode_unicode else line.encode("utf-8")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _Tee:
+    """真实的流式响应：逐行照常交给调用方，同时记下每一行，完整读完后再录进 cassette。
+    调用方中途停止读取或读取出错时不录 (半截的流回放出来没有意义)，下次还会真实调用"""
+
+    def __init__(self, response, on_complete):
+        self._response = response
+        self._on_complete = on_complete
+        self.status_code = response.status_code
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        lines = []
+        for line in self._response.iter_lines(chunk_size=chunk_size, decode_unicode=True):
+            if isinstance(line, bytes): line = line.decode("utf-8")     # 响应没声明编码时 requests 不解码
+            lines.append(line)
+            yield line if decode_unicode else line.encode("utf-8")
+        self._on_complete({"status": self.status_code, "lines": lines})
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def _capture(response):
+    """真实的非流式响应 (或流式请求返回的错误状态) -> 可录下的 dict"""
+    with response:
+        return {"status": response.status_code, "text": response.text}
+
+class HTTP:
+    """requests 模块的替身：有 cassette 时走录制/回放，没有时直接调用 real (requests)"""
+
+    def __init__(self, real_factory):
+        self._real_factory = real_factory
+        self._real = None
+
+    @property
+    def real(self):
+        if self._real is None: self._real = self._real_factory()
+        return self._real
+
+    def _request(self, method, url, data=None, stream=False, **kwargs):
+        def send():
+            fn = getattr(self.real, method)
+            return fn(url, data=data, stream=stream, **kwargs) if method == "post" else fn(url, stream=stream, **kwargs)
+        cassette = current()
+        if cassette is None:
+            return send()
+        body = data if isinstance(data, bytes) else str(data or kwargs.get("json") or "").encode("utf-8")
+        key = _digest("http", method, redact(url), kwargs.get("params"), body)
+        req = {"method": method.upper(), "url": redact(url), "bytes": len(body)}
+        if not stream:
+            res = cassette.call("http", key, req, lambda: _capture(send()))
+            return Response(res["status"], res.get("text", ""), res.get("lines"))
+        res = cassette.lookup("http", key, req)
+        if res is not None:
+            return Response(res["status"], res.get("text", ""), res.get("lines"))
+        response = cassette.real_call("http", key, req, send)
+        if response.status_code != 200:
+            res = _capture(response)
+            cassette.record("http", key, req, res)
+            return Response(res["status"], res["text"])
+        # 流式：边读边交给调用方 (News Agent 逐字显示)，读完再录
+        return _Tee(response, lambda res: cassette.record("http", key, req, res))
+
+    def get(self, url, **kwargs):
+        return self._request("get", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self._request("post", url, data=data, **kwargs)
+
+def _requests():
+    import requests
+    return requests
+
+def http():
+    """给 GeminiClient 用的 HTTP 客户端 (requests 第一次真实请求时才导入)"""
+    return HTTP(_requests)
+
+# --- yfinance ---
+
+def _frame_to_json(df):
+    cols = [list(c) if isinstance(c, tuple) else c for c in df.columns]
+    return {"index": [ts.isoformat() if hasattr(ts, "isoformat") else str(ts) for ts in df.index],
+            "index_name": df.index.name, "columns": cols, "data": df.to_numpy().tolist()}
+
+def _frame_from_json(obj):
+    import pandas as pd
+    cols = obj["columns"]
+    columns = pd.MultiIndex.from_tuples([tuple(c) for c in cols]) if cols and isinstance(cols[0], list) else cols
+    index = pd.to_datetime(pd.Index(obj["index"], dtype=object), format="ISO8601", utc=False) if obj["index"] else pd.DatetimeIndex([])
+    index.name = obj.get("index_name")
+    return pd.DataFrame(obj["data"] or None, index=index, columns=columns)
+
+class _Ticker:
+    def __init__(self, yf, symbol):
+        self._yf, self.symbol = yf, symbol
+
+    def history(self, **kwargs):
+        return self._yf._frame("yf.history", (self.symbol,), kwargs, lambda: self._yf.real.Ticker(self.symbol).history(**kwargs))
+
+class YFinance:
+    """yfinance 模块的替身 (download / Ticker().history)，有 cassette 时走录制/回放，回放时不需要安装 yfinance"""
+
+    @property
+    def real(self):
+        import yfinance
+        return yfinance
+
+    def _frame(self, kind, args, kwargs, real):
+        cassette = current()
+        if cassette is None:
+            return real()
+        key = _digest(kind, args, kwargs)
+        req = {"args": [str(a) for a in args], **{k: str(v) for k, v in kwargs.items()}}
+        return _frame_from_json(cassette.call(kind, key, req, lambda: {"frame": _frame_to_json(real())})["frame"])
+
+    def download(self, tickers, **kwargs):
+        return self._frame("yf.download", (tickers,), kwargs, lambda: self.real.download(tickers, **kwargs))
+
+    def Ticker(self, symbol):
+        return _Ticker(self, symbol)
+
+yfinance = YFinance()
+
+# --- 搜索 (DDGS 接口) ---
+
+class Search:
+    """DDGS 接口的替身：有 cassette 时走录制/回放，真实后端 (factory()) 用到时才创建"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._backend = None
+
+    def _call(self, kind, keywords, **kwargs):
+        def real():
+            if self._backend is None: self._backend = self._factory()
+            return list(getattr(self._backend, kind)(keywords=keywords, **kwargs))
+        cassette = current()
+        if cassette is None:
+            return real()
+        key = _digest("search", kind, keywords, kwargs)
+        return cassette.call(f"search.{kind}", key, dict(kwargs, keywords=keywords), lambda: {"items": real()})["items"]
+
+    def news(self, keywords, **kwargs):
+        return self._call("news", keywords, **kwargs)
+
+    def text(self, keywords, **kwargs):
+        return self._call("text", keywords, **kwargs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看 cassette 文件里录下的外部调用")
+    parser.add_argument("path")
+    parser.add_argument("--list", action="store_true", help="逐条列出")
+    args = parser.parse_args(argv)
+    cassette = Cassette(args.path, "replay")
+    print(f"📼 {args.path}: {len(cassette.entries)} 条, {os.path.getsize(args.path) / 1024:,.1f} KB")
+    for kind, n in sorted(cassette.summary().items()):
+        print(f"   {kind:<16} {n}")
+    if args.list:
+        for e in cassette.entries:
+            print(f"{e['kind']:<16} {e['key']}  {json.dumps(e['req'], ensure_ascii=False)[:120]}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
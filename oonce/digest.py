@@ -0,0 +1,139 @@
+"""每日日报定时任务：扫描 → 去重入库 → 生成文章，结果写到 digests/ 供 News Agent 页面直接打开
+
+用法:
+    python -m oonce.digest                     # 立即跑一次 (适合 cron)
+    python -m oonce.digest --at 06:30          # 常驻进程，每天 06:30 跑一次
+    python -m oonce.digest --offline           # 桩搜索 + 桩 LLM，不联网
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from oonce import gemini, news, summary, trace
+
+DIGEST_DIR = "digests"
+
+def _atomic_write(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def write_digest(article, items, history_fact, out_dir=DIGEST_DIR):
+    """每次运行一个目录 (article.md + sources.json)，latest.json 指向最新一次"""
+    now = datetime.datetime.now()
+    run_id = now.strftime("%Y-%m-%d_%H%M%S")
+    run_dir = os.path.join(out_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    _atomic_write(os.path.join(run_dir, "article.md"), article)
+    _atomic_write(os.path.join(run_dir, "sources.json"), json.dumps(items, ensure_ascii=False, indent=2))
+    meta = {
+        "run_id": run_id,
+        "generated_at": now.isoformat(timespec="seconds"),
+        "history_fact": history_fact,
+        "item_count": len(items),
+        "article": os.path.join(run_id, "article.md"),
+        "sources": os.path.join(run_id, "sources.json"),
+    }
+    _atomic_write(os.path.join(out_dir, "latest.json"), json.dumps(meta, ensure_ascii=False, indent=2))
+    summary.put("news.latest_digest", {k: meta[k] for k in ("run_id", "generated_at", "item_count")})
+    return meta
+
+def load_latest_digest(out_dir=DIGEST_DIR):
+    """读取最近一次预生成的日报，没有则返回 None"""
+    try:
+        with open(os.path.join(out_dir, "latest.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(out_dir, meta["article"]), encoding="utf-8") as f:
+            article = f.read()
+        with open(os.path.join(out_dir, meta["sources"]), encoding="utf-8") as f:
+            sources = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+    return dict(meta, article=article, sources=sources)
+
+def run_digest(topics, selected_media, check_embassy, llm, backend_factory=None,
+               out_dir=DIGEST_DIR, db_path=None, token_budget=None, log=print):
+    """跑一遍完整流水线：趣闻与搜索并行，文章只基于新增资讯。无新增时返回 None"""
+    run = trace.begin_run("digest")
+    try:
+        return _run_digest(topics, selected_media, check_embassy, llm, backend_factory,
+                           out_dir, db_path, token_budget, log)
+    finally:
+        trace.end_run(run)
+
+def _run_digest(topics, selected_media, check_embassy, llm, backend_factory,
+                out_dir, db_path, token_budget, log):
+    with ThreadPoolExecutor(max_workers=1) as fact_pool:
+        fact_future = fact_pool.submit(trace.bind(news.get_daily_history_fact), llm, db_path)
+        failed = set()
+        results = news.search_news_smart(topics, selected_media, check_embassy, backend_factory,
+                                         last_runs=news.load_last_runs(topics, db_path), on_progress=log,
+                                         failed_topics=failed)
+        new_items = news.archive_results(results, [t for t in topics if t not in failed], db_path)
+        history_fact = fact_future.result()
+
+    log(f"抓取 {len(results)} 条，新增 {len(new_items)} 条")
+    if failed:
+        log(f"⚠️ 搜索失败的话题 (下次重扫): {', '.join(failed)}")
+    if not new_items:
+        return None
+    article, err = news.generate_viral_article(new_items, history_fact, llm, token_budget)
+    if not article:
+        raise RuntimeError(f"生成失败: {err}")
+    meta = write_digest(article, new_items, history_fact, out_dir)
+    log(f"✅ 日报已写入 {os.path.join(out_dir, meta['article'])}")
+    return meta
+
+def _seconds_until(hhmm):
+    now = datetime.datetime.now()
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return (target - now).total_seconds()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OONCE 南非日报定时生成")
+    parser.add_argument("--topics", nargs="+", default=news.DEFAULT_TOPICS, choices=news.TOPIC_OPTIONS)
+    parser.add_argument("--media", nargs="*", default=news.DEFAULT_MEDIA, choices=list(news.MEDIA_MAP))
+    parser.add_argument("--no-embassy", action="store_true", help="不扫描使领馆公告")
+    parser.add_argument("--out-dir", default=DIGEST_DIR)
+    parser.add_argument("--archive", default=None, help=f"资讯档案路径 (默认 {news.ARCHIVE_DB})")
+    parser.add_argument("--token-budget", type=int, default=news.ARTICLE_TOKEN_BUDGET, help="文章提示词 token 上限")
+    parser.add_argument("--at", metavar="HH:MM", help="常驻运行，每天在该时间生成一次")
+    parser.add_argument("--offline", action="store_true", help="使用桩搜索和桩 LLM (测试用)")
+    args = parser.parse_args(argv)
+
+    if args.offline:
+        from oonce import stubs
+        llm, backend_factory = stubs.stub_llm, stubs.StubSearch
+    else:
+        api_key = gemini.load_api_key()
+        if not api_key:
+            parser.error("未找到 GEMINI_KEY (环境变量或 .streamlit/secrets.toml)")
+        llm, backend_factory = gemini.GeminiClient(api_key, default_model="gemini-pro").complete, None
+
+    run = partial(run_digest, args.topics, args.media, not args.no_embassy, llm, backend_factory,
+                  out_dir=args.out_dir, db_path=args.archive, token_budget=args.token_budget, log=lambda msg: print(msg, flush=True))
+    if not args.at:
+        run()
+        return 0
+
+    while True:
+        wait_s = _seconds_until(args.at)
+        print(f"⏰ 下次运行: {args.at} ({wait_s / 3600:.1f} 小时后)", flush=True)
+        time.sleep(wait_s)
+        try:
+            run()
+        except Exception as e:
+            # 常驻模式下单次失败不退出，第二天继续
+            print(f"❌ 本次运行失败: {e}", file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""疑似重复发票：精确签名 (发票号, 金额) 之外的模糊查重索引
+
+OCR 常见的偏差 ("INV-0012" / "INV0012" / "1NV-12"、金额差几分、名称少个字母) 精确签名抓不到。
+索引按三种方式分块，查询只看命中的小块，不扫整本台账:
+
+    发票号键      去掉符号、易混字符统一 (O->0, I/L->1, S->5, B->8, Z->2)、数字去前导零
+    数字键        发票号里的数字部分 (>= 4 位)，前缀被漏识别时用，需名称相近
+    名称三元组    名称去掉 (PTY) LTD 之类后缀后的三字母组，倒排到 "名称"，每个名称下按金额排序；
+                  名称里的数字不同视为不同公司 (SUPPLIER 0001 / 0002)，倒排按名称里的数字再分一层；
+                  找相近名称用前缀过滤：Jaccard >= t 的名称必然含查询里最稀有的 |q| - ceil(t|q|) + 1 个三元组之一
+
+判定 (任一成立即为疑似重复):
+    发票号键相同 且 金额在容差内
+    数字键相同 且 名称相近 且 金额在容差内
+    名称相近 且 金额在容差内 且 日期在 ±DATE_DAYS 天内
+"""
+import math
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import pandas as pd
+
+from oonce import trace
+
+AMOUNT_TOL = 0.05       # 金额绝对容差
+AMOUNT_REL = 0.001      # 金额相对容差 (取两者较大)
+DATE_DAYS = 3
+NAME_SIM = 0.6          # 名称三元组 Jaccard 相似度
+MIN_DIGITS = 4
+POSSIBLE_DUPLICATE = "⚠️ POSSIBLE DUPLICATE"
+NO_DATE = -10 ** 9
+
+_CONFUSABLE = str.maketrans("OILSBZ", "011582")
+_LEGAL = re.compile(r"\b(?:PTY|PROPRIETARY|LTD|LIMITED|CC|INC|CO|COMPANY|THE|T/A)\b")
+
+_cache = {}     # (台账路径, 名称列) -> (版本, 索引)
+_cache_lock = threading.Lock()     # 只保护 _key_locks 字典
+_key_locks = {}  # (台账路径, 名称列) -> 该台账的加载锁
+
+def invoice_key(inv_no):
+    key = re.sub(r"[^A-Z0-9]", "", str(inv_no).upper()).translate(_CONFUSABLE)
+    return re.sub(r"(?<![0-9])0+(?=[0-9])", "", key)
+
+def digits_key(inv_no):
+    digits = re.sub(r"\D", "", str(inv_no)).lstrip("0")
+    return digits if len(digits) >= MIN_DIGITS else ""
+
+def name_key(name):
+    name = _LEGAL.sub(" ", re.sub(r"[^A-Z0-9/ ]", " ", str(name).upper()))
+    return " ".join(name.split())
+
+def grams(name):
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _day(date):
+    try:
+        return datetime.strptime(str(date)[:10], "%Y-%m-%d").toordinal()
+    except ValueError:
+        return NO_DATE
+
+def _tolerance(total):
+    return max(AMOUNT_TOL, abs(total) * AMOUNT_REL)
+
+class DuplicateIndex:
+    def __init__(self):
+        self.rows = []          # 行号 -> (发票号, 名称, 金额, 日期序数)
+        self.by_key = {}        # 发票号键 -> [行号]
+        self.by_digits = {}     # 数字键 -> [行号]
+        self.by_name = {}       # 名称键 -> ([金额 (升序)], [行号])
+        self.name_grams = {}    # 名称键 -> 三元组集合
+        self.postings = {}      # (名称里的数字, 三元组) -> {名称键}
+        self._similar = {}      # 查询名称键 -> [相近名称键]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, inv_no, name, total, date):
+        with self._lock:
+            self._add(str(inv_no).strip().upper(), str(name).strip().upper(), float(total), _day(date))
+
+    def _add(self, inv_no, name, total, day, key=None, digits=None, nkey=None):
+        i = len(self.rows)
+        self.rows.append((inv_no, name, total, day))
+        key = invoice_key(inv_no) if key is None else key
+        digits = digits_key(inv_no) if digits is None else digits
+        nkey = name_key(name) if nkey is None else nkey
+        if key and inv_no != "UNKNOWN": self.by_key.setdefault(key, []).append(i)
+        if digits: self.by_digits.setdefault(digits, []).append(i)
+        if nkey not in self.by_name:
+            self.by_name[nkey] = ([], [])
+            self.name_grams[nkey] = grams(nkey)
+            block = re.sub(r"\D", "", nkey)
+            for g in self.name_grams[nkey]:
+                self.postings.setdefault((block, g), set()).add(nkey)
+            self._similar.clear()
+        totals, ids = self.by_name[nkey]
+        pos = bisect_right(totals, total)
+        totals.insert(pos, total); ids.insert(pos, i)
+
+    @trace.traced("duplicates.index")
+    def add_frame(self, df, entity_col):
+        """批量加入台账行 (发票号/名称的规范化用向量化字符串操作)"""
+        if df is None or df.empty:
+            return
+        inv_nos = df["Invoice No"].fillna("").astype(str).str.strip().str.upper() if "Invoice No" in df else pd.Series("", index=df.index)
+        names = df[entity_col].fillna("").astype(str).str.strip().str.upper() if entity_col in df else pd.Series("", index=df.index)
+        totals = pd.to_numeric(df["Total"].astype(str).str.replace(",", ""), errors="coerce").fillna(0.0) if "Total" in df else pd.Series(0.0, index=df.index)
+        dates = pd.to_datetime(df["Date"], errors="coerce", format="ISO8601") if "Date" in df else pd.Series(pd.NaT, index=df.index)
+        days = dates.map(lambda d: NO_DATE if pd.isna(d) else d.toordinal())
+        keys = (inv_nos.str.replace(r"[^A-Z0-9]", "", regex=True).str.translate(_CONFUSABLE)
+                .str.replace(r"(?<![0-9])0+(?=[0-9])", "", regex=True))
+        digits = inv_nos.str.replace(r"\D", "", regex=True).str.lstrip("0")
+        digits = digits.where(digits.str.len() >= MIN_DIGITS, "")
+        nkeys = names.map({n: name_key(n) for n in names.unique()})
+        with self._lock:
+            for row in zip(inv_nos, names, totals, days, keys, digits, nkeys):
+                self._add(*row)
+
+    def similar_names(self, nkey):
+        """三元组 Jaccard >= NAME_SIM 的已知名称 (按查询名称缓存)"""
+        if nkey in self._similar:
+            return self._similar[nkey]
+        out = [nkey] if nkey in self.by_name else []
+        query, block = grams(nkey), re.sub(r"\D", "", nkey)
+        rare = sorted(query, key=lambda g: len(self.postings.get((block, g), ())))
+        candidates = set()
+        for g in rare[:len(query) - math.ceil(NAME_SIM * len(query)) + 1]:
+            candidates.update(self.postings.get((block, g), ()))
+        for other in candidates:
+            if other == nkey: continue
+            other_grams = self.name_grams[other]
+            if len(query & other_grams) / len(query | other_grams) >= NAME_SIM:
+                out.append(other)
+        self._similar[nkey] = out
+        return out
+
+    def lookup(self, inv_no, name, total, date, limit=3):
+        """疑似重复的已有行 [(行号, 原因)]，按把握从高到低"""
+        inv_no = str(inv_no).strip().upper()
+        total, day, tol = float(total), _day(date), _tolerance(float(total))
+        hits = {}
+        with self._lock:
+            key = invoice_key(inv_no)
+            if key and inv_no != "UNKNOWN":
+                for i in self.by_key.get(key, ()):
+                    if abs(self.rows[i][2] - total) <= tol: hits.setdefault(i, "invoice_no")
+            names = self.similar_names(name_key(name))
+            digits = digits_key(inv_no)
+            if digits:
+                similar = set(names)
+                for i in self.by_digits.get(digits, ()):
+                    if abs(self.rows[i][2] - total) <= tol and name_key(self.rows[i][1]) in similar:
+                        hits.setdefault(i, "invoice_digits")
+            if day != NO_DATE:
+                for n in names:
+                    totals, ids = self.by_name[n]
+                    for pos in range(bisect_left(totals, total - tol), bisect_right(totals, total + tol)):
+                        i = ids[pos]
+                        if abs(self.rows[i][3] - day) <= DATE_DAYS: hits.setdefault(i, "amount_date")
+                        if len(hits) >= limit * 4: break
+                    if len(hits) >= limit * 4: break
+        return sorted(hits.items(), key=lambda kv: ("invoice_no", "invoice_digits", "amount_date").index(kv[1]))[:limit]
+
+    def describe(self, row_id):
+        inv_no, name, total, _ = self.rows[row_id]
+        return f"{inv_no} / {name} / {total:,.2f}"
+
+@trace.traced("duplicates.load")
+def load_index(ledger, entity_col):
+    """台账的疑似重复索引。按台账版本缓存，只有追加时增量加入新行；返回的索引只读，同批次的新行另建索引"""
+    cache_key = (ledger.path, entity_col)
+    usecols = lambda c: c in ("Invoice No", entity_col, "Total", "Date")
+    with _cache_lock:
+        key_lock = _key_locks.setdefault(cache_key, threading.Lock())
+    # 每本台账各自一把锁：大台账全量重读时不挡其他台账/工作区的查重
+    with key_lock:
+        cached = _cache.get(cache_key)
+        with ledger.lock(shared=True):
+            version = ledger.version()
+            if version is None:
+                return DuplicateIndex()
+            if cached and cached[0] == version:
+                return cached[1]
+            tail = ledger.read_since(cached[0], usecols=usecols, dtype=str) if cached else None
+            df = ledger.read(usecols=usecols, dtype=str) if tail is None else None
+        index = cached[1] if tail is not None else DuplicateIndex()
+        index.add_frame(tail if tail is not None else df, entity_col)
+        _cache[cache_key] = (version, index)
+    return index
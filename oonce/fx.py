@@ -0,0 +1,346 @@
+"""汇率来源 (可替换)。默认走 Yahoo Finance，测试时传入任意带同名方法的对象
+
+    YahooFX / FixedFX      数据源：{币种}=X 为 1 USD 兑该币种 (ZAR=X 即 USD→ZAR)
+    RateMatrix             本地缓存的每日汇率矩阵 (SQLite，所有页面、工作区、后台进程共用)，任意两种货币按同一天交叉换算；
+                           历史汇率每个币种每段日期只从数据源拉一次，批量换算用 numpy 向量化
+    historical_rate(s)     在任意 FX 对象上查汇率：RateMatrix 直接算；只有 historical_zar_rate 的老对象只支持 USD→ZAR
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+from oonce import trace
+
+BOOK_CURRENCY = "ZAR"       # 台账记账本位币
+FX_DB = "oonce_fx.db"
+MAX_STALE_DAYS = 7          # 周末/假日取之前最近一个交易日的汇率，最多往前找这么多天
+MISS_TTL = 600              # 数据源没给数据的日期段，这么多秒后才再请求
+TODAY_TTL = 900             # 今天的汇率 (还没收盘) 取过之后这么多秒内不再请求
+_EPOCH = date(1970, 1, 1)
+_ALIASES = {"R": "ZAR", "RAND": "ZAR", "RANDS": "ZAR", "$": "USD", "US$": "USD", "US DOLLAR": "USD",
+            "€": "EUR", "EURO": "EUR", "RMB": "CNY", "¥": "CNY", "YUAN": "CNY", "£": "GBP"}
+
+def normalize_currency(value, default=BOOK_CURRENCY):
+    """模型/导出文件里的币种写法 -> ISO 代码 (US$、$ -> USD；R -> ZAR；RMB -> CNY)，空白记 default"""
+    code = str(value or "").strip().upper()
+    if not code or code == "NAN": return default
+    if code in _ALIASES: return _ALIASES[code]
+    if "USD" in code: return "USD"      # 兼容原来的 "USD" in currency 判断
+    m = re.search(r"\b[A-Z]{3}\b", code)
+    return m.group(0) if m else code
+
+def normalize_currencies(series, default=BOOK_CURRENCY):
+    """normalize_currency 的批量版 (只处理不同的写法)"""
+    return series.map({v: normalize_currency(v, default) for v in series.unique()})
+
+def _day(value):
+    """日期 -> 1970-01-01 起的天数"""
+    return (datetime.strptime(str(value)[:10], "%Y-%m-%d").date() - _EPOCH).days
+
+def _days(dates):
+    """日期数组 (字符串/date/datetime64) -> 天数 int64 数组，认不出的记 -1"""
+    import numpy as np
+    import pandas as pd
+    values = np.asarray(dates)
+    if not np.issubdtype(values.dtype, np.datetime64):
+        codes, uniques = pd.factorize(values)       # 台账里不同的日期只有几千个，只解析这些
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce", format="ISO8601").to_numpy()
+        values = np.append(parsed, np.datetime64("NaT"))[codes]      # codes 为 -1 (空值) 的取到末尾的 NaT
+    nat = np.isnat(values)
+    days = values.astype("datetime64[D]").astype("int64")
+    days[nat] = -1
+    return days
+
+class YahooFX:
+    """Yahoo Finance 汇率 (默认 USD→ZAR，ZAR=X)"""
+    ticker = "ZAR=X"
+
+    def historical_zar_rate(self, date_str):
+        """发票日期当天 (或之前最近交易日) 的收盘价，查不到返回 None"""
+        from oonce.cassette import yfinance as yf     # 设置了 cassette 时走录制/回放
+        try:
+            inv_date = datetime.strptime(date_str, "%Y-%m-%d")
+            start_date = inv_date - timedelta(days=5)
+            end_date = inv_date + timedelta(days=1)
+            with trace.span("fx.historical", date=date_str):
+                trace.incr("api_calls")
+                data = yf.download(self.ticker, start=start_date, end=end_date, progress=False)
+            if not data.empty: return float(data['Close'].iloc[-1])
+            return None
+        except Exception: return None
+
+    def live_zar_rate(self):
+        """最新收盘价，查不到返回 None"""
+        return self.live_usd_rate("ZAR")
+
+    def live_usd_rate(self, currency):
+        """1 USD 兑 currency 的最新收盘价，查不到返回 None"""
+        from oonce.cassette import yfinance as yf
+        try:
+            with trace.span("fx.live", currency=currency):
+                trace.incr("api_calls")
+                data = yf.Ticker(f"{currency}=X").history(period="1d")
+            if not data.empty: return float(data['Close'].iloc[-1])
+        except Exception: pass
+        return None
+
+    def history(self, currency, start, end):
+        """[start, end] 每个交易日 1 USD 兑 currency 的收盘价 {YYYY-MM-DD: 汇率}，查不到返回 {}"""
+        from oonce.cassette import yfinance as yf
+        try:
+            with trace.span("fx.history", currency=currency, start=str(start), end=str(end)):
+                trace.incr("api_calls")
+                data = yf.download(f"{currency}=X", start=start, end=end + timedelta(days=1), progress=False)
+            if data.empty: return {}
+            close = data['Close']
+            if hasattr(close, "columns"): close = close.iloc[:, 0]    # 新版 yfinance 返回多级列
+            return {d.strftime("%Y-%m-%d"): float(v) for d, v in close.dropna().items()}
+        except Exception: return {}
+
+class FixedFX:
+    """固定汇率 (离线/基准测试用)。rates 为其他币种 "1 USD = x"，如 {"EUR": 0.92}"""
+
+    def __init__(self, rate=18.5, rates=None):
+        self.rate = rate
+        self.table = dict(rates or {}, ZAR=rate, USD=1.0)
+
+    def historical_zar_rate(self, date_str):
+        return self.rate
+
+    def live_zar_rate(self):
+        return self.rate
+
+    def live_usd_rate(self, currency):
+        return self.table.get(currency)
+
+    def history(self, currency, start, end):
+        if currency not in self.table: return {}
+        days = (end - start).days + 1
+        return {(start + timedelta(days=i)).strftime("%Y-%m-%d"): self.table[currency] for i in range(days)}
+
+# --- 汇率矩阵 ---
+
+def open_fx(db_path=None):
+    conn = sqlite3.connect(db_path or FX_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS rates (currency TEXT, day TEXT, usd_rate REAL, PRIMARY KEY (currency, day));
+        CREATE TABLE IF NOT EXISTS coverage (currency TEXT PRIMARY KEY, first TEXT, last TEXT, fetched REAL);
+    """)
+    return conn
+
+class RateMatrix:
+    """每日汇率矩阵：内部以 USD 为枢轴存 "1 USD = x 币种"，base→quote = x(quote) / x(base)。
+
+    coverage 表记每个币种已经拉过的连续日期区间，区间外的日期才去数据源补 (一次拉整段)；
+    今天的汇率不算已覆盖，过了 TODAY_TTL 再去取收盘价。接口兼容 YahooFX (historical_zar_rate / live_zar_rate)。
+    """
+
+    def __init__(self, source=None, db_path=None):
+        self.source = source or YahooFX()
+        self.db_path = db_path or FX_DB
+        self._series = {}       # 币种 -> (天数数组, 汇率数组)，按需从库里加载
+        self._missed = {}       # (币种, 起, 止) -> 数据源没给数据的时间，MISS_TTL 秒内不反复请求
+        self._lock = threading.Lock()
+
+    def forget_misses(self):
+        """清掉"数据源没给数据"的记录 (重处理汇率 Error 行之前调用，马上重新请求)"""
+        with self._lock:
+            self._missed.clear()
+
+    def _today_fresh(self, conn, currency):
+        """今天的汇率在 TODAY_TTL 秒内取过 (同一天的发票不用每次都去数据源)"""
+        row = conn.execute("SELECT fetched FROM coverage WHERE currency = ?", (currency,)).fetchone()
+        fetched = row[0] if row else None
+        return bool(fetched) and time.time() - fetched < TODAY_TTL and date.fromtimestamp(fetched) == date.today()
+
+    def _coverage(self, conn, currency):
+        row = conn.execute("SELECT first, last FROM coverage WHERE currency = ?", (currency,)).fetchone()
+        return (_day(row[0]), _day(row[1])) if row else None
+
+    def ensure(self, currency, first, last):
+        """保证 currency 在 [first, last] (天数) 之间的汇率已在库里 (前面多取 MAX_STALE_DAYS 天给周末/假日用)。
+        向数据源请求时不持锁 (慢请求不挡其他币种/日期的查询)，写库前重新读一次已覆盖区间再合并"""
+        if currency == "USD" or first > last:
+            return
+        first, today = first - MAX_STALE_DAYS, (date.today() - _EPOCH).days
+        last = min(last, today)
+        with closing(open_fx(self.db_path)) as conn:
+            have = self._coverage(conn, currency)
+            if have and have[0] <= first and last <= have[1]:
+                return
+            if have is None: ranges = [(first, last)]
+            else: ranges = [r for r in ((first, have[0] - 1), (have[1] + 1, last)) if r[0] <= r[1]]
+            for start, end in ranges:
+                if start == end == today and self._today_fresh(conn, currency):
+                    continue
+                with self._lock:
+                    missed = self._missed.get((currency, start, end))
+                    if missed and time.time() - missed < MISS_TTL: continue
+                data = self.source.history(currency, _EPOCH + timedelta(days=start), _EPOCH + timedelta(days=end))
+                if not data:
+                    with self._lock: self._missed[(currency, start, end)] = time.time()
+                    continue
+                with self._lock, conn:
+                    conn.executemany("INSERT OR REPLACE INTO rates (currency, day, usd_rate) VALUES (?, ?, ?)",
+                                     [(currency, d, r) for d, r in data.items()])
+                    lo, hi = start, min(end, today - 1)
+                    have = self._coverage(conn, currency)      # 请求期间别的线程/进程可能已经扩过
+                    if have and lo <= have[1] + 1 and hi >= have[0] - 1: lo, hi = min(lo, have[0]), max(hi, have[1])
+                    elif have: lo, hi = have        # 不相连 (不应出现)：只存汇率，不改覆盖区间
+                    # fetched 记的是最近一次取到今天的时间 (今天的汇率不算已覆盖，靠它判断要不要再取)
+                    row = conn.execute("SELECT fetched FROM coverage WHERE currency = ?", (currency,)).fetchone()
+                    fetched = time.time() if end >= today else (row[0] if row else None)
+                    conn.execute("INSERT OR REPLACE INTO coverage (currency, first, last, fetched) VALUES (?, ?, ?, ?)",
+                                 (currency, str(_EPOCH + timedelta(days=lo)), str(_EPOCH + timedelta(days=hi)), fetched))
+                    self._missed.pop((currency, start, end), None)
+                    self._series.pop(currency, None)
+
+    def _load(self, currency):
+        import numpy as np
+        with self._lock:
+            if currency not in self._series:
+                with closing(open_fx(self.db_path)) as conn:
+                    rows = conn.execute("SELECT day, usd_rate FROM rates WHERE currency = ? ORDER BY day", (currency,)).fetchall()
+                days = _days([d for d, _ in rows]) if rows else np.empty(0, dtype="int64")
+                self._series[currency] = (days, np.array([r for _, r in rows], dtype=float))
+            return self._series[currency]
+
+    def usd_rates(self, currency, days):
+        """每个日期 1 USD 兑 currency 的汇率 (当天没有取之前最近的交易日，超过 MAX_STALE_DAYS 记 NaN)。
+        先给 [最早, 最晚] 之间的每一天查一次，再按天数下标取值，百万行也只做一次 gather"""
+        import numpy as np
+        valid = days >= 0
+        out = np.full(len(days), np.nan)
+        known, rates = (None, None) if currency == "USD" else self._load(currency)
+        if not valid.any() or (known is not None and not len(known)):
+            return out
+        lo, hi = int(days[valid].min()), int(days[valid].max())
+        span = np.arange(lo, hi + 1)
+        if known is None:
+            dense = np.ones(len(span))
+        else:
+            pos = np.searchsorted(known, span, side="right") - 1
+            fresh = (pos >= 0) & (span - known[np.clip(pos, 0, None)] <= MAX_STALE_DAYS)
+            dense = np.where(fresh, rates[np.clip(pos, 0, None)], np.nan)
+        out[valid] = dense[days[valid] - lo]
+        return out
+
+    @trace.traced("fx.rates")
+    def rates(self, dates, bases, quote=BOOK_CURRENCY):
+        """向量化：每行 base→quote 在该日期的汇率 (numpy 数组，查不到为 NaN)。bases 可为单个币种"""
+        import numpy as np
+        import pandas as pd
+        days = _days(dates)
+        if isinstance(bases, str): codes, currencies = np.zeros(len(days), dtype="int64"), [bases]
+        else: codes, currencies = pd.factorize(np.asarray(bases, dtype=object))
+        valid = days >= 0
+        out = np.full(len(days), np.nan)
+        if not valid.any():
+            return out
+        foreign = {c for c in currencies if c != quote}     # base == quote 恒为 1，不用取任何汇率
+        for c in foreign | ({quote} if foreign else set()):
+            self.ensure(c, int(days[valid].min()), int(days[valid].max()))
+        quote_rates = self.usd_rates(quote, days) if foreign else None
+        for i, c in enumerate(currencies):
+            m = codes == i
+            out[m] = np.where(valid[m], 1.0, np.nan) if c == quote else quote_rates[m] / self.usd_rates(c, days[m])
+        return out
+
+    def convert(self, amounts, dates, base, quote=BOOK_CURRENCY):
+        """整列换算 amounts (base 可为每行的币种) -> quote，查不到汇率的为 NaN"""
+        import numpy as np
+        return np.asarray(amounts, dtype=float) * self.rates(dates, base, quote)
+
+    def historical_rate(self, date_str, base, quote=BOOK_CURRENCY):
+        rate = self.rates([date_str], [base], quote)[0]
+        return None if rate != rate else float(rate)
+
+    def historical_zar_rate(self, date_str):
+        return self.historical_rate(date_str, "USD", "ZAR")
+
+    def live_rate(self, base, quote=BOOK_CURRENCY):
+        """base→quote 最新汇率；数据源取不到时用库里最近的一天"""
+        rates = {}
+        for c in {base, quote} - {"USD"}:
+            rates[c] = getattr(self.source, "live_usd_rate", lambda _: None)(c)
+            if not rates[c]:
+                known, values = self._load(c)
+                rates[c] = float(values[-1]) if len(values) else None
+        if any(v is None for v in rates.values()):
+            return None
+        return rates.get(quote, 1.0) / rates.get(base, 1.0)
+
+    def live_zar_rate(self):
+        return self.live_rate("USD", "ZAR")
+
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+def get_rate_matrix(source=None, db_path=None):
+    """进程内按库文件单例 (页面、后台任务共用同一份内存缓存)"""
+    key = os.path.abspath(db_path or FX_DB)
+    with _matrices_lock:
+        if key not in _matrices:
+            _matrices[key] = RateMatrix(source, db_path)
+        return _matrices[key]
+
+def historical_rate(fx, date_str, base, quote=BOOK_CURRENCY):
+    """任意 FX 对象上查 base→quote 的历史汇率，查不到返回 None"""
+    if base == quote: return 1.0
+    if callable(getattr(fx, "historical_rate", None)): return fx.historical_rate(date_str, base, quote)
+    if (base, quote) == ("USD", "ZAR"): return fx.historical_zar_rate(date_str)
+    return None
+
+def historical_rates(fx, dates, bases, quote=BOOK_CURRENCY):
+    """historical_rate 的批量版 (numpy 数组，查不到为 NaN)。老 FX 对象按 (日期, 币种) 去重后逐个查"""
+    import numpy as np
+    if callable(getattr(fx, "rates", None)):
+        return fx.rates(dates, bases, quote)
+    pairs = list(zip(dates, bases))
+    found = {p: historical_rate(fx, p[0], p[1], quote) for p in set(pairs)}
+    return np.array([found[p] or np.nan for p in pairs], dtype=float)
+
+def live_rate(fx, base, quote=BOOK_CURRENCY):
+    if base == quote: return 1.0
+    if callable(getattr(fx, "live_rate", None)): return fx.live_rate(base, quote)
+    if (base, quote) == ("USD", "ZAR"): return fx.live_zar_rate()
+    return None
+
+class CachedLiveRate:
+    """进程级实时汇率缓存：peek() 立即返回上次的值 (还没有则 None)，过期时在后台线程刷新，页面渲染不等网络"""
+
+    def __init__(self, fx, ttl=900, base="USD", quote=BOOK_CURRENCY):
+        self.fx = fx
+        self.ttl = ttl
+        self.base, self.quote = base, quote
+        self._rate = None
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _refresh(self):
+        try:
+            rate = live_rate(self.fx, self.base, self.quote)
+            with self._lock:
+                if rate: self._rate = rate
+                self._fetched = time.monotonic()
+        finally:
+            self._refreshing = False
+
+    def peek(self):
+        with self._lock:
+            stale = time.monotonic() - self._fetched > self.ttl or not self._fetched
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, name="oonce-fx-refresh", daemon=True).start()
+            return self._rate
+
+    @property
+    def pending(self):
+        """第一次刷新还没结束"""
+        return not self._fetched
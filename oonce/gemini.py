@@ -0,0 +1,187 @@
+"""Gemini REST 调用 (不依赖 Streamlit，页面和命令行共用)"""
+import base64
+import json
+import os
+import re
+import threading
+import time
+import tomllib
+
+from oonce import trace
+
+GEMINI_BASE = "https://generativelanguage.googleapis.com/v1beta"
+MODEL_CACHE_TTL = 3600
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+def text_part(text):
+    return {"text": text}
+
+def file_part(bytes_data, mime_type):
+    return {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(bytes_data).decode('utf-8')}}
+
+def mime_for(file_name):
+    """上传文件的 MIME：PDF 单独处理，其余按图片发送"""
+    return "application/pdf" if str(file_name).lower().endswith('.pdf') else "image/jpeg"
+
+class RateBudget:
+    """令牌桶：平均每分钟 per_minute 次调用，最多攒 burst 次。多个客户端共用同一个对象即共用额度 (如同一工作区)"""
+
+    def __init__(self, per_minute, burst=None):
+        if per_minute <= 0:
+            raise ValueError(f"per_minute 必须大于 0: {per_minute}")
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=30):
+        """取一个令牌，额度不够时最多等 timeout 秒，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_s = (1 - self.tokens) / self.rate
+            if now + wait_s > deadline:
+                trace.incr("rate_limited")
+                return False
+            trace.incr("rate_waits")
+            time.sleep(wait_s)
+
+class GeminiClient:
+    """可替换的 LLM 客户端。
+
+    prefer: 模型名关键字的优先顺序 (如 ("pro", "flash"))，都找不到时用任意支持 generateContent 的模型，
+    再不行用 default_model。http 默认为 requests 模块 (第一次请求时才导入，设置了 cassette 时走录制/回放)，
+    测试时可传入带 get/post 的替身。
+    budget: 可选的 RateBudget，生成请求先取令牌 (模型列表查询不计)。
+    """
+
+    def __init__(self, api_key, prefer=("flash",), default_model="gemini-1.5-flash",
+                 base_url=GEMINI_BASE, http=None, timeout=60, budget=None):
+        self.api_key = api_key
+        self.prefer = tuple(prefer)
+        self.default_model = default_model
+        self.base_url = base_url
+        self._http = http
+        self.timeout = timeout
+        self.budget = budget
+
+    @property
+    def http(self):
+        if self._http is None:
+            from oonce import cassette
+            self._http = cassette.http()
+        return self._http
+
+    def get_available_model(self):
+        """自动雷达：询问 API 有哪些模型可用，避免 404 (结果缓存 1 小时)"""
+        cache_key = (self.base_url, self.api_key, self.prefer)
+        with _model_cache_lock:
+            cached = _model_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < MODEL_CACHE_TTL:
+            trace.incr("cache_hits")
+            return cached[1]
+
+        url = f"{self.base_url}/models?key={self.api_key}"
+        try:
+            with trace.span("gemini.models") as attrs:
+                trace.incr("api_calls")
+                response = self.http.get(url, timeout=10)
+                attrs["status"] = response.status_code
+            if response.status_code == 200:
+                models = [m for m in response.json().get('models', [])
+                          if 'generateContent' in m.get('supportedGenerationMethods', [])]
+                names = [m['name'].replace('models/', '') for m in models]
+                name = next((n for kw in self.prefer for n in names if kw in n), None)
+                name = name or (names[0] if names else self.default_model)
+                with _model_cache_lock:
+                    _model_cache[cache_key] = (time.monotonic(), name)
+                return name
+        except Exception:
+            pass
+        return self.default_model
+
+    def generate(self, parts, timeout=None):
+        """一次 generateContent 调用，返回 (text, err)"""
+        model_name = self.get_available_model()
+        url = f"{self.base_url}/models/{model_name}:generateContent?key={self.api_key}"
+        headers = {'Content-Type': 'application/json'}
+        payload = {"contents": [{"parts": parts}]}
+
+        body = json.dumps(payload)
+        if self.budget and not self.budget.acquire():
+            return None, "Rate budget exceeded for this workspace, please retry later"
+        try:
+            with trace.span("gemini.generate", model=model_name, bytes_sent=len(body)) as attrs:
+                trace.incr("api_calls"); trace.incr("bytes_sent", len(body))
+                response = self.http.post(url, headers=headers, data=body, timeout=timeout or self.timeout)
+                attrs["status"] = response.status_code
+            if response.status_code != 200:
+                return None, f"API Error {response.status_code} (Model: {model_name}): {response.text}"
+            res_json = response.json()
+            if 'candidates' not in res_json:
+                return None, "No content returned (Safety Block?)"
+            return res_json['candidates'][0]['content']['parts'][0]['text'], None
+        except Exception as e:
+            return None, str(e)
+
+    def complete(self, prompt):
+        """llm(prompt) -> (text, err)，供 oonce.news 等只需纯文本的调用方使用"""
+        return self.generate([text_part(prompt)])
+
+    def stream(self, prompt):
+        """流式接口 (SSE)：边生成边 yield 文本片段，出错抛 RuntimeError"""
+        model_name = self.get_available_model()
+        url = f"{self.base_url}/models/{model_name}:streamGenerateContent?alt=sse&key={self.api_key}"
+        headers = {'Content-Type': 'application/json'}
+        payload = {"contents": [{"parts": [text_part(prompt)]}]}
+
+        body = json.dumps(payload)
+        if self.budget and not self.budget.acquire():
+            raise RuntimeError("Rate budget exceeded for this workspace, please retry later")
+        trace.incr("api_calls"); trace.incr("bytes_sent", len(body))
+        # 连接超时 10 秒；读超时针对相邻两个分片之间的间隔。chunk_size=None 收到即处理，不等凑满缓冲区
+        try:
+            with trace.span("gemini.stream_first_byte", model=model_name):
+                response = self.http.post(url, headers=headers, data=body, stream=True, timeout=(10, self.timeout))
+        except Exception as e:     # 连接失败 / 超时 (requests 的异常) 统一成 RuntimeError
+            raise RuntimeError(f"Connection Error: {e}") from e
+        with response, trace.span("gemini.stream", model=model_name):
+            if response.status_code != 200:
+                raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+            try:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[len("data:"):])
+                    for cand in chunk.get('candidates', [])[:1]:
+                        for part in cand.get('content', {}).get('parts', []):
+                            if part.get('text'): yield part['text']
+            except ValueError as e:     # 分片不是合法 JSON
+                raise RuntimeError(f"Malformed stream chunk: {e}") from e
+            except OSError as e:
+                raise RuntimeError(f"Stream Error: {e}") from e
+
+def extract_json(text, pattern=None):
+    """去掉 ```json 包裹后解析；pattern 用于从长文本中截取 [...] 或 {...}"""
+    clean_text = text.replace('```json', '').replace('```', '').strip()
+    if pattern:
+        match = re.search(pattern, clean_text, re.DOTALL)
+        if not match: return None
+        clean_text = match.group(0)
+    return json.loads(clean_text)
+
+def load_api_key(secrets_path=".streamlit/secrets.toml"):
+    """命令行模式读取 Key：优先环境变量 GEMINI_KEY，其次 Streamlit 的 secrets.toml"""
+    key = os.environ.get("GEMINI_KEY", "")
+    if not key and os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as f:
+            key = tomllib.load(f).get("GEMINI_KEY", "")
+    return key.strip()
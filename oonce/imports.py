@@ -0,0 +1,95 @@
+"""Import Master 核心逻辑：装箱单识别翻译、到岸成本 (关税/VAT/PRN) 计算"""
+from oonce import trace
+from oonce.fx import live_rate
+from oonce.gemini import text_part, file_part, mime_for, extract_json
+
+RATE_MARKUPS = {"USD": 0.3}    # 报关汇率 = 实时汇率 + 加价 (ZAR)；没配置的币种不加价，由用户确认
+FALLBACK_RATE = 18.80    # 查不到实时汇率时的保底值 (USD)
+QUOTE_CURRENCIES = {"USD": "$", "CNY": "¥", "EUR": "€"}    # 供应商报价币种 -> 符号
+
+def has_markup(currency):
+    return currency in RATE_MARKUPS
+
+def rate_with_markup(rate, currency="USD"):
+    """实时汇率 → 报关汇率 (按 RATE_MARKUPS 加价；没配置加价的币种原样返回实时汇率，页面提示用户确认)；
+    没有实时汇率时 USD 用保底值，其他币种返回 None (需手填)"""
+    if rate: return round(rate + RATE_MARKUPS[currency], 2) if has_markup(currency) else round(rate, 4)
+    return FALLBACK_RATE if currency == "USD" else None
+
+def get_live_rate(fx, currency="USD"):
+    return rate_with_markup(live_rate(fx, currency, "ZAR"), currency)
+
+def build_packing_prompt(target_total, currency="USD"):
+    # 强化 Prompt：加入翻译和手写识别指令
+    return f"""
+    You are an expert Import/Export Customs Broker.
+    Task: Analyze the Packing List image (Note: Input may be HANDWRITTEN and in CHINESE).
+
+    CRITICAL INSTRUCTIONS:
+    1. **LANGUAGE**: Detect the language (Chinese/English).
+       - If Chinese, **TRANSLATE** accurately to English.
+       - If English, keep it.
+    2. **FORMAT**: Output the 'description' in **UPPERCASE ONLY** (e.g., "STAINLESS STEEL BOLTS").
+    3. **HS CODE**: Find HS Codes for South Africa with **Duty Rate between 15% and 20%** if possible.
+    4. **PRICING**: Target Total = {currency} {target_total}. Distribute value (unit_price in {currency}).
+
+    Output JSON ONLY:
+    [
+      {{"description": "TRANSLATED ENGLISH ITEM NAME", "quantity": 100, "hs_code": "XXXX.XX", "duty_rate": 15, "unit_price": 10.00}}
+    ]
+    """
+
+@trace.traced("import.analyze")
+def analyze_packing_list(file_name, bytes_data, target_total, llm, currency="USD"):
+    """返回 (行列表, 模型原文/错误信息)。llm 建议优先 Pro 模型 (识别手写更强)；单价按 currency 报价"""
+    parts = [text_part(build_packing_prompt(target_total, currency)), file_part(bytes_data, mime_for(file_name))]
+    text, err = llm.generate(parts)
+    if err: return [], err
+    try:
+        data = extract_json(text, r'\[.*\]')
+    except Exception:
+        data = None
+    return (data, text) if data else ([], text)
+
+def packing_frame(raw_data):
+    """模型返回的行 → DataFrame，数量/单价缺失记 0，税率缺失记 15%"""
+    import pandas as pd
+    init_df = pd.DataFrame(raw_data)
+    init_df['quantity'] = pd.to_numeric(init_df['quantity'], errors='coerce').fillna(0)
+    init_df['unit_price'] = pd.to_numeric(init_df['unit_price'], errors='coerce').fillna(0)
+    init_df['duty_rate'] = pd.to_numeric(init_df['duty_rate'], errors='coerce').fillna(15)
+    return init_df
+
+def line_costs(df, exchange_rate):
+    """逐行 FOB / 关税 / ATV / 进口 VAT (ZAR)，原地加列。exchange_rate 可为单个数，也可为与 df 对齐的一列 (多票合并计算时每行用所属那票的汇率)"""
+    import pandas as pd
+    for col in ['quantity', 'unit_price', 'duty_rate']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    df['subtotal'] = df['quantity'] * df['unit_price']
+    df['FOB_ZAR'] = df['subtotal'] * exchange_rate
+    df['Duty_Amt_ZAR'] = df['FOB_ZAR'] * (df['duty_rate'] / 100)
+    df['ATV_ZAR'] = (df['FOB_ZAR'] * 1.1) + df['Duty_Amt_ZAR']
+    df['VAT_Amt_ZAR'] = df['ATV_ZAR'] * 0.15
+    return df
+
+@trace.traced("import.landed_cost")
+def calculate_landed_cost(df, exchange_rate, local_fees, currency="USD"):
+    """exchange_rate 为 currency→ZAR 的报关汇率。汇总里 Total_FOB 为报价币种金额"""
+    line_costs(df, exchange_rate)
+
+    total_duty = df['Duty_Amt_ZAR'].sum()
+    total_vat = df['VAT_Amt_ZAR'].sum()
+    prn_value = total_duty + total_vat
+    total_local_fees = sum(local_fees.values())
+    landing_cash_required = prn_value + total_local_fees
+
+    summary = {
+        "Currency": currency,
+        "Total_FOB": df['subtotal'].sum(),
+        "Total_FOB_ZAR": df['FOB_ZAR'].sum(),
+        "Total_PRN_ZAR": prn_value,
+        "Total_Local_Fees": total_local_fees,
+        "Landing_Cash_Required": landing_cash_required
+    }
+    return df, summary
@@ -0,0 +1,396 @@
+"""Invoice Manager 核心逻辑：OCR 提取 (先本地模板，再模型)、金额清洗、查重、汇率换算、入账"""
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from oonce import duplicates, local_extract, profiles, trace
+from oonce.fx import BOOK_CURRENCY, historical_rate, historical_rates, normalize_currencies, normalize_currency
+from oonce.gemini import text_part, file_part, mime_for, extract_json
+
+CORE_COLS = ["Date", "Invoice No", "{entity}", "Subtotal", "VAT", "Total", "Currency"]
+EXTRA_COLS = ["Validation", "File Name", "Total (Original)", "Exchange Rate"]
+ORIGINAL_COL = "Total (Original)"     # 外币发票的原币金额 (币种见 Currency)
+LEGACY_COLS = {"Total (USD)": ORIGINAL_COL}    # 旧台账表头 (只有 USD 时的列名)
+
+def entity_label(mode):
+    return "Vendor" if mode == "input" else "Client"
+
+def ledger_columns(mode):
+    return [c.format(entity=entity_label(mode)) for c in CORE_COLS] + EXTRA_COLS
+
+def migrate_ledger(ledger):
+    """旧台账的 Total (USD) 表头改成 Total (Original) (列位置不变，追加写入不受影响)。改过返回 True"""
+    if not ledger.exists():
+        return False
+    with open(ledger.path, encoding="utf-8-sig") as f:
+        header = f.readline()
+    if not any(old in header for old in LEGACY_COLS):
+        return False
+    with ledger.lock():
+        version = ledger.version()
+        df = ledger.read(dtype=str, keep_default_na=False)
+        if not set(LEGACY_COLS) & set(df.columns):
+            return False
+        ledger.overwrite(df.rename(columns=LEGACY_COLS), expected_version=version)
+    return True
+
+def build_invoice_prompt(mode, hints=""):
+    target_entity = "Vendor/Supplier Name" if mode == "input" else "Client/Customer Name"
+    entity_key = "vendor" if mode == "input" else "client"
+    return f"""
+    You are an expert financial auditor OCR system.
+    Task: Extract invoice data into JSON.
+
+    CRITICAL INSTRUCTIONS FOR ACCURACY:
+    1. **TOTAL AMOUNT**: Look for "Total Due", "Balance Due", "Grand Total". Be extremely careful with decimal points.
+    2. **DATE**: Identify the main Invoice Date. Format: YYYY-MM-DD.
+    3. **INVOICE NO**: Extract the unique Invoice Number.
+    4. **{target_entity}**: Extract the full company name.
+    5. **NO HALLUCINATIONS**: If the image is blurry or not an invoice, return {{"error": "Image unclear/Not invoice"}}.
+    {hints}
+
+    Output JSON format:
+    {{
+        "date": "YYYY-MM-DD",
+        "invoice_number": "STRING",
+        "{entity_key}": "STRING",
+        "subtotal": NUMBER,
+        "vat": NUMBER,
+        "total": NUMBER,
+        "currency": "ISO CODE (ZAR, USD, EUR, CNY ...)"
+    }}
+    """
+
+def extract_invoice_data(file_name, bytes_data, llm, mode="input", templates=None, hints=""):
+    """llm: oonce.gemini.GeminiClient (或带 generate(parts) 的替身)；
+    templates: local_extract.load_templates 的结果，有文字层的 PDF 先在本地识别，没把握再调用模型；
+    hints: profiles.prompt_hints 生成的供应商提示"""
+    if templates:
+        res = local_extract.extract_local(bytes_data, templates, "vendor" if mode == "input" else "client")
+        if res: return res
+    parts = [text_part(build_invoice_prompt(mode, hints)), file_part(bytes_data, mime_for(file_name))]
+    text, err = llm.generate(parts)
+    if err: return {"error": err}
+    try:
+        return extract_json(text)
+    except Exception as e:
+        return {"error": str(e)}
+
+def parse_amount(value):
+    return round(float(str(value).replace(',', '').replace(' ', '')), 2)
+
+def frame_signatures(df):
+    """台账 DataFrame 的查重签名集合 (发票号大写, 金额保留两位)，金额无法解析记为 0"""
+    if df is None or df.empty: return set()
+    inv_nos = df['Invoice No'].astype(str).str.strip().str.upper() if 'Invoice No' in df else pd.Series("", index=df.index)
+    totals = df['Total'] if 'Total' in df else pd.Series(0, index=df.index)
+    totals = pd.to_numeric(totals.astype(str).str.replace(',', ''), errors='coerce').fillna(0.0).round(2)
+    return set(zip(inv_nos, totals))
+
+@trace.traced("invoice.signatures")
+def load_existing_signatures(ledger):
+    """历史台账的查重签名"""
+    try:
+        return frame_signatures(ledger.read(usecols=lambda c: c in ('Invoice No', 'Total'))) if ledger.exists() else set()
+    except Exception:
+        return set()
+
+def load_templates(ledger, mode):
+    """本地预识别模板 (关闭或失败时返回 None，全部走模型)"""
+    if not local_extract.LOCAL_EXTRACT: return None
+    try:
+        return local_extract.load_templates(ledger, entity_label(mode)) if ledger.exists() else None
+    except Exception:
+        return None
+
+def load_profiles(ledger, mode):
+    """人工更正学来的供应商档案 (读取失败时返回空，不影响识别)"""
+    try:
+        return profiles.load_profiles(mode, profiles.db_for(ledger))
+    except Exception:
+        return {}
+
+def load_duplicate_index(ledger, mode):
+    """疑似重复索引 (读取失败时返回 None，只做精确查重)"""
+    try:
+        return duplicates.load_index(ledger, entity_label(mode)) if ledger.exists() else None
+    except Exception:
+        return None
+
+def flag_possible_duplicate(row, mode, indexes):
+    """在 indexes (历史台账 + 本批次) 里找近似重复，返回命中说明或 None。
+    只有校验通过 (✅) 的行改标 POSSIBLE DUPLICATE；❌ Math Error 等问题标记保留 (期间结账要靠它找待重处理的行)，只在说明里提示"""
+    if "DUPLICATE" in row["Validation"]:
+        return None
+    for index in indexes:
+        if index is None: continue
+        hits = index.lookup(row["Invoice No"], row[entity_label(mode)], row["Total"], row["Date"], limit=1)
+        if hits:
+            if row["Validation"].startswith("✅"): row["Validation"] = duplicates.POSSIBLE_DUPLICATE
+            trace.incr("invoice.possible_duplicates")
+            return index.describe(hits[0][0])
+    return None
+
+def signatures_since(ledger, version):
+    """version 之后别人写入的签名；期间台账被整表覆盖过则全量重读"""
+    try:
+        tail = ledger.read_since(version, usecols=lambda c: c in ('Invoice No', 'Total'))
+    except Exception:
+        tail = None
+    return frame_signatures(tail) if tail is not None else load_existing_signatures(ledger)
+
+def fx_validation(currency):
+    """外币行的校验标记 (USD 沿用原来的 ✅ USD Auto)"""
+    return f"✅ {currency} Auto"
+
+def build_ledger_row(res, mode, fname, fx, is_duplicate=False):
+    """把模型返回的 dict 清洗成台账行。金额无法解析时抛 ValueError。
+    外币发票按发票日期的汇率换算成 ZAR (进口发票无本地 VAT)，外币原额记在 Total (Original) 列 (币种见 Currency)"""
+    label = entity_label(mode)
+    key_name = "vendor" if mode == "input" else "client"
+    raw_inv_no = str(res.get("invoice_number", "UNKNOWN")).strip().upper()
+    raw_entity_name = str(res.get(key_name, "UNKNOWN")).strip().upper()
+    currency = normalize_currency(res.get("currency", BOOK_CURRENCY))
+
+    raw_subtotal = parse_amount(res.get("subtotal", 0))
+    raw_vat = parse_amount(res.get("vat", 0))
+    raw_total = parse_amount(res.get("total", 0))
+
+    row = {
+        "Date": res.get("date"),
+        "Invoice No": raw_inv_no,
+        label: raw_entity_name,
+        "Currency": currency,
+        "Subtotal": raw_subtotal,
+        "VAT": raw_vat,
+        "Total": raw_total,
+        ORIGINAL_COL: "", "Exchange Rate": 1.0,
+        "Validation": "", "File Name": fname
+    }
+
+    if is_duplicate:
+        row["Validation"] = "⚠️ DUPLICATE"
+
+    if currency != BOOK_CURRENCY:
+        rate = historical_rate(fx, row["Date"], currency)
+        if not rate: rate = 1.0; row["Exchange Rate"] = "Error"
+        else: row["Exchange Rate"] = round(rate, 4)
+
+        converted_val = round(raw_subtotal * float(rate), 2)
+        row["Subtotal"] = converted_val; row["VAT"] = 0.0; row["Total"] = converted_val
+        row[ORIGINAL_COL] = raw_subtotal
+
+        if "DUPLICATE" not in row["Validation"]: row["Validation"] = fx_validation(currency)
+    else:
+        if "DUPLICATE" not in row["Validation"]:
+            calc_total = round(row["Subtotal"] + row["VAT"], 2)
+            if abs(calc_total - row["Total"]) < 0.2: row["Validation"] = "✅ OK"
+            else: row["Validation"] = "❌ Math Error"
+    return row
+
+def parse_amount_series(series):
+    """批量版 parse_amount (导出文件用)：返回 (金额, 无法解析的行)。空白记 0，(1,234.50) 记负数，去掉货币符号"""
+    text = series.fillna("").astype(str).str.strip()
+    negative = text.str.startswith("(") & text.str.endswith(")")
+    values = pd.to_numeric(text.str.replace(r"[^0-9.\-]", "", regex=True), errors="coerce")
+    bad = values.isna() & (text != "")
+    values = values.astype(float).fillna(0.0).round(2)
+    return values.where(~negative, -values.abs()), bad
+
+def signature_hashes(df):
+    """frame_signatures 的哈希版 (uint64 数组)：百万行查重用排序数组 + np.isin，不建 Python 元组集合"""
+    if df is None or df.empty: return np.array([], dtype="uint64")
+    inv_nos = df['Invoice No'].astype(str).str.strip().str.upper()
+    totals = pd.to_numeric(df['Total'].astype(str).str.replace(',', ''), errors='coerce').fillna(0.0).round(2)
+    return pd.util.hash_pandas_object(pd.DataFrame({"inv": inv_nos, "total": totals}), index=False).to_numpy()
+
+def _normalize_dates(values):
+    """{原值: YYYY-MM-DD}：先按 ISO，其余按南非习惯 DD/MM/YYYY，认不出的原样保留"""
+    values = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    rest = parsed.isna() & (values.astype(str).str.strip() != "")
+    if rest.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            parsed[rest] = pd.to_datetime(values[rest], errors="coerce", dayfirst=True)
+    return dict(zip(values, parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), values.astype(str))))
+
+def normalize_frame(raw, mode, fx, fname):
+    """批量版 build_ledger_row：raw 的列名与模型输出相同 (date, invoice_number, vendor/client, subtotal, vat, total, currency)。
+
+    返回 (台账行, 失败行掩码)。清洗和校验规则与 build_ledger_row 一致 (查重标记由调用方补)；
+    另外日期统一成 YYYY-MM-DD (认不出的原样保留)。外币行的汇率整列一次取 (fx.historical_rates)
+    """
+    label = entity_label(mode)
+    key_name = "vendor" if mode == "input" else "client"
+    idx = raw.index
+    col = lambda name, default: raw[name] if name in raw else pd.Series(default, index=idx, dtype=object)
+    text = lambda name, default: col(name, default).fillna(default).astype(str).str.strip().str.upper()
+
+    subtotal, bad_sub = parse_amount_series(col("subtotal", ""))
+    vat, bad_vat = parse_amount_series(col("vat", ""))
+    total, bad_total = parse_amount_series(col("total", ""))
+    no_amount = (col("total", "").fillna("").astype(str).str.strip() == "") & (col("subtotal", "").fillna("").astype(str).str.strip() == "")
+    failed = bad_sub | bad_vat | bad_total | no_amount
+
+    raw_dates = col("date", "").fillna("")
+    dates = raw_dates.map(_normalize_dates(raw_dates.unique()))    # 导出文件里不同的日期通常只有几千个
+    inv_nos = col("invoice_number", "UNKNOWN")
+    if pd.api.types.is_float_dtype(inv_nos): inv_nos = inv_nos.astype("Int64").astype(object)    # Excel 把纯数字单号读成 12345.0
+    currency = normalize_currencies(text("currency", BOOK_CURRENCY))
+
+    out = pd.DataFrame({
+        "Date": dates, "Invoice No": inv_nos.fillna("UNKNOWN").astype(str).str.strip().str.upper(),
+        label: text(key_name, "UNKNOWN"), "Currency": currency,
+        "Subtotal": subtotal, "VAT": vat, "Total": total,
+        ORIGINAL_COL: "", "Exchange Rate": 1.0, "Validation": "", "File Name": fname,
+    }, index=idx).astype({"Exchange Rate": object, ORIGINAL_COL: object})
+
+    foreign = currency != BOOK_CURRENCY
+    if foreign.any():
+        rate = pd.Series(historical_rates(fx, dates[foreign].to_numpy(), currency[foreign].to_numpy()), index=dates[foreign].index)
+        ok = rate.notna() & (rate.fillna(0) != 0)
+        converted = (subtotal[foreign] * rate.where(ok, 1.0).astype(float)).round(2)
+        out.loc[foreign, "Exchange Rate"] = rate.astype(float).round(4).astype(object).where(ok, "Error")
+        out.loc[foreign, ORIGINAL_COL] = subtotal[foreign]
+        out.loc[foreign, "Subtotal"] = converted; out.loc[foreign, "Total"] = converted
+        out.loc[foreign, "VAT"] = 0.0
+        out.loc[foreign, "Validation"] = currency[foreign].map(fx_validation)
+    zar = ~foreign
+    math_ok = ((out["Subtotal"] + out["VAT"]).round(2) - out["Total"]).abs() < 0.2
+    out.loc[zar, "Validation"] = np.where(math_ok[zar], "✅ OK", "❌ Math Error")
+    return out[ledger_columns(mode)], failed
+
+@trace.traced("invoice.batch")
+def process_invoices(files, mode, allow_duplicates, llm, fx, ledger, on_progress=None, on_commit=None):
+    """批量识别并入账。files 为带 getvalue() (可选 name) 的对象，如 Streamlit 的 UploadedFile。
+
+    返回 {"rows": 新增行, "skipped": 重复跳过的文件, "failed": 失败说明, "local": 本地识别 (未调用模型) 的张数,
+          "possible": 疑似重复 (发票号/金额近似，已入账并标记) 的说明}
+    """
+    snapshot = ledger.version()
+    existing_signatures = load_existing_signatures(ledger)
+    templates = load_templates(ledger, mode)
+    learned = load_profiles(ledger, mode)
+    hints = profiles.prompt_hints(learned)
+    dupes = (load_duplicate_index(ledger, mode), duplicates.DuplicateIndex())     # 历史台账 (缓存只读) + 本批次
+    current_batch_signatures = set()
+    results, skipped_files, failed_files = [], [], []
+    row_signatures = []
+    possible = []
+    local_count = 0
+
+    for i, file in enumerate(files):
+        fname = getattr(file, 'name', f"Photo_{datetime.now().strftime('%H%M%S')}.jpg")
+
+        try:
+            with trace.span("invoice.extract", file=fname):
+                res = extract_invoice_data(fname, file.getvalue(), llm, mode=mode, templates=templates, hints=hints)
+            res = profiles.apply_profile(res, mode, learned)
+            if isinstance(res, dict) and res.pop("source", None) == "local": local_count += 1
+
+            if not isinstance(res, dict):
+                failed_files.append(f"{fname} (系统响应异常)")
+            elif "error" in res:
+                failed_files.append(f"{fname} ({res['error']})")
+            elif "date" in res and ("total" in res or "subtotal" in res):
+                try:
+                    # 三个金额都要能解析，否则整张记为金额识别失败
+                    _, _, raw_total = (parse_amount(res.get(k, 0)) for k in ("subtotal", "vat", "total"))
+                    signature = (str(res.get("invoice_number", "UNKNOWN")).strip().upper(), raw_total)
+                    is_duplicate = signature in existing_signatures or signature in current_batch_signatures
+                    if is_duplicate and not allow_duplicates:
+                        skipped_files.append(f"{fname}")
+                    else:
+                        with trace.span("invoice.normalize", currency=str(res.get("currency", ""))):
+                            row = build_ledger_row(res, mode, fname, fx, is_duplicate)
+                        match = flag_possible_duplicate(row, mode, dupes)
+                        if match: possible.append(f"{fname} ≈ {match}")
+                        dupes[1].add(row["Invoice No"], row[entity_label(mode)], row["Total"], row["Date"])
+                        results.append(row)
+                        row_signatures.append(signature)
+                        current_batch_signatures.add(signature)
+                except ValueError:
+                    failed_files.append(f"{fname} (金额识别失败)")
+            else:
+                failed_files.append(f"{fname} (缺失关键字段)")
+
+        except Exception as e:
+            failed_files.append(f"{fname} (未知错误: {str(e)})")
+
+        if on_progress: on_progress((i + 1) / len(files))
+
+    if results:
+        results = commit_rows(ledger, mode, results, row_signatures, snapshot, allow_duplicates, skipped_files, on_commit)
+    return {"rows": results, "skipped": skipped_files, "failed": failed_files, "local": local_count, "possible": possible}
+
+@trace.traced("invoice.commit")
+def commit_rows(ledger, mode, rows, signatures, snapshot, allow_duplicates, skipped_files, on_commit=None):
+    """持锁入账：批处理期间别人已经录入的发票在这里重新查重 (跳过或标记重复)，返回实际写入的行。
+    on_commit(追加前的台账版本, 要写入的文件名列表) 在持锁、真正追加之前调用 (后台任务据此判断崩溃前是否已入账)"""
+    with ledger.lock():
+        fresh = signatures_since(ledger, snapshot) if ledger.version() != snapshot else set()
+        kept = []
+        for row, signature in zip(rows, signatures):
+            if signature in fresh:
+                if not allow_duplicates:
+                    skipped_files.append(row["File Name"]); continue
+                row["Validation"] = "⚠️ DUPLICATE"
+            kept.append(row)
+        if kept:
+            if on_commit: on_commit(ledger.version(), [row["File Name"] for row in kept])
+            ledger.append(pd.DataFrame(kept)[ledger_columns(mode)])
+    return kept
+
+@trace.traced("invoice.reprocess")
+def reprocess_flagged(ledger, fx):
+    """批量重处理台账里的问题行 (原文件处理完已删除，只用台账里的数据):
+    外币行汇率为 Error 的重新取当天汇率并换算；❌ Math Error 的按当前金额重新校验 (表格里改过金额的转为 ✅ OK)。
+    返回 (修复行数, 仍有问题的行数)；期间台账被别人改过抛 LedgerConflict"""
+    version = ledger.version()
+    if version is None:
+        return 0, 0
+    df = ledger.read(dtype=str, keep_default_na=False).rename(columns=LEGACY_COLS)    # 写回时顺带迁移表头
+    if not {"Currency", "Exchange Rate", ORIGINAL_COL, "Validation"} <= set(df.columns):
+        return 0, 0
+    currency = normalize_currencies(df["Currency"])
+    rate_err = df["Exchange Rate"].str.strip().eq("Error") & currency.ne(BOOK_CURRENCY)
+    math_err = df["Validation"].str.startswith("❌")
+    fixed = pd.Series(False, index=df.index)
+
+    if rate_err.any():
+        if callable(getattr(fx, "forget_misses", None)): fx.forget_misses()     # 之前没取到的日期段马上重新请求
+        rate = pd.Series(historical_rates(fx, df.loc[rate_err, "Date"].to_numpy(), currency[rate_err].to_numpy()),
+                         index=df.index[rate_err]).reindex(df.index)
+        ok = rate_err & rate.notna() & df[ORIGINAL_COL].str.strip().ne("")
+        original, _ = parse_amount_series(df.loc[ok, ORIGINAL_COL])
+        converted = (original * rate[ok].astype(float)).round(2)
+        df.loc[ok, "Exchange Rate"] = rate[ok].astype(float).round(4).astype(str)
+        df.loc[ok, "Subtotal"] = converted.astype(str); df.loc[ok, "Total"] = converted.astype(str); df.loc[ok, "VAT"] = "0.0"
+        relabel = ok & ~df["Validation"].str.contains("DUPLICATE")
+        df.loc[relabel, "Validation"] = currency[relabel].map(fx_validation)
+        fixed |= ok
+
+    if math_err.any():
+        (sub, bad_s), (vat, bad_v), (total, bad_t) = (parse_amount_series(df.loc[math_err, c]) for c in ("Subtotal", "VAT", "Total"))
+        ok = (((sub + vat).round(2) - total).abs() < 0.2) & ~(bad_s | bad_v | bad_t)
+        ok = ok.reindex(df.index, fill_value=False)
+        df.loc[ok, "Validation"] = "✅ OK"
+        fixed |= ok
+
+    n_fixed = int(fixed.sum())
+    if n_fixed:
+        ledger.overwrite(df, expected_version=version)
+    return n_fixed, int((rate_err | math_err).sum()) - n_fixed
+
+@trace.traced("invoice.metrics")
+def calculate_metrics(input_ledger, output_ledger):
+    """侧边栏汇总：进项合计、销项合计 (读写入时维护的汇总，不扫整本台账)"""
+    total_in = 0.0; total_out = 0.0
+    try: total_in = input_ledger.totals()[1]
+    except: pass
+    try: total_out = output_ledger.totals()[1]
+    except: pass
+    return total_in, total_out
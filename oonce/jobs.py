@@ -0,0 +1,285 @@
+"""发票识别后台任务队列：上传即入队 (SQLite 持久化)，工作线程有界并发处理，页面轮询状态
+
+页面刷新或关闭不影响已入队的任务；多个员工同时提交时各自的任务并行跑，互不阻塞。
+工作线程默认跑在 Streamlit 进程里 (get_worker)，也可以单独起一个进程:
+
+    OONCE_INGEST_WORKER=external streamlit run Home.py
+    python -m oonce.jobs --workers 4 [--workspace default acme]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from oonce import trace
+from oonce.storage import get_ledger
+
+JOBS_DB = "oonce_jobs.db"
+INGEST_MAX_WORKERS = 3     # 同时处理的任务数 (每个任务内部逐张调用模型)
+POLL_INTERVAL = 1.0        # 工作线程空闲时查询新任务的间隔 (秒)
+STALE_AFTER = 300          # running 状态超过该秒数没有进度，视为进程已退出，重新入队
+HEARTBEAT = 60             # 调度线程每隔这么多秒给在跑的任务续期，并把别的进程留下的过期任务放回队列
+ACTIVE_STATUSES = ("queued", "running")
+# 设为 external 时页面不在进程内起工作线程，由单独的 python -m oonce.jobs 处理
+WORKER_MODE = os.environ.get("OONCE_INGEST_WORKER", "inline")
+
+class StoredFile:
+    """从任务表取出的上传文件 (接口同 Streamlit 的 UploadedFile)"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+def open_jobs(db_path=None):
+    conn = sqlite3.connect(db_path or JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, mode TEXT, allow_duplicates INTEGER, owner TEXT,
+            status TEXT, total INTEGER, done INTEGER DEFAULT 0,
+            created REAL, updated REAL, finished REAL, result TEXT, error TEXT);
+        CREATE TABLE IF NOT EXISTS job_files (
+            job_id TEXT, idx INTEGER, name TEXT, data BLOB, PRIMARY KEY (job_id, idx));
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created);
+    """)
+    try:
+        conn.execute("ALTER TABLE jobs ADD COLUMN committed TEXT")    # 入账标记 (旧库补列)
+    except sqlite3.OperationalError:
+        pass
+    return conn
+
+def _job_dict(row):
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def enqueue_invoices(files, mode, allow_duplicates, owner="", db_path=None):
+    """把上传文件连同内容写进任务表，返回任务 id"""
+    job_id = uuid.uuid4().hex[:12]
+    now = time.time()
+    with closing(open_jobs(db_path)) as conn, conn:
+        conn.execute("INSERT INTO jobs (id, mode, allow_duplicates, owner, status, total, created, updated) "
+                     "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                     (job_id, mode, int(bool(allow_duplicates)), owner, len(files), now, now))
+        conn.executemany("INSERT INTO job_files (job_id, idx, name, data) VALUES (?, ?, ?, ?)",
+                         [(job_id, i, getattr(f, 'name', None) or f"Photo_{job_id}_{i}.jpg", f.getvalue())
+                          for i, f in enumerate(files)])
+    worker = _workers.get(os.path.abspath(db_path or JOBS_DB))
+    if worker: worker.wake()
+    return job_id
+
+def get_job(job_id, db_path=None):
+    with closing(open_jobs(db_path)) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+def list_jobs(mode=None, active_only=False, limit=20, db_path=None):
+    """最近的任务 (新的在前)"""
+    sql, params = "SELECT * FROM jobs WHERE 1=1", []
+    if mode:
+        sql += " AND mode = ?"; params.append(mode)
+    if active_only:
+        sql += f" AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})"; params += ACTIVE_STATUSES
+    sql += " ORDER BY created DESC LIMIT ?"; params.append(limit)
+    with closing(open_jobs(db_path)) as conn:
+        return [_job_dict(r) for r in conn.execute(sql, params).fetchall()]
+
+def queue_counts(db_path=None):
+    """{status: 数量}，只统计排队中和处理中的任务"""
+    with closing(open_jobs(db_path)) as conn:
+        rows = conn.execute(f"SELECT status, COUNT(*) FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) "
+                            "GROUP BY status", ACTIVE_STATUSES).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+def claim_next_job(db_path=None):
+    """原子地取出最早的排队任务并标记为 running (多进程同时取也不会重复)，没有则返回 None"""
+    with closing(open_jobs(db_path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ?", (time.time(), row['id']))
+        conn.commit()
+    return row['id'] if row else None
+
+def requeue_stale(db_path=None, stale_after=STALE_AFTER):
+    """把长时间没有进度的 running 任务放回队列。入账前会先记下入账标记 (committed)，
+    重跑时据此判断崩溃前是否已经写进台账，已写入的不再重复记账 (见 run_job)"""
+    with closing(open_jobs(db_path)) as conn, conn:
+        cur = conn.execute("UPDATE jobs SET status = 'queued', done = 0 WHERE status = 'running' AND updated < ?",
+                           (time.time() - stale_after,))
+    return cur.rowcount
+
+def _already_committed(ledger, marker):
+    """上次运行在入账前记下的标记 {"version", "files"} 对应的行是否已经在台账里"""
+    marker = json.loads(marker)
+    tail = ledger.read_since(tuple(marker["version"]), usecols=["File Name"], dtype=str) if marker["version"] else None
+    if tail is not None:
+        # 标记是持锁、紧挨着追加之前写的，追加成功的话这些行就是之后的头几行
+        return tail["File Name"].head(len(marker["files"])).tolist() == marker["files"]
+    if not ledger.exists():     # 台账期间被整表覆盖过：退一步按文件名查
+        return False
+    return set(marker["files"]) <= set(ledger.read(usecols=["File Name"], dtype=str)["File Name"])
+
+def run_job(job_id, llm, fx, ledger_factory=None, db_path=None):
+    """处理一个已认领的任务，结果写回任务表，文件内容处理完即删除"""
+    from oonce.invoices import process_invoices
+    run = trace.begin_run("ingest_job")
+    with closing(open_jobs(db_path)) as conn:
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        files = [StoredFile(r['name'], r['data'])
+                 for r in conn.execute("SELECT name, data FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,))]
+
+        def on_progress(frac):
+            with conn:
+                conn.execute("UPDATE jobs SET done = ?, updated = ? WHERE id = ?",
+                             (round(frac * len(files)), time.time(), job_id))
+
+        def on_commit(version, names):
+            with conn:
+                conn.execute("UPDATE jobs SET committed = ?, updated = ? WHERE id = ?",
+                             (json.dumps({"version": list(version) if version else None, "files": names}, ensure_ascii=False),
+                              time.time(), job_id))
+
+        status, result, error = "done", None, None
+        try:
+            ledger = (ledger_factory or get_ledger)(job['mode'])
+            if job['committed'] and _already_committed(ledger, job['committed']):
+                # 上次运行已经入账，只是没来得及更新任务状态 (进程中途退出)
+                result = {"rows": len(json.loads(job['committed'])["files"]), "skipped": [], "failed": [], "local": 0, "possible": []}
+            else:
+                batch = process_invoices(files, job['mode'], bool(job['allow_duplicates']), llm, fx, ledger,
+                                         on_progress=on_progress, on_commit=on_commit)
+                result = {"rows": len(batch["rows"]), "skipped": batch["skipped"], "failed": batch["failed"],
+                          "local": batch.get("local", 0), "possible": batch.get("possible", [])}
+        except Exception as e:
+            status, error = "failed", str(e)
+
+        with conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, finished = ? WHERE id = ?",
+                         (status, json.dumps(result, ensure_ascii=False) if result else None, error,
+                          time.time(), time.time(), job_id))
+            conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+    trace.end_run(run)
+    return status
+
+class IngestWorker:
+    """后台调度线程：不断认领排队任务，交给有界线程池处理"""
+
+    def __init__(self, llm, fx, max_workers=INGEST_MAX_WORKERS, ledger_factory=None, db_path=None):
+        self.llm, self.fx = llm, fx
+        self.max_workers = max_workers
+        self.ledger_factory = ledger_factory
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="oonce-ingest")
+        self._slots = threading.Semaphore(max_workers)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._running = set()      # 本进程正在处理的任务 id
+        self._running_lock = threading.Lock()
+        self._last_beat = 0.0
+
+    def start(self):
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._loop, name="oonce-ingest-dispatch", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, wait=True):
+        self._stop.set(); self._wake.set()
+        if self._thread: self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job_id):
+        try:
+            run_job(job_id, self.llm, self.fx, self.ledger_factory, self.db_path)
+        finally:
+            with self._running_lock: self._running.discard(job_id)
+            self._slots.release()
+            self._wake.set()
+
+    def _heartbeat(self):
+        """给本进程在跑的任务续期 (单张发票识别很慢时也不会被别的进程当成过期)，再回收别的进程崩溃留下的任务"""
+        self._last_beat = time.monotonic()
+        with self._running_lock: running = list(self._running)
+        try:
+            if running:
+                with closing(open_jobs(self.db_path)) as conn, conn:
+                    conn.execute(f"UPDATE jobs SET updated = ? WHERE id IN ({','.join('?' * len(running))})",
+                                 [time.time()] + running)
+            requeue_stale(self.db_path)
+        except sqlite3.Error:
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_beat >= HEARTBEAT:
+                self._heartbeat()
+            # 先占并发名额再认领，满载时任务留在队列里，其他进程的工作线程也能取
+            if not self._slots.acquire(timeout=POLL_INTERVAL):
+                continue
+            try:
+                job_id = claim_next_job(self.db_path)
+            except sqlite3.Error:
+                job_id = None
+            if job_id:
+                with self._running_lock: self._running.add(job_id)
+                self._pool.submit(self._run, job_id)
+                continue
+            self._slots.release()
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+_workers = {}   # 任务表绝对路径 -> IngestWorker (每个工作区一个)
+_workers_lock = threading.Lock()
+
+def get_worker(llm, fx, max_workers=INGEST_MAX_WORKERS, ledger_factory=None, db_path=None):
+    """进程内单例 (按任务表区分)：第一次调用时启动，之后 Streamlit 每次重跑脚本都拿到同一个。外部工作进程模式下返回 None"""
+    if WORKER_MODE == "external":
+        return None
+    key = os.path.abspath(db_path or JOBS_DB)
+    with _workers_lock:
+        if key not in _workers:
+            _workers[key] = IngestWorker(llm, fx, max_workers, ledger_factory, db_path).start()
+        return _workers[key]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OONCE 发票识别后台工作进程")
+    parser.add_argument("--workers", type=int, default=INGEST_MAX_WORKERS, help="同时处理的任务数")
+    parser.add_argument("--workspace", nargs="+", default=None, help="只处理这些工作区 (默认全部)")
+    args = parser.parse_args(argv)
+
+    from oonce import workspace
+    from oonce.fx import get_rate_matrix
+    from oonce.gemini import GeminiClient, load_api_key
+    default_key = load_api_key()
+    workers = []
+    for slug in args.workspace or workspace.list_workspaces():
+        ws = workspace.get_workspace(slug)
+        api_key = ws.api_key(default_key)
+        if not api_key:
+            parser.error(f"工作区 {slug} 未找到 Gemini Key (环境变量或 .streamlit/secrets.toml)")
+        llm = GeminiClient(api_key, prefer=("flash",), default_model="gemini-1.5-flash", budget=ws.budget())
+        workers.append(IngestWorker(llm, get_rate_matrix(), args.workers, ws.ledger, ws.jobs_db).start())
+    print(f"🛠️ 工作进程已启动 ({len(workers)} 个工作区 × {args.workers} 并发)，Ctrl+C 退出", flush=True)
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        for worker in workers: worker.stop(wait=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""发票本地预识别：PDF 自带文字层时先用正则 + 供应商模板在本地提取，没把握的再交给 Gemini
+
+模板按供应商 (进项) / 客户 (销项) 从台账里校验通过 (✅) 的历史行学来：
+名称、常用币种、发票号格式 (如 INV-00123 -> INV-\\d{5})。本地识别只在以下条件全部满足时采用:
+
+    文字层里找到已知名称 · 按该名称的格式找到唯一的发票号 · 日期可解析
+    · Total / Subtotal / VAT 至少两项，且 Subtotal + VAT = Total
+
+扫描件、图片、新供应商、对不上账的一律走模型。依赖 pypdf (未安装时全部走模型)。
+
+    OONCE_LOCAL_EXTRACT=0     # 关闭本地预识别
+"""
+import io
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+from oonce import trace
+
+LOCAL_EXTRACT = os.environ.get("OONCE_LOCAL_EXTRACT", "1") != "0"
+MAX_PAGES = 3
+MIN_NAME_LEN = 4      # 太短的名称容易在正文里误匹配
+MAX_SHAPES = 3        # 每个名称最多保留几种发票号格式
+LABEL_WINDOW = 40     # 标签 ("INVOICE NO" / "DATE") 之后多少个字符内找值
+
+_AMOUNT = r"([0-9][0-9 ,]*\.[0-9]{2})(?![0-9])"
+_CURRENCY = r"(?:ZAR|USD|EUR|CNY|RMB|US\$|R|\$|€|¥)?"
+_CURRENCY_MARKS = (("USD", re.compile(r"\bUSD\b|US\$")), ("EUR", re.compile(r"\bEUR\b|€")),
+                   ("CNY", re.compile(r"\bCNY\b|\bRMB\b|¥")), ("ZAR", re.compile(r"\bZAR\b")))
+_TOTAL_RE = re.compile(r"(?<![A-Z])(?<!SUB )(?<!SUB-)(?:GRAND TOTAL|TOTAL DUE|BALANCE DUE|AMOUNT DUE|TOTAL)"
+                       r"(?:\s*\((?:ZAR|USD|EUR|CNY|INCL\.? VAT)\)|\s+INCL(?:UDING|\.)? VAT)?\s*:?\s*" + _CURRENCY + r"\s*" + _AMOUNT)
+_SUBTOTAL_RE = re.compile(r"(?<![A-Z])(?:SUB[ -]?TOTAL|(?:TOTAL|AMOUNT) EXCL(?:UDING|\.)? VAT)"
+                          r"\s*:?\s*" + _CURRENCY + r"\s*" + _AMOUNT)
+_VAT_RE = re.compile(r"(?<![A-Z])(?<!INCL )(?<!INCL\. )(?<!EXCL )(?<!EXCL\. )(?<!INCLUDING )(?<!EXCLUDING )(?:VAT|TAX)"
+                     r"(?:\s*\(?\s*@?\s*\d{1,2}(?:\.\d+)?\s*%\s*\)?)?\s*:?\s*" + _CURRENCY + r"\s*" + _AMOUNT)
+_INV_LABEL_RE = re.compile(r"INVOICE\s*(?:NO\.?|NUMBER|NUM|#)|INV\s*(?:NO\.?|#)|DOCUMENT\s*(?:NO\.?|NUMBER)")
+_DATE_LABEL_RE = re.compile(r"(?<!DUE )(?<![A-Z])DATE\s*:?\s*")     # 不要 DUE DATE
+_MONTHS = {m: i + 1 for i, m in enumerate(("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"))}
+_DATE_RES = (
+    (re.compile(r"(?<!\d)(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?!\d)"), lambda g: (g[0], g[1], g[2])),
+    (re.compile(r"(?<!\d)(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})(?!\d)"), lambda g: (g[2], g[1], g[0])),   # 南非习惯 DD/MM/YYYY
+    (re.compile(r"(?<!\d)(\d{1,2})\s+(JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)[A-Z]*\.?,?\s+(\d{4})"),
+     lambda g: (g[2], _MONTHS[g[1]], g[0])),
+)
+
+_cache = {}     # 台账路径 -> (版本, 发票号格式计数, 币种计数, 模板)
+_cache_lock = threading.Lock()
+
+# --- 文字层 ---
+
+def pdf_text(bytes_data, max_pages=MAX_PAGES):
+    """PDF 前几页的文字层 (大写、空白压缩)。不是 PDF、扫描件或未安装 pypdf 返回 ''"""
+    if not bytes_data.startswith(b"%PDF"):
+        return ""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return ""
+    try:
+        reader = PdfReader(io.BytesIO(bytes_data))
+        text = "\n".join(page.extract_text() or "" for page in reader.pages[:max_pages])
+    except Exception:
+        return ""
+    return re.sub(r"[ \t\xa0]+", " ", text).upper()
+
+# --- 模板学习 ---
+
+def mask_digits(values):
+    """发票号 (Series) 的格式键：数字统一换成 #，如 INV-00123 -> INV-#####"""
+    return values.str.replace(r"\d", "#", regex=True)
+
+def shape_regex(mask):
+    """格式键 -> 正则：字母和符号原样保留，连续的 # 按位数换成 \\d{n}"""
+    return "".join(rf"\d{{{len(p)}}}" if p[0] == "#" else re.escape(p) for p in re.findall(r"#+|[^#]", mask))
+
+def _count(df, entity_col):
+    """台账行 -> ((名称, 发票号格式) 计数, (名称, 币种) 计数)，只统计校验通过的行"""
+    shapes, currencies = Counter(), Counter()
+    if df is None or df.empty or entity_col not in df or "Invoice No" not in df:
+        return shapes, currencies
+    if "Validation" in df:
+        df = df[df["Validation"].astype(str).str.startswith("✅")]
+    names = df[entity_col].astype(str).str.strip().str.upper()
+    inv_nos = df["Invoice No"].astype(str).str.strip().str.upper()
+    ok = (names.str.len() >= MIN_NAME_LEN) & (names != "UNKNOWN") & (inv_nos.str.len() >= 3) & (inv_nos != "UNKNOWN")
+    names, inv_nos = names[ok], inv_nos[ok]
+    # 先把数字统一成 #，按 (名称, 格式) 聚合后再生成正则，百万行台账也只对几千个组合做字符串处理
+    masked = mask_digits(inv_nos)
+    for (name, mask), n in masked.groupby([names, masked]).size().items():
+        shapes[(name, mask)] += int(n)
+    if "Currency" in df:
+        curr = df["Currency"][ok].astype(str).str.strip().str.upper()
+        for (name, c), n in curr.groupby([names, curr]).size().items():
+            currencies[(name, c)] += int(n)
+    return shapes, currencies
+
+def _build(shapes, currencies):
+    by_name = {}
+    for (name, mask), n in shapes.items():
+        by_name.setdefault(name, []).append((n, mask))
+    templates = {}
+    for name, masks in by_name.items():
+        masks = sorted(masks, reverse=True)[:MAX_SHAPES]
+        pattern = "|".join(shape_regex(m) for _, m in masks)
+        currency = max(((n, c) for (nm, c), n in currencies.items() if nm == name), default=(0, "ZAR"))[1]
+        templates[name] = {
+            "regex": re.compile(rf"(?<![A-Z0-9])(?:{pattern})(?![A-Z0-9])"),
+            "currency": currency,
+            "count": sum(n for n, _ in masks),
+        }
+    return templates
+
+@trace.traced("invoice.templates")
+def load_templates(ledger, entity_col):
+    """台账对应的模板 {名称: {"regex", "currency", "count"}}。按台账版本缓存，只有追加时增量更新"""
+    usecols = lambda c: c in (entity_col, "Invoice No", "Currency", "Validation")
+    with _cache_lock:
+        cached = _cache.get(ledger.path)
+    with ledger.lock(shared=True):
+        version = ledger.version()
+        if version is None:
+            return {}
+        if cached and cached[0] == version:
+            return cached[3]
+        tail = ledger.read_since(cached[0], usecols=usecols) if cached else None
+        df = ledger.read(usecols=usecols) if tail is None else None
+
+    if tail is not None:
+        shapes, currencies = Counter(cached[1]), Counter(cached[2])
+        new_shapes, new_currencies = _count(tail, entity_col)
+        shapes.update(new_shapes); currencies.update(new_currencies)
+    else:
+        shapes, currencies = _count(df, entity_col)
+    templates = _build(shapes, currencies)
+    with _cache_lock:
+        _cache[ledger.path] = (version, shapes, currencies, templates)
+    return templates
+
+# --- 字段提取 ---
+
+def _amount(regex, text, last=False):
+    matches = regex.findall(text)
+    if not matches:
+        return None
+    try:
+        return round(float(matches[-1 if last else 0].replace(",", "").replace(" ", "")), 2)
+    except ValueError:
+        return None
+
+def _parse_date(text, anchored=False):
+    """返回 (位置, YYYY-MM-DD)；anchored 时只认紧挨开头的日期"""
+    found = []
+    for regex, order in _DATE_RES:
+        m = regex.match(text) if anchored else regex.search(text)
+        if not m: continue
+        try:
+            y, mo, d = (int(v) for v in order(m.groups()))
+            found.append((m.start(), datetime(y, mo, d).strftime("%Y-%m-%d")))
+        except ValueError:
+            continue
+    return min(found) if found else None
+
+def _find_date(text):
+    for label in _DATE_LABEL_RE.finditer(text):
+        hit = _parse_date(text[label.end():label.end() + LABEL_WINDOW], anchored=True)
+        if hit: return hit[1]
+    hit = _parse_date(text)
+    return hit[1] if hit else None
+
+def _find_invoice_no(text, regex):
+    """标签后面的优先；没有标签时正文里只能有一个候选，否则算没把握"""
+    for label in _INV_LABEL_RE.finditer(text):
+        m = regex.search(text[label.end():label.end() + LABEL_WINDOW])
+        if m: return m.group(0)
+    candidates = set(regex.findall(text))
+    return candidates.pop() if len(candidates) == 1 else None
+
+def _match_name(text, templates):
+    """正文里出现的已知名称 (有多个时取最长的，避免 ACME 抢了 ACME HOLDINGS)"""
+    hits = [name for name in templates if name in text]
+    return max(hits, key=len) if hits else None
+
+def _amounts(text, currency):
+    total = _amount(_TOTAL_RE, text, last=True)
+    subtotal = _amount(_SUBTOTAL_RE, text)
+    vat = _amount(_VAT_RE, text)
+    if currency != "ZAR" and vat is None:      # 外币发票没有本地 VAT
+        vat = 0.0
+        if subtotal is None: subtotal = total
+        if total is None: total = subtotal
+    if sum(v is None for v in (total, subtotal, vat)) > 1:
+        return None
+    if total is None: total = round(subtotal + vat, 2)
+    if subtotal is None: subtotal = round(total - vat, 2)
+    if vat is None: vat = round(total - subtotal, 2)
+    if total <= 0 or subtotal < 0 or vat < 0 or abs(subtotal + vat - total) > 0.02:
+        return None
+    return subtotal, vat, total
+
+def extract_fields(text, templates, entity_key):
+    """从文字层提取与模型同格式的 dict；任何一项没把握返回 None"""
+    name = _match_name(text, templates)
+    if not name:
+        return None
+    template = templates[name]
+    inv_no = _find_invoice_no(text, template["regex"])
+    date = _find_date(text)
+    currency = next((code for code, mark in _CURRENCY_MARKS if mark.search(text)), template["currency"])
+    amounts = _amounts(text, currency)
+    if not (inv_no and date and amounts):
+        return None
+    subtotal, vat, total = amounts
+    return {"date": date, "invoice_number": inv_no, entity_key: name,
+            "subtotal": subtotal, "vat": vat, "total": total, "currency": currency, "source": "local"}
+
+def extract_local(bytes_data, templates, entity_key):
+    """本地预识别：成功返回结果 dict，否则 None (调用方交给模型)"""
+    if not templates:
+        return None
+    with trace.span("invoice.local_extract") as attrs:
+        text = pdf_text(bytes_data)
+        res = extract_fields(text, templates, entity_key) if text.strip() else None
+        attrs["text_layer"] = bool(text.strip())
+        attrs["hit"] = res is not None
+    trace.incr("extract.local" if res else "extract.escalated")
+    return res
@@ -0,0 +1,521 @@
+"""News Agent 核心逻辑：搜索、去重、资讯档案、文章生成 (页面和每日定时任务共用)"""
+import datetime
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from oonce import trace
+
+# --- 选项 ---
+# 10个华人感兴趣的方面
+TOPIC_OPTIONS = [
+    "Immigration/Visas",       # 内政部/签证
+    "Crime/Safety Alerts",     # 治安/预警
+    "Rand/RMB Exchange Rate",  # 汇率/金融
+    "Eskom/Water Supply",      # 水电/限电
+    "Logistics/Port Delays",   # 物流/港口
+    "Traffic/Strikes",         # 交通/罢工
+    "China-SA Relations",      # 中南关系
+    "Real Estate/Property",    # 房产/租房
+    "Education/Schools",       # 教育/留学
+    "Lifestyle/Food"           # 吃喝玩乐
+]
+# 默认勾选前三个最核心的
+DEFAULT_TOPICS = ["Immigration/Visas", "Crime/Safety Alerts", "Rand/RMB Exchange Rate"]
+
+# 媒体域名映射
+MEDIA_MAP = {
+    "Business Day": "site:businesslive.co.za",
+    "Sunday Times": "site:timeslive.co.za",
+    "Daily Sun": "site:snl24.com",
+    "The Star": "site:iol.co.za"
+}
+DEFAULT_MEDIA = ["Business Day", "The Star"]
+
+# --- 搜索后端 & 缓存 ---
+def _ddgs():
+    from duckduckgo_search import DDGS
+    return DDGS()
+
+def _ddgs_backend():
+    """DDGS (设置了 cassette 时走录制/回放，回放时不创建真实连接)"""
+    from oonce import cassette
+    return cassette.Search(_ddgs)
+
+# 后端工厂：返回带 .news() / .text() 方法的对象 (DDGS 接口)，离线测试时可替换为桩
+SEARCH_BACKEND_FACTORY = _ddgs_backend
+SEARCH_CACHE_TTL = 3600      # 同一查询 1 小时内直接命中缓存
+SEARCH_MAX_WORKERS = 6       # 并发上限，避免被 DuckDuckGo 限流
+HEDGE_DELAY = 2.0            # 严格模式超过 2 秒未返回，提前发出降级查询
+
+_search_cache = {}
+_search_cache_lock = threading.Lock()
+
+def cached_search(kind, query, time_limit, max_results, backend_factory=None):
+    """带 TTL 缓存的单次搜索 (kind: news / text)，出错 (含超时) 返回 None 且不写缓存，与"没有结果"区分开"""
+    key = (kind, query, time_limit, max_results)
+    now = time.monotonic()
+    with _search_cache_lock:
+        hit = _search_cache.get(key)
+        if hit and now - hit[0] < SEARCH_CACHE_TTL:
+            trace.incr("cache_hits")
+            return hit[1]
+
+    factory = backend_factory or SEARCH_BACKEND_FACTORY
+    try:
+        with trace.span(f"search.{kind}", time_limit=time_limit) as attrs:
+            trace.incr("api_calls")
+            # 每个线程独立建连接，DDGS 实例不保证线程安全
+            backend = factory()
+            search_fn = backend.news if kind == "news" else backend.text
+            res = list(search_fn(keywords=query, region="za-en", timelimit=time_limit, max_results=max_results))
+            attrs["results"] = len(res)
+    except Exception:
+        trace.incr("errors")
+        return None
+
+    with _search_cache_lock:
+        _search_cache[key] = (now, res)
+    return res
+
+def clear_search_cache():
+    with _search_cache_lock:
+        _search_cache.clear()
+
+def build_topic_tiers(topic, media_filter, since=None):
+    """三级降级策略：A 严格 (指定媒体+24h) → B 指定媒体+一周 → C 全网+一周
+    增量扫描：该话题 24 小时内扫过的话，降级层级也只查 24 小时"""
+    fallback_limit = "w"
+    if since and datetime.datetime.now(datetime.timezone.utc) - since < datetime.timedelta(days=1):
+        fallback_limit = "d"
+    query_a = f"South Africa {topic} news {media_filter}"
+    tiers = [(query_a, "d")]
+    if media_filter:
+        tiers.append((query_a, fallback_limit))
+    tiers.append((f"South Africa {topic} news", fallback_limit))
+    return tiers
+
+def parse_news_date(value):
+    try:
+        dt = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+@trace.traced("news.search")
+def search_news_smart(topics, selected_media, check_embassy, backend_factory=None, last_runs=None, on_progress=None,
+                      failed_topics=None):
+    """last_runs: {topic: 上次扫描时间 (UTC)}，早于该时间发布的新闻不再返回
+    on_progress: 进度回调 (只在调用线程里触发)，页面传入 st.empty().text
+    failed_topics: 传入 set 时，搜索出错/超时且没拿到结果的话题会加进去 (这些话题不应推进 last_run)"""
+    last_runs = last_runs or {}
+    on_progress = on_progress or (lambda msg: None)
+    results = []
+    
+    # 构建媒体过滤串
+    media_filter = ""
+    if selected_media:
+        filters = [MEDIA_MAP[m] for m in selected_media if m in MEDIA_MAP]
+        if filters:
+            media_filter = "(" + " OR ".join(filters) + ")"
+
+    embassy_queries = []
+    if check_embassy:
+        embassy_queries = [
+            "site:za.china-embassy.gov.cn notice",             # 驻南非大使馆
+            "site:johannesburg.china-consulate.gov.cn notice", # 约堡总领馆
+            "site:durban.china-consulate.gov.cn notice",       # 德班总领馆
+            "site:capetown.china-consulate.gov.cn notice"      # 开普敦总领馆
+        ]
+
+    on_progress("🔍 正在启动智能搜索策略...")
+
+    tiers = {topic: build_topic_tiers(topic, media_filter, last_runs.get(topic)) for topic in topics}
+    tier_results = {topic: {} for topic in topics}   # topic -> {tier_idx: results}
+    launched = {topic: 0 for topic in topics}        # 已发出的层级数
+    last_launch = {}
+    last_fut = {}
+    chosen = {}                                      # topic -> 最终采用的结果
+
+    pool = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS)
+    try:
+        pending = {}
+
+        def launch(topic):
+            idx = launched[topic]
+            query, time_limit = tiers[topic][idx]
+            fut = pool.submit(trace.bind(cached_search), "news", query, time_limit, 2, backend_factory)
+            pending[fut] = (topic, idx)
+            last_fut[topic] = fut
+            launched[topic] = idx + 1
+            last_launch[topic] = time.monotonic()
+
+        # --- 1. 使领馆公告 (搜索过去一个月，公告频率较低) 与各话题严格模式同时发出 ---
+        embassy_futs = [pool.submit(trace.bind(cached_search), "text", q, "m", 1, backend_factory) for q in embassy_queries]
+        for topic in topics:
+            launch(topic)
+
+        # --- 2. 常规新闻：对冲请求，严格模式迟迟不返回或返回空时提前发出降级查询 ---
+        while len(chosen) < len(topics):
+            done, _ = wait(list(pending), timeout=HEDGE_DELAY, return_when=FIRST_COMPLETED)
+            for fut in done:
+                topic, idx = pending.pop(fut)
+                tier_results[topic][idx] = fut.result()
+
+            now = time.monotonic()
+            for topic in topics:
+                if topic in chosen:
+                    continue
+                # 按层级顺序取第一个非空结果；更高优先级层级尚未返回时继续等待
+                for idx in range(len(tiers[topic])):
+                    if idx not in tier_results[topic]:
+                        break
+                    if tier_results[topic][idx]:
+                        chosen[topic] = tier_results[topic][idx]
+                        break
+                else:
+                    chosen[topic] = []
+                    # 各层都没结果且有层级出错：不能当成"确实没有新闻"
+                    if failed_topics is not None and None in tier_results[topic].values():
+                        failed_topics.add(topic)
+                if topic in chosen or launched[topic] >= len(tiers[topic]):
+                    continue
+                prev_empty = launched[topic] - 1 in tier_results[topic] and not tier_results[topic][launched[topic] - 1]
+                # 仍在排队的请求不算慢，只对已在执行且超时的请求对冲
+                slow = last_fut[topic].running() and now - last_launch[topic] >= HEDGE_DELAY
+                if prev_empty or slow:
+                    trace.incr("retries" if prev_empty else "hedges")
+                    launch(topic)
+
+            on_progress(f"🔍 已完成 {len(chosen)}/{len(topics)} 个话题...")
+
+        # 存入结果 (保持话题顺序)
+        for topic in topics:
+            since = last_runs.get(topic)
+            for res in chosen[topic]:
+                published = parse_news_date(res.get('date', ''))
+                if since and published and published <= since:
+                    continue
+                results.append({
+                    "type": "NEWS",
+                    "category": topic,
+                    "title": res['title'],
+                    "snippet": res['body'],
+                    "source": res['source'],
+                    "url": res['url'],
+                    "date": res.get('date', '')
+                })
+
+        if embassy_futs:
+            on_progress("🇨🇳 正在汇总使领馆公告...")
+        for fut in embassy_futs:
+            for res in fut.result() or []:
+                results.append({
+                    "type": "EMBASSY",
+                    "category": "领事提醒",
+                    "title": res['title'],
+                    "snippet": res['body'],
+                    "source": "中国驻南非使领馆",
+                    "url": res['href'],
+                    "date": ""
+                })
+
+    finally:
+        # 未被采用的对冲请求不再等待，已在途的结果仍会写入缓存
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return dedupe_news(results)
+
+# --- 去重：URL 归一化 + MinHash 近似聚类 ---
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_")
+MINHASH_PERM = 64            # 签名长度
+MINHASH_BANDS = 16           # LSH 分桶：16 段 × 4 行，相似度 ~0.5 以上才会成为候选
+NEAR_DUP_THRESHOLD = 0.5     # 估计 Jaccard 相似度阈值
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(20240601)
+_MINHASH_COEFFS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(MINHASH_PERM)]
+
+def normalize_url(url):
+    """去掉协议、www/amp/m 前缀、跟踪参数、锚点和末尾斜杠，同一篇文章得到同一个 key"""
+    try:
+        parts = urlsplit(str(url).strip())
+    except ValueError:
+        return str(url).strip().lower()
+    host = parts.netloc.lower()
+    for prefix in ("www.", "amp.", "m."):
+        if host.startswith(prefix): host = host[len(prefix):]
+    path = re.sub(r"/(amp|amp\.html)/?$", "", parts.path).rstrip("/")
+    query = [(k, v) for k, v in parse_qsl(parts.query) if not k.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit(("", host, path, urlencode(sorted(query)), "")).lstrip("/")
+
+def _shingles(text, k=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def _minhash(shingles):
+    hashes = [zlib.crc32(sh.encode("utf-8")) for sh in shingles] or [0]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _MINHASH_COEFFS]
+
+def _similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / MINHASH_PERM
+
+@trace.traced("news.dedupe")
+def dedupe_news(results):
+    """同一新闻被多家媒体转载时只保留一条代表，来源合并到 source / related_urls"""
+    # 1. 完全相同的 URL 直接合并
+    by_url = {}
+    items = []
+    for item in results:
+        key = normalize_url(item['url'])
+        if key in by_url:
+            by_url[key]['_members'].append(item)
+            continue
+        item = dict(item, _members=[item])
+        by_url[key] = item
+        items.append(item)
+
+    # 2. 标题+摘要 MinHash，LSH 分桶找候选对，再用签名估算相似度确认
+    parent = list(range(len(items)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = MINHASH_PERM // MINHASH_BANDS
+    sigs = [_minhash(_shingles(f"{it['title']} {it['snippet']}")) for it in items]
+    buckets = {}
+    for i, sig in enumerate(sigs):
+        for band in range(MINHASH_BANDS):
+            key = (items[i]['type'], band, tuple(sig[band * rows:(band + 1) * rows]))
+            for j in buckets.setdefault(key, []):
+                if find(i) != find(j) and _similarity(sig, sigs[j]) >= NEAR_DUP_THRESHOLD:
+                    parent[find(i)] = find(j)
+            buckets[key].append(i)
+
+    # 3. 每个簇保留最先出现的一条 (话题优先级顺序)，合并来源
+    clusters = {}
+    for i, item in enumerate(items):
+        clusters.setdefault(find(i), []).append(item)
+
+    deduped = []
+    for members in clusters.values():
+        rep = {k: v for k, v in members[0].items() if k != '_members'}
+        sources, urls = [], []
+        for m in (x for c in members for x in c['_members']):
+            if m['source'] not in sources: sources.append(m['source'])
+            if m['url'] not in urls: urls.append(m['url'])
+        rep['source'] = " / ".join(sources)
+        rep['related_urls'] = urls[1:]
+        deduped.append(rep)
+    return deduped
+
+# --- 本地资讯档案 (SQLite + FTS5) ---
+ARCHIVE_DB = "oonce_news_archive.db"
+
+def open_archive(db_path=None):
+    conn = sqlite3.connect(db_path or ARCHIVE_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY, type TEXT, category TEXT, title TEXT, snippet TEXT,
+            source TEXT, url TEXT, published TEXT, first_seen TEXT);
+        CREATE TABLE IF NOT EXISTS seen_urls (url_key TEXT PRIMARY KEY, item_id INTEGER);
+        CREATE TABLE IF NOT EXISTS topic_runs (topic TEXT PRIMARY KEY, last_run TEXT);
+        CREATE TABLE IF NOT EXISTS history_facts (day TEXT PRIMARY KEY, fact TEXT);
+        CREATE INDEX IF NOT EXISTS idx_items_first_seen ON items(first_seen);
+    """)
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+                     "title, snippet, source, category, content='items', content_rowid='id')")
+    except sqlite3.OperationalError:
+        pass  # 老版本 SQLite 没有 FTS5，搜索退回 LIKE
+    return conn
+
+def _has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='items_fts'").fetchone() is not None
+
+def load_last_runs(topics, db_path=None):
+    with closing(open_archive(db_path)) as conn:
+        rows = conn.execute("SELECT topic, last_run FROM topic_runs").fetchall()
+    runs = {r['topic']: parse_news_date(r['last_run']) for r in rows}
+    return {t: runs[t] for t in topics if runs.get(t)}
+
+@trace.traced("news.archive_write")
+def archive_results(results, topics, db_path=None):
+    """写入档案并返回首次出现的条目 (任一转载 URL 已存在即视为旧闻)。
+    topics 只传本次搜索成功的话题，只有它们的 last_run 会推进"""
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    new_items = []
+    with closing(open_archive(db_path)) as conn, conn:
+        fts = _has_fts(conn)
+        for item in results:
+            keys = {normalize_url(u) for u in [item['url']] + item.get('related_urls', [])}
+            marks = ",".join("?" * len(keys))
+            if conn.execute(f"SELECT 1 FROM seen_urls WHERE url_key IN ({marks})", list(keys)).fetchone():
+                continue
+            cur = conn.execute(
+                "INSERT INTO items (type, category, title, snippet, source, url, published, first_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (item['type'], item['category'], item['title'], item['snippet'],
+                 item['source'], item['url'], item.get('date', ''), now))
+            conn.executemany("INSERT OR IGNORE INTO seen_urls VALUES (?, ?)", [(k, cur.lastrowid) for k in keys])
+            if fts:
+                conn.execute("INSERT INTO items_fts (rowid, title, snippet, source, category) VALUES (?, ?, ?, ?, ?)",
+                             (cur.lastrowid, item['title'], item['snippet'], item['source'], item['category']))
+            new_items.append(dict(item, first_seen=now))
+        conn.executemany("INSERT OR REPLACE INTO topic_runs VALUES (?, ?)", [(t, now) for t in topics])
+    return new_items
+
+@trace.traced("news.archive_search")
+def search_archive(query, limit=50, db_path=None):
+    """离线检索历史资讯，不访问 DuckDuckGo"""
+    terms = query.split()
+    if not terms: return []
+    with closing(open_archive(db_path)) as conn:
+        if _has_fts(conn):
+            match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+            rows = conn.execute(
+                "SELECT items.* FROM items_fts JOIN items ON items.id = items_fts.rowid "
+                "WHERE items_fts MATCH ? ORDER BY rank LIMIT ?", (match, limit)).fetchall()
+        else:
+            where = " AND ".join("(title LIKE ? OR snippet LIKE ?)" for _ in terms)
+            params = [p for t in terms for p in (f"%{t}%", f"%{t}%")]
+            rows = conn.execute(f"SELECT * FROM items WHERE {where} ORDER BY first_seen DESC LIMIT ?",
+                                params + [limit]).fetchall()
+    return [dict(r) for r in rows]
+
+def get_daily_history_fact(llm, db_path=None):
+    """每天只生成一次历史趣闻，存在档案里复用"""
+    today = datetime.date.today().isoformat()
+    with closing(open_archive(db_path)) as conn:
+        row = conn.execute("SELECT fact FROM history_facts WHERE day = ?", (today,)).fetchone()
+    if row:
+        trace.incr("cache_hits")
+        return row['fact']
+    fact = get_history_fun_fact(llm)
+    with closing(open_archive(db_path)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO history_facts VALUES (?, ?)", (today, fact))
+    return fact
+
+# --- 文章生成 ---
+# llm(prompt) -> (text, err)；stream_llm(prompt) -> 文本片段生成器。页面/命令行传入 Gemini，离线时传桩
+
+def get_history_fun_fact(llm):
+    prompt = """
+    Generate a concise, interesting "Fun Fact" or "On This Day" story about South African history.
+    It could be about Gold Rush, Nelson Mandela, Zulu Kingdom, or Cape Town history.
+    Max 80 words.
+    """
+    fact, _ = llm(prompt)
+    return fact if fact else "Did you know? South Africa has 3 capital cities!"
+
+EMPTY_NEWS_MSG = "未找到任何数据，AI无法生成文章。请尝试放宽搜索条件或增加话题。"
+
+# --- 提示词预算 ---
+ARTICLE_TOKEN_BUDGET = 6000   # 整个提示词 (含模板和趣闻) 的 token 上限
+_CJK = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+def estimate_tokens(text):
+    """粗估 token 数：中日韩字符约 1 字 1 token，其余约 4 字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def rank_news_items(news_data):
+    """使领馆公告永远在前；新闻按话题优先级 (TOPIC_OPTIONS 顺序)，同话题内越新越靠前"""
+    def recency(item):
+        published = parse_news_date(item.get('date') or item.get('first_seen') or "")
+        return -published.timestamp() if published else 0.0
+    def priority(item):
+        cat = item['category']
+        return TOPIC_OPTIONS.index(cat) if cat in TOPIC_OPTIONS else len(TOPIC_OPTIONS)
+
+    embassy = [it for it in news_data if it['type'] == 'EMBASSY']
+    others = [it for it in news_data if it['type'] != 'EMBASSY']
+    return embassy + sorted(others, key=lambda it: (priority(it), recency(it)))
+
+def _item_line(item, snippet_chars):
+    snippet = item['snippet'] or ""
+    if snippet_chars is not None and len(snippet) > snippet_chars:
+        snippet = snippet[:snippet_chars].rstrip() + "…" if snippet_chars else ""
+    body = f"{item['title']}: {snippet}" if snippet else item['title']
+    prefix = "🚨 " if item['type'] == 'EMBASSY' else "• "
+    return f"{prefix}[{item['category']}] {body} (Source: {item['source']})\n"
+
+def fit_items_to_budget(news_data, budget_tokens):
+    """按优先级装入预算：先统一截短摘要 (二分找能放下的最大长度)，仍放不下再从末尾丢弃新闻 (公告不丢)"""
+    ranked = rank_news_items(news_data)
+    def render(snippet_chars):
+        lines = [(it, _item_line(it, snippet_chars)) for it in ranked]
+        return lines, sum(estimate_tokens(line) for _, line in lines)
+
+    lines, cost = render(None)
+    if cost <= budget_tokens:
+        return lines
+    lo, hi = 0, max(len(it['snippet'] or "") for it in ranked)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if render(mid)[1] <= budget_tokens: lo = mid
+        else: hi = mid - 1
+    lines, cost = render(lo)
+    if cost <= budget_tokens:
+        return lines
+
+    kept, used = [], 0
+    for item, line in lines:
+        cost = estimate_tokens(line)
+        if item['type'] != 'EMBASSY' and used + cost > budget_tokens:
+            break
+        kept.append((item, line))
+        used += cost
+    return kept
+
+@trace.traced("news.build_prompt")
+def build_article_prompt(news_data, history_fact, token_budget=None):
+    budget = token_budget or ARTICLE_TOKEN_BUDGET
+    template = """
+    You are the Chief Editor of "OONCE South Africa Daily" (OONCE南非日报).
+    Task: Write a viral WeChat Official Account article for Chinese expats.
+    
+    Input Data:
+    [EMBASSY NOTICES (TOP PRIORITY)]:
+    {embassy_text}
+    
+    [NEWS]:
+    {news_text}
+    
+    [HISTORY FACT]:
+    {history_fact}
+    
+    Requirements:
+    1. **Language**: Chinese (Simplified).
+    2. **Headline**: Clickbait/Urgent (e.g., "紧急！" or "注意！").
+    3. **Structure**:
+       - **Part 1 🚨**: Embassy notices (Priority). If none, say "今日无重要领事提醒".
+       - **Part 2 📰**: General News summary. Group by topic.
+       - **Part 3 📜**: History story (Translate the fact).
+       - **Ending**: "关注OONCE，南非生活不迷路。"
+    """
+    fixed = estimate_tokens(template) + estimate_tokens(history_fact or "")
+    lines = fit_items_to_budget(news_data, max(budget - fixed, 0))
+
+    embassy_text = "".join(line for item, line in lines if item['type'] == 'EMBASSY')
+    news_text = "".join(line for item, line in lines if item['type'] != 'EMBASSY')
+    return template.format(embassy_text=embassy_text, news_text=news_text, history_fact=history_fact)
+
+def generate_viral_article(news_data, history_fact, llm, token_budget=None):
+    if not news_data: return None, EMPTY_NEWS_MSG
+    return llm(build_article_prompt(news_data, history_fact, token_budget))
+
+def generate_viral_article_stream(news_data, history_fact, stream_llm, token_budget=None):
+    """流式版本：返回文本片段生成器，供 st.write_stream 逐字渲染"""
+    if not news_data: raise ValueError(EMPTY_NEWS_MSG)
+    return stream_llm(build_article_prompt(news_data, history_fact, token_budget))
@@ -0,0 +1,38 @@
+"""隐藏的 "⏱️ Performance" 侧边栏面板 (唯一依赖 Streamlit 的 oonce 模块)
+
+URL 加 ?perf=1 或设置环境变量 OONCE_PERF_PANEL=1 时显示。页面脚本末尾调用 render_perf_panel。
+"""
+import io
+import os
+
+import streamlit as st
+
+from oonce import trace
+
+def perf_panel_enabled():
+    return st.query_params.get("perf") == "1" or os.environ.get("OONCE_PERF_PANEL") == "1"
+
+def render_perf_panel(page_name, max_runs=5):
+    """结束本次运行的追踪，并在开启时把最近几次运行的 span / 计数器画到侧边栏"""
+    trace.end_run()
+    if not perf_panel_enabled():
+        return
+    import pandas as pd
+    runs = trace.recent_runs(page_name)[:max_runs]
+    with st.sidebar.expander("⏱️ Performance", expanded=False):
+        if not runs:
+            st.caption("暂无记录")
+        for run in runs:
+            total_ms = sum(s["ms"] for s in run.spans if s["parent"] is None)
+            st.markdown(f"**{run.id}** · {len(run.spans)} spans · {total_ms:,.0f} ms")
+            if run.counters:
+                st.caption(" | ".join(f"{k}: {v:,}" for k, v in sorted(run.counters.items())))
+            if run.spans:
+                df = pd.DataFrame(run.spans)
+                summary = df.groupby("name")["ms"].agg(["count", "sum", "max"]).sort_values("sum", ascending=False)
+                st.dataframe(summary.round(1), use_container_width=True)
+
+        buf = io.StringIO()
+        trace.export_jsonl(buf, runs)
+        st.download_button("📥 JSONL", buf.getvalue().encode("utf-8"), f"trace_{page_name}.jsonl")
+        st.download_button("📥 Prometheus", trace.prometheus_text().encode("utf-8"), "oonce_metrics.txt")
@@ -0,0 +1,187 @@
+"""供应商档案：从 Invoice Manager 表格里的人工更正学习，下次识别同一家时少犯同样的错
+
+    corrections 表    每处更正一行 (mode, 名称, 字段, 原值, 改后值)，和台账放在同一目录
+    load_profiles     按名称汇总：名称别名、发票号格式与易混字符、常用币种、金额/日期易错提示
+    prompt_hints      更正最多的几家写进识别提示词
+    apply_profile     识别结果按档案纠正 (别名 -> 正式名称、发票号易混字符、曾被改过的币种)
+
+金额不自动改，只靠提示词和原有的 Subtotal + VAT = Total 校验。
+表格里只有改前/改后的值，没有原件和坐标，所以只学值的规律 (格式、易混字符、币种)，不学字段在版面上的位置。
+"""
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from contextlib import closing
+
+from oonce import trace
+
+PROFILES_DB = "oonce_profiles.db"
+MAX_HINT_NAMES = 15     # 提示词里最多写几家
+MAX_ROWS = 5000         # 汇总时只看最近的更正
+FIELDS = ("{entity}", "Invoice No", "Date", "Currency", "Subtotal", "VAT", "Total")
+AMOUNT_FIELDS = ("Subtotal", "VAT", "Total")
+
+def open_profiles(db_path=None):
+    conn = sqlite3.connect(db_path or PROFILES_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS corrections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, mode TEXT, name TEXT, field TEXT,
+            wrong TEXT, right TEXT, created REAL);
+        CREATE INDEX IF NOT EXISTS idx_corrections_name ON corrections(mode, name);
+    """)
+    return conn
+
+def db_for(ledger):
+    """档案库跟着台账走 (各工作区各自一份)"""
+    return os.path.join(os.path.dirname(ledger.path), PROFILES_DB)
+
+def _entity(mode):
+    return "Vendor" if mode == "input" else "Client"
+
+def mask(value):
+    """发票号格式键：数字统一换成 #"""
+    return re.sub(r"\d", "#", value)
+
+# --- 记录更正 ---
+
+def _text(series):
+    return series.fillna("").astype(str).str.strip().str.upper()
+
+def _numeric(series):
+    import pandas as pd
+    return pd.to_numeric(series.astype(str).str.replace(",", "").str.strip(), errors="coerce")
+
+def diff_corrections(before, after, mode):
+    """表格保存前后逐行比较 (只看两边都有的行，新增/删除的行不算更正)，返回 [(名称, 字段, 原值, 改后值)]"""
+    entity = _entity(mode)
+    common = before.index.intersection(after.index)
+    if common.empty:
+        return []
+    names = _text(after.loc[common, entity]) if entity in after else None
+    out = []
+    for field in (f.format(entity=entity) for f in FIELDS):
+        if field not in before or field not in after: continue
+        old, new = before.loc[common, field], after.loc[common, field]
+        if field in AMOUNT_FIELDS:
+            old_n, new_n = _numeric(old), _numeric(new)
+            changed = (old_n - new_n).abs().fillna(1) > 0.005
+            changed &= new_n.notna()
+            old, new = old_n.round(2).astype(str), new_n.round(2).astype(str)
+        else:
+            old, new = _text(old), _text(new)
+            changed = (old != new) & (new != "")
+        for idx in changed[changed].index:
+            name = names[idx] if names is not None else ""
+            out.append((name, "Name" if field == entity else field, old[idx], new[idx]))
+    return out
+
+def record_corrections(mode, before, after, db_path=None):
+    """保存表格后调用，返回记下的更正数"""
+    rows = diff_corrections(before, after, mode)
+    if rows:
+        now = time.time()
+        with closing(open_profiles(db_path)) as conn, conn:
+            conn.executemany("INSERT INTO corrections (mode, name, field, wrong, right, created) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(mode, name, field, wrong, right, now) for name, field, wrong, right in rows])
+    return len(rows)
+
+# --- 汇总档案 ---
+
+def _total_kind(wrong, right):
+    """金额错在哪：小数点 (差 10/100/1000 倍) 或取错了数"""
+    try:
+        wrong, right = float(wrong), float(right)
+    except ValueError:
+        return "other"
+    if wrong and right:
+        ratio = max(wrong, right) / min(wrong, right) if min(wrong, right) > 0 else 0
+        if any(abs(ratio - 10 ** k) < 0.01 * 10 ** k for k in (1, 2, 3)):
+            return "decimal"
+    return "other"
+
+def _is_day_month_swap(wrong, right):
+    w = re.match(r"(\d{4})-(\d{2})-(\d{2})", wrong); r = re.match(r"(\d{4})-(\d{2})-(\d{2})", right)
+    return bool(w and r) and (w[1], w[2], w[3]) == (r[1], r[3], r[2])
+
+@trace.traced("profiles.load")
+def load_profiles(mode, db_path=None):
+    """{名称: {"count", "aliases", "shapes", "confusions", "currency", "currency_fix", "total", "date_swap"}}"""
+    if db_path and not os.path.exists(db_path):
+        return {}
+    with closing(open_profiles(db_path)) as conn:
+        rows = conn.execute("SELECT name, field, wrong, right FROM corrections WHERE mode = ? ORDER BY id DESC LIMIT ?",
+                            (mode, MAX_ROWS)).fetchall()
+    profiles = {}
+    for r in rows:
+        name = r["right"] if r["field"] == "Name" else r["name"]
+        if not name: continue
+        p = profiles.setdefault(name, {"count": 0, "aliases": set(), "shapes": Counter(), "confusions": {},
+                                       "currency": Counter(), "currency_fix": {}, "total": Counter(), "date_swap": 0})
+        p["count"] += 1
+        wrong, right = r["wrong"], r["right"]
+        if r["field"] == "Name":
+            if wrong: p["aliases"].add(wrong)
+        elif r["field"] == "Invoice No":
+            p["shapes"][mask(right)] += 1
+            if len(wrong) == len(right):
+                for a, b in zip(wrong, right):
+                    if a != b: p["confusions"].setdefault(a, b)
+        elif r["field"] == "Currency":
+            p["currency"][right] += 1
+            if wrong: p["currency_fix"].setdefault(wrong, right)    # 最近一次更正优先；原来为空的不算误读
+        elif r["field"] == "Total":
+            p["total"][_total_kind(wrong, right)] += 1
+        elif r["field"] == "Date":
+            p["date_swap"] += _is_day_month_swap(wrong, right)
+    for p in profiles.values():
+        # 某个币种也被人工确认过是对的 (改成过它)，说明这家确实会开该币种的票，不再自动改
+        p["currency_fix"] = {w: r for w, r in p["currency_fix"].items() if w not in p["currency"]}
+    return profiles
+
+def prompt_hints(profiles, limit=MAX_HINT_NAMES):
+    """更正最多的几家写成提示词附加段 (没有档案返回空串)"""
+    lines = []
+    for name, p in sorted(profiles.items(), key=lambda kv: -kv[1]["count"])[:limit]:
+        notes = []
+        if p["aliases"]: notes.append("may be misread as " + ", ".join(f'"{a}"' for a in sorted(p["aliases"])[:3]))
+        if p["shapes"]: notes.append("invoice numbers look like " + " or ".join(s for s, _ in p["shapes"].most_common(2)) + " (# = digit)")
+        if p["currency"]: notes.append(f"currency is {p['currency'].most_common(1)[0][0]}")
+        if p["total"]["decimal"]: notes.append("check the decimal point of the Total")
+        elif p["total"]: notes.append("Total was misread before, it must equal Subtotal + VAT")
+        if p["date_swap"]: notes.append("dates are written DD/MM/YYYY")
+        if notes: lines.append(f"    - {name}: " + "; ".join(notes))
+    if not lines:
+        return ""
+    return "\n    KNOWN COMPANY NOTES (learned from our accountants' corrections):\n" + "\n".join(lines) + "\n"
+
+def _fix_invoice_no(inv_no, p):
+    shapes = p["shapes"]
+    if not shapes or mask(inv_no) in shapes:
+        return inv_no
+    fixed = "".join(p["confusions"].get(c, c) for c in inv_no)
+    return fixed if mask(fixed) in shapes else inv_no
+
+def apply_profile(res, mode, profiles):
+    """按档案纠正一条识别结果 (返回新 dict)；名称不在档案里原样返回"""
+    if not profiles or not isinstance(res, dict):
+        return res
+    key = "vendor" if mode == "input" else "client"
+    name = str(res.get(key, "")).strip().upper()
+    if name not in profiles:
+        name = next((n for n, p in profiles.items() if name in p["aliases"]), None)
+        if name is None:
+            return res
+    p = profiles[name]
+    fixed = dict(res, **{key: name})
+    inv_no = str(res.get("invoice_number", "")).strip().upper()
+    if inv_no:
+        fixed["invoice_number"] = _fix_invoice_no(inv_no, p)
+    currency = str(res.get("currency", "")).strip().upper()
+    if currency and currency in p["currency_fix"]:    # 只改成当初被更正过的那个误读值
+        fixed["currency"] = p["currency_fix"][currency]
+    changed = sum(str(fixed.get(k, "")).upper() != str(res.get(k, "")).upper() for k in (key, "invoice_number", "currency"))
+    if changed: trace.incr("profile.fixes", changed)
+    return fixed
@@ -0,0 +1,84 @@
+"""Project Quoter 核心逻辑：工程清单识别、定价策略、货车物流测算"""
+import io
+import math
+
+from oonce import trace
+from oonce.gemini import text_part, file_part, mime_for, extract_json
+
+TRUCK_PAYLOAD_KG = 34000.0     # Superlink 载重
+TRUCK_VOLUME_M3 = 108.0 * 0.9  # 容积按 90% 装载率
+
+PROMPT_BASE = """
+    You are an expert Quantity Surveyor.
+    Task: Analyze Project List.
+    Requirements:
+    1. Extract: Item, Spec, Quantity.
+    2. Price (USD): Estimate `china_price` and `sa_price` (0 if unavailable).
+    3. Logistics: Estimate `weight_kg` and `volume_m3` per unit.
+    Output JSON ONLY:
+    [
+      {"item": "Item A", "spec": "Spec", "quantity": 10, "china_price": 5.0, "sa_price": 0, "weight_kg": 1, "volume_m3": 0.01}
+    ]
+    """
+
+@trace.traced("quote.analyze")
+def analyze_project_list(file_name, bytes_data, llm):
+    """返回 (行列表, 错误信息)。Excel 先转成文本再发给模型，图片/PDF 直接上传"""
+    file_ext = file_name.lower().split('.')[-1]
+
+    if file_ext in ['xlsx', 'xls']:
+        import pandas as pd
+        try:
+            df = pd.read_excel(io.BytesIO(bytes_data))
+            if df.empty: return [], "Excel is empty."
+            df = df.fillna("")
+            excel_text = df.to_string(index=False)
+            parts = [text_part(PROMPT_BASE + f"\nData:\n{excel_text}")]
+        except Exception as e: return [], f"Excel Error: {str(e)}"
+    else:
+        parts = [text_part(PROMPT_BASE), file_part(bytes_data, mime_for(file_name))]
+
+    text, err = llm.generate(parts)
+    if err: return [], err
+    try:
+        data = extract_json(text, r'\[.*\]')
+    except Exception:
+        data = None
+    return (data, None) if data else ([], text)
+
+def project_frame(raw_data):
+    import pandas as pd
+    return pd.DataFrame(raw_data)
+
+@trace.traced("quote.logistics_price")
+def calculate_logistics_and_price(df, freight_rate, china_markup, profit_margin):
+    import pandas as pd
+    for col in ['quantity', 'china_price', 'sa_price', 'weight_kg', 'volume_m3']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    def get_strategy_price(row):
+        if row['sa_price'] > 0: return row['sa_price']
+        else: return row['china_price'] * china_markup
+
+    df['base_price'] = df.apply(get_strategy_price, axis=1)
+    df['final_unit_price'] = df['base_price'] * (1 + profit_margin / 100.0)
+    df['subtotal_product'] = df['quantity'] * df['final_unit_price']
+
+    total_weight = (df['quantity'] * df['weight_kg']).sum()
+    total_volume = (df['quantity'] * df['volume_m3']).sum()
+
+    num_trucks = math.ceil(max(total_weight / TRUCK_PAYLOAD_KG, total_volume / TRUCK_VOLUME_M3))
+    if num_trucks < 1: num_trucks = 1
+
+    total_freight = num_trucks * (freight_rate * 34.0)
+    grand_total = df['subtotal_product'].sum() + total_freight
+
+    summary = {
+        "total_product_value": df['subtotal_product'].sum(),
+        "num_trucks": num_trucks,
+        "total_freight": total_freight,
+        "grand_total": grand_total,
+        "total_weight": total_weight / 1000.0,
+        "total_volume": total_volume
+    }
+    return df, summary
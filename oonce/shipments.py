@@ -0,0 +1,174 @@
+"""Import Master 批量模式：多票货 (每票一份装箱单) 的工作区
+
+    shipments 表         每票的参数 (名称、报价币种、报关汇率、目标金额、当地费用、预计到港日、状态)
+    shipment_lines 表    每票识别出的明细行 (可在页面上改完保存)
+
+装箱单并发识别 (共用工作区的模型调用额度)，识别完逐票入库；到岸成本把所有票的明细拼成一张表，
+每行带上所属那票的汇率一次算完再按票汇总；现金流按预计到港日汇总 PRN (关税 + 进口 VAT) 和当地费用。
+库文件跟工作区走 (Workspace.shipments_db)。
+"""
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from oonce import trace
+from oonce.imports import analyze_packing_list, packing_frame, line_costs
+
+SHIPMENTS_DB = "oonce_shipments.db"
+SHIPMENT_MAX_WORKERS = 4     # 同时识别的装箱单数
+LINE_COLUMNS = ["description", "quantity", "hs_code", "duty_rate", "unit_price"]
+UNSCHEDULED = "unscheduled"  # 没填预计到港日的票
+
+def open_shipments(db_path=None):
+    conn = sqlite3.connect(db_path or SHIPMENTS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS shipments (
+            id TEXT PRIMARY KEY, name TEXT, source TEXT, currency TEXT, exchange_rate REAL,
+            target_total REAL, fees TEXT, eta TEXT, status TEXT, error TEXT, created REAL, updated REAL);
+        CREATE TABLE IF NOT EXISTS shipment_lines (
+            shipment_id TEXT, line INTEGER, description TEXT, quantity REAL, hs_code TEXT,
+            duty_rate REAL, unit_price REAL, PRIMARY KEY (shipment_id, line));
+        CREATE INDEX IF NOT EXISTS idx_shipments_eta ON shipments(status, eta);
+    """)
+    return conn
+
+def create_shipment(name, currency, exchange_rate, target_total, fees, eta=None, source="", db_path=None):
+    """新建一票 (状态 analyzing)，返回 id。fees 为 {费用名: ZAR}，eta 为预计到港日 (date 或 YYYY-MM-DD)"""
+    shipment_id = uuid.uuid4().hex[:8]
+    now = time.time()
+    with closing(open_shipments(db_path)) as conn, conn:
+        conn.execute("INSERT INTO shipments (id, name, source, currency, exchange_rate, target_total, fees, eta, status, created, updated) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'analyzing', ?, ?)",
+                     (shipment_id, name, source, currency, float(exchange_rate or 0), float(target_total or 0),
+                      json.dumps(fees or {}), str(eta)[:10] if eta else None, now, now))
+    return shipment_id
+
+def update_shipment(shipment_id, db_path=None, **fields):
+    """改一票的参数 (name / currency / exchange_rate / target_total / fees / eta / status / error)"""
+    if "fees" in fields: fields["fees"] = json.dumps(fields["fees"] or {})
+    if "eta" in fields: fields["eta"] = str(fields["eta"])[:10] if fields["eta"] else None
+    cols = [c for c in fields if c in ("name", "currency", "exchange_rate", "target_total", "fees", "eta", "status", "error")]
+    if not cols:
+        return
+    with closing(open_shipments(db_path)) as conn, conn:
+        conn.execute(f"UPDATE shipments SET {', '.join(f'{c} = ?' for c in cols)}, updated = ? WHERE id = ?",
+                     [fields[c] for c in cols] + [time.time(), shipment_id])
+
+def delete_shipment(shipment_id, db_path=None):
+    with closing(open_shipments(db_path)) as conn, conn:
+        conn.execute("DELETE FROM shipment_lines WHERE shipment_id = ?", (shipment_id,))
+        conn.execute("DELETE FROM shipments WHERE id = ?", (shipment_id,))
+
+def save_lines(shipment_id, df, db_path=None):
+    """整票替换明细行 (df 至少有 LINE_COLUMNS 里的列，缺的补空)"""
+    import pandas as pd
+    df = df.reindex(columns=LINE_COLUMNS)
+    for col in ("quantity", "unit_price", "duty_rate"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
+    rows = [(shipment_id, i, str(d if pd.notna(d) else ""), float(q), str(h if pd.notna(h) else ""), float(r), float(p))
+            for i, (d, q, h, r, p) in enumerate(df[LINE_COLUMNS].itertuples(index=False, name=None))]
+    with closing(open_shipments(db_path)) as conn, conn:
+        conn.execute("DELETE FROM shipment_lines WHERE shipment_id = ?", (shipment_id,))
+        conn.executemany("INSERT INTO shipment_lines (shipment_id, line, description, quantity, hs_code, duty_rate, unit_price) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("UPDATE shipments SET updated = ? WHERE id = ?", (time.time(), shipment_id))
+
+def list_shipments(include_closed=False, db_path=None):
+    """所有票 (DataFrame，按预计到港日排序，fees 已解析成 dict)"""
+    import pandas as pd
+    sql = "SELECT * FROM shipments" + ("" if include_closed else " WHERE status != 'closed'") + " ORDER BY eta IS NULL, eta, created"
+    with closing(open_shipments(db_path)) as conn:
+        rows = [dict(r) for r in conn.execute(sql).fetchall()]
+    cols = ["id", "name", "source", "currency", "exchange_rate", "target_total", "fees", "eta", "status", "error", "created", "updated"]
+    df = pd.DataFrame(rows, columns=cols)
+    df["fees"] = df["fees"].map(lambda v: json.loads(v) if v else {})
+    return df
+
+def load_lines(shipment_ids=None, db_path=None):
+    """明细行 (DataFrame，带 shipment_id 列)；shipment_ids 为 None 时取全部"""
+    import pandas as pd
+    sql, params = "SELECT * FROM shipment_lines", []
+    if shipment_ids is not None:
+        shipment_ids = list(shipment_ids)
+        if not shipment_ids:
+            return pd.DataFrame(columns=["shipment_id", "line"] + LINE_COLUMNS)
+        sql += f" WHERE shipment_id IN ({','.join('?' * len(shipment_ids))})"; params = shipment_ids
+    with closing(open_shipments(db_path)) as conn:
+        rows = [dict(r) for r in conn.execute(sql + " ORDER BY shipment_id, line", params).fetchall()]
+    return pd.DataFrame(rows, columns=["shipment_id", "line"] + LINE_COLUMNS)
+
+# --- 并发识别 ---
+
+def _analyze_one(shipment_id, file_name, data, target_total, currency, llm, db_path):
+    try:
+        raw_data, debug_text = analyze_packing_list(file_name, data, target_total, llm, currency)
+        if not raw_data:
+            update_shipment(shipment_id, db_path, status="failed", error=str(debug_text or "")[:500])
+            return False
+        save_lines(shipment_id, packing_frame(raw_data), db_path)
+        update_shipment(shipment_id, db_path, status="ready", error=None)
+        return True
+    except Exception as e:
+        update_shipment(shipment_id, db_path, status="failed", error=str(e)[:500])
+        return False
+
+@trace.traced("shipments.analyze")
+def analyze_batch(files, llm, currency, exchange_rate, target_total, fees, eta=None, db_path=None,
+                  max_workers=SHIPMENT_MAX_WORKERS, on_progress=None):
+    """每份装箱单建一票并发识别 (参数先都用同一套，识别完可逐票改)。返回 {"ready": [id], "failed": [(文件名, 原因)]}"""
+    files = [(getattr(f, "name", None) or f"Packing_{i}.jpg", f.getvalue()) for i, f in enumerate(files)]
+    ids = [create_shipment(name.rsplit(".", 1)[0], currency, exchange_rate, target_total, fees, eta, name, db_path)
+           for name, _ in files]
+    ok = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="oonce-shipment") as pool:
+        futures = [pool.submit(trace.bind(_analyze_one), sid, name, data, target_total, currency, llm, db_path)
+                   for sid, (name, data) in zip(ids, files)]
+        for done, f in enumerate(futures, 1):
+            ok.append(f.result())
+            if on_progress: on_progress(done / len(futures))
+    failed = list_shipments(db_path=db_path).set_index("id")["error"].to_dict()
+    return {"ready": [sid for sid, good in zip(ids, ok) if good],
+            "failed": [(name, failed.get(sid) or "") for sid, (name, _), good in zip(ids, files, ok) if not good]}
+
+# --- 合并计算 ---
+
+@trace.traced("shipments.landed_costs")
+def landed_costs(shipments, lines):
+    """所有票一次算到岸成本：明细拼成一张表，每行带所属票的汇率向量化计算后按票汇总。
+    返回 (每票汇总 DataFrame, 带成本列的明细)。汇总列同 calculate_landed_cost 的汇总 (另有 Target / Diff / Lines)"""
+    import pandas as pd
+    cols = ["id", "name", "currency", "eta", "status", "exchange_rate", "Lines", "Target", "Total_FOB", "Diff",
+            "Total_FOB_ZAR", "Total_PRN_ZAR", "Total_Local_Fees", "Landing_Cash_Required"]
+    if shipments.empty:
+        return pd.DataFrame(columns=cols), lines
+    params = shipments.set_index("id")
+    lines = line_costs(lines.copy(), lines["shipment_id"].map(params["exchange_rate"]).fillna(0.0))
+    per = lines.groupby("shipment_id").agg(Lines=("line", "size"), Total_FOB=("subtotal", "sum"), Total_FOB_ZAR=("FOB_ZAR", "sum"),
+                                           Duty=("Duty_Amt_ZAR", "sum"), VAT=("VAT_Amt_ZAR", "sum"))
+    out = params[["name", "currency", "eta", "status", "exchange_rate"]].join(per).fillna({c: 0 for c in per.columns})
+    out["Lines"] = out["Lines"].astype(int)
+    out["Target"] = params["target_total"]
+    out["Diff"] = out["Total_FOB"] - out["Target"]
+    out["Total_PRN_ZAR"] = out.pop("Duty") + out.pop("VAT")
+    out["Total_Local_Fees"] = params["fees"].map(lambda fees: float(sum(fees.values())))
+    out["Landing_Cash_Required"] = out["Total_PRN_ZAR"] + out["Total_Local_Fees"]
+    return out.rename_axis("id").reset_index()[cols], lines
+
+def cashflow_timeline(costs, freq="W"):
+    """按预计到港日汇总落地现金 (freq: D 按天 / W 按周 / M 按月)，附累计。没填到港日的单列一行 unscheduled"""
+    import pandas as pd
+    cols = ["Arrival", "Shipments", "Total_PRN_ZAR", "Total_Local_Fees", "Landing_Cash_Required", "Cumulative"]
+    if costs.empty:
+        return pd.DataFrame(columns=cols)
+    eta = pd.to_datetime(costs["eta"], errors="coerce", format="ISO8601")
+    period = eta.dt.to_period(freq).dt.start_time.dt.strftime("%Y-%m-%d") if freq != "D" else eta.dt.strftime("%Y-%m-%d")
+    df = costs.assign(Arrival=period.fillna(UNSCHEDULED))
+    out = df.groupby("Arrival").agg(Shipments=("id", "size"), Total_PRN_ZAR=("Total_PRN_ZAR", "sum"),
+                                    Total_Local_Fees=("Total_Local_Fees", "sum"), Landing_Cash_Required=("Landing_Cash_Required", "sum"))
+    out = out.reset_index()     # YYYY-MM-DD 按字符串排序即日期升序，unscheduled 排在最后
+    out["Cumulative"] = out["Landing_Cash_Required"].cumsum()
+    return out.round(2).reset_index(drop=True)[cols]
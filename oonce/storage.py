@@ -0,0 +1,197 @@
+"""发票台账存储 (可替换)。默认每种台账一个 CSV 文件
+
+多个会话 / 后台任务同时写同一本台账时：追加和整表覆盖都在文件锁 (<台账>.lock) 内进行，
+覆盖先写临时文件再原子替换；读取持共享锁，不会读到写了一半的行。
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from oonce import summary, trace
+
+try:
+    import fcntl
+except ImportError:  # Windows：退化为进程内锁
+    fcntl = None
+
+FILE_INPUT = "oonce_input_v4.csv"
+FILE_OUTPUT = "oonce_output_v4.csv"
+TAIL_BLOCK = 1 << 16     # read_tail 每次往前读的字节数
+
+class LedgerConflict(Exception):
+    """台账在读取之后被别人改过 (保存表格编辑时检测)"""
+
+_held = threading.local()      # 当前线程已持有的锁：path -> (fd, 是否独占, 重入深度)
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+def _process_lock(path):
+    with _process_locks_guard:
+        return _process_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+@contextmanager
+def file_lock(path, shared=False):
+    """跨进程文件锁 (<path>.lock)；同一线程可重入 (独占锁内再拿共享锁直接放行)。
+    持共享锁时再要独占锁会和自己的共享锁互相等待，直接抛 RuntimeError"""
+    held = getattr(_held, "locks", None)
+    if held is None:
+        held = _held.locks = {}
+    key = os.path.abspath(path)
+    if key in held and not held[key][1] and not shared:
+        raise RuntimeError(f"持有共享锁时不能升级为独占锁: {path}")
+    if key in held and (held[key][1] or shared):
+        fd, exclusive, depth = held[key]
+        held[key] = (fd, exclusive, depth + 1)
+        try:
+            yield
+        finally:
+            fd, exclusive, depth = held[key]
+            held[key] = (fd, exclusive, depth - 1)
+        return
+
+    with trace.span("ledger.lock_wait", shared=shared):
+        if fcntl:
+            fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            fd = _process_lock(path)
+            fd.acquire()
+    held[key] = (fd, not shared, 1)
+    try:
+        yield
+    finally:
+        del held[key]
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN); os.close(fd)
+        else:
+            fd.release()
+
+class CsvLedger:
+    def __init__(self, path, summary_db=None):
+        self.path = path
+        self.summary_db = summary_db    # 首页汇总表 (oonce.summary)，None 为默认位置
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def version(self):
+        """(inode, 大小, 修改时间, 覆盖代数)。只有追加时 inode 和代数不变、大小变大；
+        整表覆盖会换 inode 并把代数加一 (inode 可能被复用，单看 inode 不可靠)。文件不存在返回 None"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, self._generation())
+
+    def _generation(self):
+        """覆盖代数 (<台账>.gen)，每次 overwrite 加一；没有该文件为 0"""
+        try:
+            with open(self.path + ".gen", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def lock(self, shared=False):
+        return file_lock(self.path, shared)
+
+    def read(self, **kwargs):
+        import pandas as pd
+        with self.lock(shared=True), trace.span("ledger.read", path=self.path) as attrs:
+            df = pd.read_csv(self.path, **kwargs)
+            attrs["rows"] = len(df)
+        return df
+
+    def read_since(self, version, **kwargs):
+        """读取 version 之后追加的行。期间文件被整表覆盖过 (或原先不存在) 返回 None，调用方需全量重读。
+        判定为覆盖：inode 或覆盖代数变了、文件变小、或大小没变但修改时间变了 (原地改写)"""
+        import pandas as pd
+        with self.lock(shared=True):
+            current = self.version()
+            if version is None or current is None or len(version) != len(current):
+                return None
+            (ino, size, mtime, gen), (old_ino, old_size, old_mtime, old_gen) = current, version
+            if ino != old_ino or gen != old_gen or size < old_size or (size == old_size and mtime != old_mtime):
+                return None
+            with open(self.path, "rb") as f:
+                header = f.readline()
+                f.seek(version[1])
+                tail = f.read()
+        return pd.read_csv(io.BytesIO(header + tail), **kwargs)
+
+    def read_tail(self, n, **kwargs):
+        """最后 n 行 (从文件尾往前按块读，不解析整个文件)。不足 n 行时就是整表"""
+        import pandas as pd
+        with self.lock(shared=True), open(self.path, "rb") as f:
+            header = f.readline()
+            start, pos, buf = len(header), f.seek(0, os.SEEK_END), b""
+            while pos > start and buf.count(b"\n") <= n:
+                step = min(TAIL_BLOCK, pos - start)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        lines = buf.splitlines(keepends=True)
+        if pos > start: lines = lines[1:]     # 第一行可能只读到半截
+        return pd.read_csv(io.BytesIO(header + b"".join(lines[-n:])), **kwargs)
+
+    def append(self, df):
+        with self.lock(), trace.span("ledger.append", path=self.path, rows=len(df)):
+            before = self.version()
+            if before: df.to_csv(self.path, mode='a', header=False, index=False, encoding='utf-8-sig')
+            else: df.to_csv(self.path, mode='w', header=True, index=False, encoding='utf-8-sig')
+            summary.record_ledger_write(self.path, before, self.version(), len(df), _frame_total(df), db_path=self.summary_db)
+
+    def totals(self):
+        """(行数, Total 合计)。优先用写入时维护的汇总；对不上当前版本时重读 Total 列并回写汇总"""
+        version = self.version()
+        if version is None:
+            return 0, 0.0
+        cached, fresh = summary.ledger_summary(self.path, version, self.summary_db)
+        if fresh:
+            return cached["rows"], cached["total"]
+        with self.lock(shared=True):
+            version = self.version()
+            df = self.read(usecols=['Total'])
+        rows, total = len(df), _frame_total(df)
+        summary.record_ledger_write(self.path, None, version, rows, total, replace=True, db_path=self.summary_db)
+        return rows, total
+
+    def overwrite(self, df, expected_version=None):
+        """原子替换整表。给了 expected_version 时，文件在此之后被改过就抛 LedgerConflict"""
+        with self.lock(), trace.span("ledger.overwrite", path=self.path, rows=len(df)):
+            if expected_version is not None and self.version() != expected_version:
+                raise LedgerConflict(self.path)
+            fd, tmp = tempfile.mkstemp(prefix=".ledger_", suffix=".csv", dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+                    df.to_csv(f, index=False)
+                if self.exists(): shutil.copymode(self.path, tmp)  # mkstemp 默认 0600
+                self._bump_generation()
+                os.replace(tmp, self.path)
+                summary.record_ledger_write(self.path, None, self.version(), len(df), _frame_total(df), replace=True,
+                                            db_path=self.summary_db)
+            except BaseException:
+                if os.path.exists(tmp): os.remove(tmp)
+                raise
+
+    def _bump_generation(self):
+        # 在替换台账之前加一：即便替换后崩溃，旧版本号也不会再和新文件对上
+        gen_tmp = f"{self.path}.gen.tmp"
+        with open(gen_tmp, "w", encoding="utf-8") as f:
+            f.write(str(self._generation() + 1))
+        os.replace(gen_tmp, self.path + ".gen")
+
+def _frame_total(df):
+    """Total 列合计 (金额可能带千分位逗号)"""
+    if 'Total' not in df: return 0.0
+    import pandas as pd
+    return round(float(pd.to_numeric(df['Total'].astype(str).str.replace(',', ''), errors='coerce').sum()), 2)
+
+def get_ledger(mode, root=None):
+    """mode: input (进项/成本) / output (销项/收入)。root 为工作区目录 (见 oonce.workspace)，None 为当前目录"""
+    name = FILE_INPUT if mode == "input" else FILE_OUTPUT
+    if root is None:
+        return CsvLedger(name)
+    return CsvLedger(os.path.join(root, name), summary_db=os.path.join(root, summary.SUMMARY_DB))
@@ -0,0 +1,81 @@
+"""离线桩：替代 DuckDuckGo 和 Gemini，用于无网络环境下跑通整条流水线"""
+import hashlib
+import json
+import time
+
+_WORDS = ("rand eskom port durban visa home affairs police taxi strike school rates property cape town "
+          "johannesburg minister budget tariff water outage freight court election bank loan fuel price").split()
+
+class StubSearch:
+    """DDGS 接口的确定性替身：同一查询永远返回同样的结果 (不同查询的标题互不相似，不会被去重合并)"""
+    latency = 0.0
+
+    def _fake(self, keywords, max_results):
+        items = []
+        for i in range(max_results):
+            digest = hashlib.md5(f"{keywords}|{i}".encode("utf-8")).hexdigest()
+            words = [_WORDS[int(digest[k:k + 2], 16) % len(_WORDS)] for k in range(0, 24, 2)]
+            items.append({
+                "title": f"[stub] {' '.join(words[:6])}",
+                "body": f"{' '.join(words[6:])} ({digest[:8]})",
+                "source": "Stub News",
+                "url": f"https://stub.local/news/{digest[:8]}",
+                "href": f"https://stub.local/notice/{digest[:8]}",
+                "date": "",
+            })
+        return items
+
+    def news(self, keywords, region=None, timelimit=None, max_results=2):
+        time.sleep(self.latency)
+        return self._fake(keywords, max_results)
+
+    def text(self, keywords, region=None, timelimit=None, max_results=1):
+        time.sleep(self.latency)
+        return self._fake(keywords, max_results)
+
+def stub_llm(prompt):
+    """llm(prompt) -> (text, err) 的替身"""
+    if "Fun Fact" in prompt:
+        return "[stub] Did you know? South Africa has 3 capital cities!", None
+    return f"# [stub] OONCE南非日报\n\n(离线模式，提示词 {len(prompt)} 字符)\n\n关注OONCE，南非生活不迷路。", None
+
+def stub_stream_llm(prompt):
+    text, _ = stub_llm(prompt)
+    for line in text.splitlines(keepends=True):
+        yield line
+
+class StubGemini:
+    """GeminiClient 的离线替身：按提示词类型返回固定格式的 JSON，同一文件永远得到同一结果"""
+    latency = 0.0
+
+    def _seed(self, parts):
+        blob = "".join(p.get("text", "") + p.get("inline_data", {}).get("data", "") for p in parts)
+        return int(hashlib.md5(blob.encode("utf-8")).hexdigest()[:8], 16)
+
+    def generate(self, parts, timeout=None):
+        time.sleep(self.latency)
+        prompt = parts[0].get("text", "")
+        seed = self._seed(parts)
+        if "financial auditor" in prompt:
+            entity_key = "vendor" if '"vendor"' in prompt else "client"
+            subtotal = round(100 + seed % 90000 / 10, 2)
+            return json.dumps({
+                "date": f"2024-{seed % 12 + 1:02d}-{seed % 28 + 1:02d}",
+                "invoice_number": f"INV-{seed % 100000:05d}",
+                entity_key: f"STUB TRADING {seed % 50}",
+                "subtotal": subtotal, "vat": round(subtotal * 0.15, 2), "total": round(subtotal * 1.15, 2),
+                "currency": "ZAR",
+            }), None
+        if "Customs Broker" in prompt:
+            return json.dumps([{"description": f"STUB ITEM {i}", "quantity": 10 * (i + 1), "hs_code": "7318.15",
+                                "duty_rate": 15, "unit_price": 5.0 + i} for i in range(5)]), None
+        if "Quantity Surveyor" in prompt:
+            return json.dumps([{"item": f"Stub item {i}", "spec": "STD", "quantity": 10 * (i + 1), "china_price": 5.0 + i,
+                                "sa_price": 0, "weight_kg": 2.0, "volume_m3": 0.01} for i in range(5)]), None
+        return stub_llm(prompt)
+
+    def complete(self, prompt):
+        return self.generate([{"text": prompt}])
+
+    def stream(self, prompt):
+        return stub_stream_llm(prompt)
@@ -0,0 +1,101 @@
+"""跨模块汇总表：各模块写入时顺手更新，首页 KPI 只读这里 (一次 SQLite 查询，不扫台账、不联网)
+
+    ledger:<台账路径>     {"rows", "total", "version"}   CsvLedger 追加/覆盖时增量维护
+    import.last_landing   最近一次 Import Master 的到岸现金测算
+    news.latest_digest    最近一次生成的日报
+    quotes 表             Project Quoter 保存的报价 (open / closed)
+"""
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+SUMMARY_DB = "oonce_summary.db"
+
+def open_summary(db_path=None):
+    conn = sqlite3.connect(db_path or SUMMARY_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS kpis (key TEXT PRIMARY KEY, value TEXT, updated REAL);
+        CREATE TABLE IF NOT EXISTS quotes (
+            id TEXT PRIMARY KEY, name TEXT, grand_total REAL, num_trucks INTEGER,
+            status TEXT, created REAL, closed REAL);
+        CREATE INDEX IF NOT EXISTS idx_quotes_status ON quotes(status);
+    """)
+    return conn
+
+def put(key, value, db_path=None):
+    with closing(open_summary(db_path)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO kpis (key, value, updated) VALUES (?, ?, ?)",
+                     (key, json.dumps(value, ensure_ascii=False), time.time()))
+
+def get(key, default=None, db_path=None):
+    with closing(open_summary(db_path)) as conn:
+        row = conn.execute("SELECT value FROM kpis WHERE key = ?", (key,)).fetchone()
+    return json.loads(row['value']) if row else default
+
+def get_all(db_path=None):
+    """{key: (value, updated)}"""
+    with closing(open_summary(db_path)) as conn:
+        rows = conn.execute("SELECT key, value, updated FROM kpis").fetchall()
+    return {r['key']: (json.loads(r['value']), r['updated']) for r in rows}
+
+# --- 台账合计 ---
+
+def ledger_key(path):
+    return f"ledger:{path}"
+
+def record_ledger_write(path, before, after, rows, total, replace=False, db_path=None):
+    """台账写入后调用 (持台账锁)。追加时在 before 版本的汇总上累加；汇总对不上 (如 CSV 被外部改过) 则标记失效"""
+    key = ledger_key(path)
+    with closing(open_summary(db_path)) as conn, conn:
+        row = conn.execute("SELECT value FROM kpis WHERE key = ?", (key,)).fetchone()
+        current = json.loads(row['value']) if row else None
+        if replace or before is None:
+            value = {"rows": rows, "total": total, "version": list(after)}
+        elif current and current.get("version") == list(before):
+            value = {"rows": current["rows"] + rows, "total": round(current["total"] + total, 2), "version": list(after)}
+        else:
+            value = dict(current or {"rows": 0, "total": 0.0}, version=None)
+        conn.execute("INSERT OR REPLACE INTO kpis (key, value, updated) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), time.time()))
+
+def ledger_summary(path, version, db_path=None):
+    """(汇总, 是否与 version 一致)。没有汇总返回 (None, False)"""
+    value = get(ledger_key(path), db_path=db_path)
+    if value is None:
+        return None, False
+    return value, version is not None and value.get("version") == list(version)
+
+# --- Import Master ---
+
+def record_landing(landing, source="", db_path=None):
+    """记录最近一次到岸成本测算 (landing 为 calculate_landed_cost 返回的汇总)"""
+    value = {k: round(float(landing[k]), 2) for k in ("Total_FOB", "Total_PRN_ZAR", "Landing_Cash_Required")}
+    put("import.last_landing", dict(value, currency=landing.get("Currency", "USD"), source=source), db_path)
+    return value
+
+# --- 报价登记 ---
+
+def save_quote(name, grand_total, num_trucks, db_path=None):
+    quote_id = uuid.uuid4().hex[:8]
+    with closing(open_summary(db_path)) as conn, conn:
+        conn.execute("INSERT INTO quotes (id, name, grand_total, num_trucks, status, created) VALUES (?, ?, ?, ?, 'open', ?)",
+                     (quote_id, name, float(grand_total), int(num_trucks), time.time()))
+    return quote_id
+
+def close_quote(quote_id, db_path=None):
+    with closing(open_summary(db_path)) as conn, conn:
+        conn.execute("UPDATE quotes SET status = 'closed', closed = ? WHERE id = ?", (time.time(), quote_id))
+
+def open_quotes(limit=20, db_path=None):
+    with closing(open_summary(db_path)) as conn:
+        return [dict(r) for r in conn.execute(
+            "SELECT * FROM quotes WHERE status = 'open' ORDER BY created DESC LIMIT ?", (limit,)).fetchall()]
+
+def open_quote_totals(db_path=None):
+    """(张数, 合计金额)"""
+    with closing(open_summary(db_path)) as conn:
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(grand_total), 0) FROM quotes WHERE status = 'open'").fetchone()
+    return row[0], row[1]
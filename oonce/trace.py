@@ -0,0 +1,143 @@
+"""轻量级追踪：span 计时 + 每次运行的计数器 (API 调用、发送字节、缓存命中、重试)
+
+设计目标是常开：每个 span 只有两次 perf_counter 和一次列表追加，不做任何 I/O。
+导出为 JSONL (每行一个 span / 运行汇总) 或 Prometheus 文本格式。
+
+    run = trace.begin_run("invoice_manager")    # 页面脚本开头 / 命令行入口
+    with trace.span("gemini.generate", model=name):
+        ...
+    trace.incr("api_calls")
+    pool.submit(trace.bind(fn), ...)              # 线程池里的任务归到同一次运行
+    trace.end_run(run)                            # 设置了 OONCE_TRACE_FILE 时追加写 JSONL
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("OONCE_TRACE", "1") != "0"
+TRACE_FILE = os.environ.get("OONCE_TRACE_FILE", "")
+MAX_RUNS = 100             # 内存里保留最近多少次运行
+MAX_SPANS_PER_RUN = 5000   # 单次运行 span 上限，防止超大批次占内存
+
+_current_run = contextvars.ContextVar("oonce_trace_run", default=None)
+_current_span = contextvars.ContextVar("oonce_trace_span", default=None)
+_lock = threading.Lock()
+
+class Run:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.counters = Counter()
+        self.dropped = 0
+
+    def to_dict(self):
+        return {"type": "run", "run": self.id, "name": self.name, "started": self.started,
+                "spans": len(self.spans), "dropped_spans": self.dropped, "counters": dict(self.counters)}
+
+_runs = deque(maxlen=MAX_RUNS)
+_background = Run("background")
+_totals = Counter()
+_span_stats = {}   # name -> [count, total_ms, max_ms]
+
+def begin_run(name):
+    """开始一次运行 (一次页面渲染 / 一次批处理)，之后当前线程里的 span 和计数都记在它名下"""
+    run = Run(name)
+    with _lock:
+        _runs.append(run)
+    _current_run.set(run)
+    _current_span.set(None)
+    return run
+
+def current_run():
+    return _current_run.get() or _background
+
+def end_run(run=None):
+    run = run or current_run()
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            export_jsonl(f, [run])
+    return run
+
+def recent_runs(name=None):
+    with _lock:
+        runs = list(_runs)
+    return [r for r in reversed(runs) if name is None or r.name == name]
+
+def incr(key, n=1):
+    if not ENABLED or not n: return
+    run = current_run()
+    with _lock:
+        run.counters[key] += n
+        _totals[key] += n
+
+@contextmanager
+def span(name, **attrs):
+    """计时一段代码；attrs 里可以在 with 块内继续补充 (如响应状态码)"""
+    if not ENABLED:
+        yield attrs
+        return
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start_wall, start = time.time(), time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        run = current_run()
+        record = {"name": name, "start": start_wall, "ms": round(ms, 3), "parent": parent, "attrs": attrs}
+        with _lock:
+            if len(run.spans) < MAX_SPANS_PER_RUN: run.spans.append(record)
+            else: run.dropped += 1
+            stats = _span_stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1; stats[1] += ms; stats[2] = max(stats[2], ms)
+
+def traced(name):
+    """装饰器版 span"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def bind(fn):
+    """把当前运行/父 span 带进线程池任务 (ThreadPoolExecutor 不会自动传递 contextvars)"""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn)
+
+def export_jsonl(f, runs=None):
+    """每个 span 一行，每次运行再追加一行汇总 (type=run)"""
+    for run in runs if runs is not None else recent_runs():
+        for s in list(run.spans):
+            f.write(json.dumps(dict(s, type="span", run=run.id, run_name=run.name), ensure_ascii=False, default=str) + "\n")
+        f.write(json.dumps(run.to_dict(), ensure_ascii=False) + "\n")
+
+def prometheus_text():
+    """进程累计值，Prometheus 文本格式"""
+    lines = ["# TYPE oonce_events_total counter"]
+    with _lock:
+        totals = dict(_totals)
+        stats = {k: list(v) for k, v in _span_stats.items()}
+    for key, value in sorted(totals.items()):
+        lines.append(f'oonce_events_total{{event="{key}"}} {value}')
+    lines += ["# TYPE oonce_span_seconds summary"]
+    for name, (count, total_ms, _) in sorted(stats.items()):
+        lines.append(f'oonce_span_seconds_count{{span="{name}"}} {count}')
+        lines.append(f'oonce_span_seconds_sum{{span="{name}"}} {total_ms / 1000:.6f}')
+    lines += ["# TYPE oonce_span_seconds_max gauge"]
+    for name, (_, _, max_ms) in sorted(stats.items()):
+        lines.append(f'oonce_span_seconds_max{{span="{name}"}} {max_ms / 1000:.6f}')
+    return "\n".join(lines) + "\n"
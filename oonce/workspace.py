@@ -0,0 +1,144 @@
+"""公司工作区 (多租户)：每个工作区一个目录，台账 / 任务表 / 汇总表 / 快照 / 批量货运各自独立
+
+    workspaces/acme/oonce_input_v4.csv
+    workspaces/acme/oonce_jobs.db
+    workspaces/acme/workspace.json     # {"name": "Acme (Pty) Ltd", "gemini_key": "GEMINI_KEY_ACME", "rpm": 30}
+
+default 工作区沿用当前目录下原来的文件，老数据无需迁移。gemini_key 为 secrets / 环境变量里的键名，
+不配置则用全局 GEMINI_KEY；rpm 为该工作区所有页面、后台任务共用的每分钟模型调用额度。
+"""
+import json
+import os
+import re
+import threading
+
+from oonce import jobs, summary
+from oonce.gemini import RateBudget
+from oonce.storage import get_ledger
+
+WORKSPACE_ROOT = "workspaces"
+DEFAULT_WORKSPACE = "default"
+DEFAULT_RPM = 60
+_SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+class Workspace:
+    def __init__(self, slug, root=None):
+        self.slug = slug
+        self.root = root    # None = 当前目录 (default 工作区)
+
+    def path(self, name):
+        return os.path.join(self.root, name) if self.root else name
+
+    @property
+    def config(self):
+        if not self.root:
+            return {}
+        try:
+            with open(self.path("workspace.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def name(self):
+        return self.config.get("name") or self.slug
+
+    @property
+    def jobs_db(self):
+        return self.path(jobs.JOBS_DB)
+
+    @property
+    def summary_db(self):
+        return self.path(summary.SUMMARY_DB) if self.root else None
+
+    @property
+    def shipments_db(self):
+        from oonce.shipments import SHIPMENTS_DB
+        return self.path(SHIPMENTS_DB)
+
+    @property
+    def snapshot_dir(self):
+        from oonce.analytics import SNAPSHOT_DIR
+        return self.path(SNAPSHOT_DIR)
+
+    def ledger(self, mode):
+        return get_ledger(mode, self.root)
+
+    def api_key(self, default="", secrets=None):
+        """工作区自己的 Gemini Key (secrets 优先，其次环境变量)，没配置用 default"""
+        key_name = self.config.get("gemini_key")
+        if key_name:
+            try:
+                if secrets is not None and key_name in secrets: return str(secrets[key_name]).strip()
+            except Exception: pass
+            if os.environ.get(key_name): return os.environ[key_name].strip()
+        return default
+
+    def rpm(self):
+        """workspace.json 里的 rpm；没填或不是数字用 DEFAULT_RPM，小于 1 按 1 算"""
+        try:
+            return max(1, int(self.config.get("rpm", DEFAULT_RPM)))
+        except (TypeError, ValueError):
+            return DEFAULT_RPM
+
+    def budget(self):
+        """该工作区共用的调用额度 (进程内按工作区单例)"""
+        with _budgets_lock:
+            if self.slug not in _budgets:
+                _budgets[self.slug] = RateBudget(self.rpm())
+            return _budgets[self.slug]
+
+def get_workspace(slug=None):
+    slug = slug or DEFAULT_WORKSPACE
+    if slug == DEFAULT_WORKSPACE:
+        return Workspace(DEFAULT_WORKSPACE)
+    if not _SLUG_RE.match(slug):
+        raise ValueError(f"无效的工作区名: {slug}")
+    return Workspace(slug, os.path.join(WORKSPACE_ROOT, slug))
+
+def list_workspaces():
+    slugs = []
+    if os.path.isdir(WORKSPACE_ROOT):
+        slugs = sorted(d for d in os.listdir(WORKSPACE_ROOT)
+                       if _SLUG_RE.match(d) and os.path.isdir(os.path.join(WORKSPACE_ROOT, d)))
+    return [DEFAULT_WORKSPACE] + [s for s in slugs if s != DEFAULT_WORKSPACE]
+
+def create_workspace(slug, name="", rpm=DEFAULT_RPM, gemini_key=""):
+    ws = get_workspace(slug.strip().lower())
+    if not ws.root:
+        return ws
+    os.makedirs(ws.root, exist_ok=True)
+    if not os.path.exists(ws.path("workspace.json")):
+        config = {"name": name or ws.slug, "rpm": rpm}
+        if gemini_key: config["gemini_key"] = gemini_key
+        with open(ws.path("workspace.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+    return ws
+
+def select_workspace():
+    """侧边栏工作区选择 (各页面共用，选择存在会话里，也可用 ?ws=<slug> 直达)，返回 Workspace"""
+    import streamlit as st
+    options = list_workspaces()
+    active = st.session_state.get("active_workspace") or st.query_params.get("ws")
+    if active not in options:
+        active = DEFAULT_WORKSPACE
+
+    with st.sidebar:
+        # 不设 key：选项/默认值变了就是新控件，切换页面后也不会残留旧选择
+        slug = st.selectbox("🏢 Workspace", options, index=options.index(active),
+                            format_func=lambda s: get_workspace(s).name)
+        with st.expander("➕ New Workspace"):
+            new_slug = st.text_input("ID (a-z, 0-9, -)", key="new_ws_slug")
+            new_name = st.text_input("Company Name", key="new_ws_name")
+            if st.button("Create", key="new_ws_btn"):
+                try:
+                    st.session_state["active_workspace"] = create_workspace(new_slug, new_name).slug
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+    st.session_state["active_workspace"] = slug
+    st.query_params["ws"] = slug
+    return get_workspace(slug)
@@ -1,12 +1,16 @@
 import streamlit as st
-import pandas as pd
-import requests
-import json
-import os
-import base64
+import datetime
 import time
-import yfinance as yf
-from datetime import datetime, timedelta
+import uuid
+
+from oonce import profiles, trace
+from oonce.fx import get_rate_matrix
+from oonce.gemini import GeminiClient
+from oonce.invoices import calculate_metrics, entity_label, migrate_ledger, reprocess_flagged
+from oonce.jobs import enqueue_invoices, get_job, get_worker, list_jobs, ACTIVE_STATUSES
+from oonce.storage import CsvLedger, LedgerConflict
+from oonce.perf_panel import render_perf_panel
+from oonce.workspace import get_workspace, select_workspace
 
 # --- 1. 安全配置 (这是唯一的修改点) ---
 try:
@@ -16,11 +20,10 @@ except Exception:
     st.error("🚨 未检测到 API Key！请在 Streamlit 后台 Settings -> Secrets 中配置 GEMINI_KEY。")
     st.stop()
 
-FILE_INPUT = "oonce_input_v4.csv"
-FILE_OUTPUT = "oonce_output_v4.csv"
-
 # 设置页面
 st.set_page_config(page_title="OONCE Finance", layout="wide", page_icon="📈")
+trace.begin_run("invoice_manager")
+ws = select_workspace()
 
 # --- 2. CSS 美化 ---
 st.markdown("""
@@ -42,243 +45,144 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 3. 核心逻辑 ---
-
-def get_available_model():
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={API_KEY}"
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            # 优先寻找 flash
-            for model in data.get('models', []):
-                name = model['name'].replace('models/', '')
-                if 'flash' in name and 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return name
-            # 兜底
-            for model in data.get('models', []):
-                if 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return model['name'].replace('models/', '')
-    except:
-        pass
-    return "gemini-1.5-flash"
-
-def get_historical_zar_rate(date_str):
-    try:
-        inv_date = datetime.strptime(date_str, "%Y-%m-%d")
-        start_date = inv_date - timedelta(days=5)
-        end_date = inv_date + timedelta(days=1)
-        data = yf.download("ZAR=X", start=start_date, end=end_date, progress=False)
-        if not data.empty: return float(data['Close'].iloc[-1])
-        return None
-    except: return None
-
-def extract_invoice_data(uploaded_file, mode="input"):
-    model_name = get_available_model()
-    
-    mime_type = "image/jpeg"
-    if hasattr(uploaded_file, 'name') and uploaded_file.name.lower().endswith('.pdf'): 
-        mime_type = "application/pdf"
-    
-    bytes_data = uploaded_file.getvalue()
-    base64_data = base64.b64encode(bytes_data).decode('utf-8')
-    
-    target_entity = "Vendor/Supplier Name" if mode == "input" else "Client/Customer Name"
-    entity_key = "vendor" if mode == "input" else "client"
-    
-    prompt = f"""
-    You are an expert financial auditor OCR system. 
-    Task: Extract invoice data into JSON.
-
-    CRITICAL INSTRUCTIONS FOR ACCURACY:
-    1. **TOTAL AMOUNT**: Look for "Total Due", "Balance Due", "Grand Total". Be extremely careful with decimal points.
-    2. **DATE**: Identify the main Invoice Date. Format: YYYY-MM-DD.
-    3. **INVOICE NO**: Extract the unique Invoice Number.
-    4. **{target_entity}**: Extract the full company name.
-    5. **NO HALLUCINATIONS**: If the image is blurry or not an invoice, return {{"error": "Image unclear/Not invoice"}}.
-    
-    Output JSON format:
-    {{
-        "date": "YYYY-MM-DD", 
-        "invoice_number": "STRING", 
-        "{entity_key}": "STRING", 
-        "subtotal": NUMBER, 
-        "vat": NUMBER, 
-        "total": NUMBER, 
-        "currency": "USD" or "ZAR"
-    }}
-    """
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-    headers = {'Content-Type': 'application/json'}
-    payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": mime_type, "data": base64_data}}]}]}
-
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
-        if response.status_code == 200:
-            text = response.json()['candidates'][0]['content']['parts'][0]['text']
-            clean_text = text.replace('```json', '').replace('```', '').strip()
-            return json.loads(clean_text)
-        else:
-            return {"error": f"API Error {response.status_code} (Model: {model_name})"}
-    except Exception as e: return {"error": str(e)}
-
-def load_existing_signatures(csv_file):
-    signatures = set()
-    if os.path.exists(csv_file):
-        try:
-            df = pd.read_csv(csv_file)
-            for _, row in df.iterrows():
-                inv_no = str(row.get('Invoice No', '')).strip().upper()
-                try: 
-                    raw_val = float(str(row.get('Total', 0)).replace(',', ''))
-                    total = round(raw_val, 2)
-                except: 
-                    total = 0.0
-                signatures.add((inv_no, total))
-        except: pass
-    return signatures
+# --- 3. 核心逻辑 (见 oonce/invoices.py，页面只负责展示) ---
+
+TAIL_ROWS = 500     # 表格默认只读最近这么多行 (首屏不解析整本台账)，需要时再加载全表
+
+@st.cache_resource
+def get_clients(api_key, slug):
+    """每个工作区一份：模型客户端 (共用该工作区的调用额度)、后台识别线程 (浏览器刷新/关闭不影响已提交的任务)；汇率矩阵全进程共用"""
+    workspace = get_workspace(slug)
+    llm = GeminiClient(api_key, prefer=("flash",), default_model="gemini-1.5-flash", budget=workspace.budget())
+    fx = get_rate_matrix()
+    get_worker(llm, fx, ledger_factory=workspace.ledger, db_path=workspace.jobs_db)
+    return llm, fx
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_ledger(path, version):
+    """按台账版本缓存整表，台账没变时重跑脚本不再解析 CSV"""
+    return CsvLedger(path).read()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_ledger_tail(path, version, n):
+    """按台账版本缓存最近 n 行 (从文件尾往前读)"""
+    return CsvLedger(path).read_tail(n)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def migrate_once(slug, mode, version):
+    """旧表头 Total (USD) -> Total (Original)，每个台账版本只检查一次"""
+    return migrate_ledger(get_workspace(slug).ledger(mode))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def ledger_metrics(slug, input_version, output_version):
+    workspace = get_workspace(slug)
+    return calculate_metrics(workspace.ledger("input"), workspace.ledger("output"))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def refresh_reports(slug, input_version, output_version):
+    """按台账版本刷新快照，台账没变时重跑脚本不再检查/重建快照"""
+    from oonce import analytics
+    workspace = get_workspace(slug)
+    return analytics.refresh_snapshots(workspace.snapshot_dir, workspace.ledger)
+
+llm, fx = get_clients(ws.api_key(API_KEY, st.secrets), ws.slug)
+session_tag = st.session_state.setdefault("session_tag", uuid.uuid4().hex[:6])
+my_jobs_key = f"my_jobs_{ws.slug}"   # 任务 id 只在所属工作区的任务表里有效
+job_reports_key = f"job_reports_{ws.slug}"
 
 def process_and_save(files, mode, allow_duplicates):
-    csv_file = FILE_INPUT if mode == "input" else FILE_OUTPUT
-    entity_label = "Vendor" if mode == "input" else "Client"
-    key_name = "vendor" if mode == "input" else "client"
-    
-    existing_signatures = load_existing_signatures(csv_file)
-    current_batch_signatures = set()
-    
-    progress_bar = st.progress(0)
-    results = []
-    skipped_files = []
-    failed_files = [] 
-    
-    for i, file in enumerate(files):
-        fname = getattr(file, 'name', f"Photo_{datetime.now().strftime('%H%M%S')}.jpg")
-        
-        try:
-            res = extract_invoice_data(file, mode=mode)
-            
-            if not isinstance(res, dict):
-                failed_files.append(f"{fname} (系统响应异常)")
-                continue
-                
-            if "error" in res:
-                failed_files.append(f"{fname} ({res['error']})")
-                continue
-
-            if "date" in res and ("total" in res or "subtotal" in res):
-                raw_inv_no = str(res.get("invoice_number", "UNKNOWN")).strip().upper()
-                raw_entity_name = str(res.get(key_name, "UNKNOWN")).strip().upper()
-                currency = str(res.get("currency", "ZAR")).upper()
+    job_id = enqueue_invoices(files, mode, allow_duplicates, owner=session_tag, db_path=ws.jobs_db)
+    st.session_state.setdefault(my_jobs_key, []).append(job_id)
+    st.toast(f"📥 已加入后台队列 ({len(files)} 个文件)，可继续操作", icon="⏳")
 
-                try:
-                    raw_subtotal = round(float(str(res.get("subtotal", 0)).replace(',', '').replace(' ', '')), 2)
-                    raw_vat = round(float(str(res.get("vat", 0)).replace(',', '').replace(' ', '')), 2)
-                    raw_total = round(float(str(res.get("total", 0)).replace(',', '').replace(' ', '')), 2)
-                except:
-                    failed_files.append(f"{fname} (金额识别失败)")
-                    continue
-
-                signature = (raw_inv_no, raw_total)
-                is_duplicate_history = signature in existing_signatures
-                is_duplicate_batch = signature in current_batch_signatures
-                
-                if (is_duplicate_history or is_duplicate_batch) and not allow_duplicates:
-                    skipped_files.append(f"{fname}")
-                    continue
-                
-                row = {
-                    "Date": res.get("date"), 
-                    "Invoice No": raw_inv_no,       
-                    entity_label: raw_entity_name,  
-                    "Currency": currency,           
-                    "Subtotal": raw_subtotal, 
-                    "VAT": raw_vat, 
-                    "Total": raw_total,
-                    "Total (USD)": "", "Exchange Rate": 1.0, 
-                    "Validation": "", "File Name": fname
-                }
-                
-                if (is_duplicate_history or is_duplicate_batch) and allow_duplicates:
-                    row["Validation"] = "⚠️ DUPLICATE"
-                
-                if "USD" in currency:
-                    rate = get_historical_zar_rate(row["Date"])
-                    if not rate: rate = 1.0; row["Exchange Rate"] = "Error"
-                    else: row["Exchange Rate"] = round(rate, 4)
-                    
-                    converted_val = round(raw_subtotal * (rate if isinstance(rate, float) else 0), 2)
-                    row["Subtotal"] = converted_val; row["VAT"] = 0.0; row["Total"] = converted_val
-                    row["Total (USD)"] = raw_subtotal
-                    
-                    if "DUPLICATE" not in row["Validation"]: row["Validation"] = "✅ USD Auto"
-                else:
-                    row["Subtotal"] = raw_subtotal; row["VAT"] = raw_vat; row["Total"] = raw_total
-                    row["Total (USD)"] = ""; row["Exchange Rate"] = 1.0
-                    
-                    if "DUPLICATE" not in row["Validation"]:
-                        calc_total = round(row["Subtotal"] + row["VAT"], 2)
-                        if abs(calc_total - row["Total"]) < 0.2: row["Validation"] = "✅ OK"
-                        else: row["Validation"] = "❌ Math Error"
-                
-                results.append(row)
-                current_batch_signatures.add(signature)
-            else:
-                failed_files.append(f"{fname} (缺失关键字段)")
-        
-        except Exception as e:
-            failed_files.append(f"{fname} (未知错误: {str(e)})")
-
-        progress_bar.progress((i + 1) / len(files))
-
-    if skipped_files: st.toast(f"🚫 已跳过 {len(skipped_files)} 个重复文件", icon="🔕")
-    
-    if failed_files:
-        st.error(f"⚠️ 以下 {len(failed_files)} 个文件处理失败:")
-        for msg in failed_files: st.text(f"• {msg}")
-
-    if results:
-        st.toast(f"✅ 成功录入 {len(results)} 张新发票", icon="🎉")
-        df = pd.DataFrame(results)
-        core_cols = ["Date", "Invoice No", entity_label, "Subtotal", "VAT", "Total", "Currency"]
-        extra_cols = ["Validation", "File Name", "Total (USD)", "Exchange Rate"]
-        df = df[core_cols + extra_cols]
-        if os.path.exists(csv_file): df.to_csv(csv_file, mode='a', header=False, index=False, encoding='utf-8-sig')
-        else: df.to_csv(csv_file, mode='w', header=True, index=False, encoding='utf-8-sig')
-        time.sleep(1)
+def show_job_reports(mode):
+    """本会话已完成任务的结果 (由 show_job_status 收集后整页刷新时展示)"""
+    for job in st.session_state.get(job_reports_key, {}).pop(mode, []):
+        if job["status"] == "failed":
+            st.error(f"⚠️ 后台任务失败: {job['error']}"); continue
+        batch = job["result"]
+        if batch["skipped"]: st.toast(f"🚫 已跳过 {len(batch['skipped'])} 个重复文件", icon="🔕")
+        if batch["failed"]:
+            st.error(f"⚠️ 以下 {len(batch['failed'])} 个文件处理失败:")
+            for msg in batch["failed"]: st.text(f"• {msg}")
+        if batch["rows"]: st.toast(f"✅ 成功录入 {batch['rows']} 张新发票", icon="🎉")
+        if batch.get("possible"):
+            st.warning(f"🔍 {len(batch['possible'])} 张疑似重复 (发票号/金额近似)，已录入 (校验通过的标记 POSSIBLE DUPLICATE)，请核对:")
+            for msg in batch["possible"]: st.text(f"• {msg}")
+        if batch.get("local"): st.toast(f"⚡ 其中 {batch['local']} 张由本地模板识别 (未调用模型)", icon="⚡")
+
+@st.fragment(run_every=2)
+def show_job_status(mode):
+    """轮询任务表：显示排队/处理中的任务 (所有员工)，本会话的任务完成后刷新整页"""
+    for job in list_jobs(mode, active_only=True, db_path=ws.jobs_db):
+        who = "我" if job["owner"] == session_tag else job["owner"] or "—"
+        label = "排队中" if job["status"] == "queued" else f"处理中 {job['done']}/{job['total']}"
+        st.progress(job["done"] / max(job["total"], 1), text=f"⏳ [{who}] {job['total']} 个文件 · {label}")
+
+    finished = []
+    for job_id in list(st.session_state.get(my_jobs_key, [])):
+        job = get_job(job_id, ws.jobs_db)
+        if job and job["mode"] == mode and job["status"] not in ACTIVE_STATUSES:
+            st.session_state[my_jobs_key].remove(job_id)
+            finished.append(job)
+    if finished:
+        st.session_state.setdefault(job_reports_key, {}).setdefault(mode, []).extend(finished)
         st.rerun()
 
 def show_interactive_table(mode):
-    csv_file = FILE_INPUT if mode == "input" else FILE_OUTPUT
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file)
+    ledger = ws.ledger(mode)
+    migrate_once(ws.slug, mode, ledger.version())
+    if ledger.exists():
+        full = st.toggle("Load full ledger", key=f"full_{ws.slug}_{mode}")
+        with ledger.lock(shared=True):
+            version = ledger.version()
+            df = read_ledger(ledger.path, version) if full else read_ledger_tail(ledger.path, version, TAIL_ROWS)
+        partial = not full and len(df) >= TAIL_ROWS
+        if partial: st.caption(f"只显示最近 {TAIL_ROWS} 行 (保存时只替换这些行)，打开 Load full ledger 查看/下载全表")
+        editor_key = f"editor_{ws.slug}_{mode}_{'full' if full else 'tail'}"
         edited_df = st.data_editor(
-            df, key=f"editor_{mode}", num_rows="dynamic", use_container_width=True, hide_index=True,
+            df, key=editor_key, num_rows="dynamic", use_container_width=True, hide_index=True,
             column_config={"Validation": st.column_config.TextColumn("Status")}
         )
-        if not df.equals(edited_df):
+        # 开始编辑时的台账版本：期间别人只是追加新行不影响；整表被别人保存过则按冲突处理
+        base_key = f"editor_base_{ws.slug}_{mode}"
+        conflict_key = f"conflict_{ws.slug}_{mode}"
+        if df.equals(edited_df):
+            st.session_state[base_key] = version; st.session_state.pop(conflict_key, None)
+        else:
             if st.button(f"💾 Save Changes", key=f"save_{mode}"):
-                edited_df.to_csv(csv_file, index=False, encoding='utf-8-sig')
-                st.success("Saved!")
-                time.sleep(1); st.rerun()
-        st.download_button(f"📥 Download CSV", df.to_csv(index=False).encode('utf-8-sig'), f"OONCE_{mode.upper()}.csv")
+                try:
+                    base = st.session_state.get(base_key, version)
+                    if (base[0], base[-1]) != (version[0], version[-1]): raise LedgerConflict(ledger.path)   # inode / 覆盖代数
+                    if partial:
+                        # 只编辑了最近的行：读全表把最后 len(df) 行换成编辑结果
+                        import pandas as pd
+                        with ledger.lock():
+                            if ledger.version() != version: raise LedgerConflict(ledger.path)
+                            head = ledger.read().iloc[:-len(df)]
+                            ledger.overwrite(pd.concat([head, edited_df], ignore_index=True), expected_version=version)
+                    else:
+                        ledger.overwrite(edited_df, expected_version=version)
+                    # 记下人工更正 (名称/发票号/金额/币种)，下次识别同一家时参考
+                    try: learned = profiles.record_corrections(mode, df, edited_df, profiles.db_for(ledger))
+                    except Exception: learned = 0
+                    st.success(f"Saved! 🧠 已记住 {learned} 处更正" if learned else "Saved!")
+                    time.sleep(1); st.rerun()
+                except LedgerConflict:
+                    st.session_state[conflict_key] = True
+            if st.session_state.get(conflict_key):
+                st.error("⚠️ 台账已被其他人修改，未保存。请放弃本次修改后重新编辑。")
+                if st.button("🔄 Discard & Reload", key=f"reload_{mode}"):
+                    for k in (editor_key, conflict_key, base_key): st.session_state.pop(k, None)
+                    st.rerun()
+        if not partial: st.download_button(f"📥 Download CSV", df.to_csv(index=False).encode('utf-8-sig'), f"OONCE_{mode.upper()}.csv")
     else: st.info("No records.")
 
-def calculate_metrics():
-    total_in = 0.0; total_out = 0.0
-    if os.path.exists(FILE_INPUT):
-        try: total_in = pd.read_csv(FILE_INPUT)['Total'].sum()
-        except: pass
-    if os.path.exists(FILE_OUTPUT):
-        try: total_out = pd.read_csv(FILE_OUTPUT)['Total'].sum()
-        except: pass
-    return total_in, total_out
-
 # --- 4. 页面布局 ---
 
 with st.sidebar:
     st.markdown("### 📊 Dashboard")
-    tot_in, tot_out = calculate_metrics()
+    tot_in, tot_out = ledger_metrics(ws.slug, ws.ledger("input").version(), ws.ledger("output").version())
     net_profit = tot_out - tot_in
     st.metric("Total Cost (Input)", f"R {tot_in:,.2f}", delta="-Cost", delta_color="inverse")
     st.metric("Total Revenue (Output)", f"R {tot_out:,.2f}", delta="+Rev")
@@ -320,6 +224,8 @@ with st.container(border=True):
             else:
                 st.warning("Please upload a file or take a photo.")
 
+    show_job_status("input")
+    show_job_reports("input")
     st.markdown("---")
     show_interactive_table("input")
 
@@ -348,5 +254,108 @@ with st.container(border=True):
             else:
                 st.warning("Please upload a file or take a photo.")
 
+    show_job_status("output")
+    show_job_reports("output")
     st.markdown("---")
     show_interactive_table("output")
+
+st.write("")
+
+# 板块 3: BULK IMPORT (会计系统导出 / 银行流水，分块读取、按块入账，见 oonce/bulk_import.py)
+with st.container(border=True):
+    st.markdown("### 📂 Bulk Import")
+    b1, b2 = st.columns(2)
+    with b1: bulk_mode = st.radio("Ledger", ["input", "output"], format_func=lambda m: "Input (Cost)" if m == "input" else "Output (Revenue)", horizontal=True, key="bulk_mode")
+    with b2: bulk_kind = st.radio("File Type", ["invoices", "bank"], format_func=lambda k: "Invoice Export" if k == "invoices" else "Bank Statement", horizontal=True, key="bulk_kind")
+    bulk_file = st.file_uploader("CSV / XLSX", type=["csv", "xlsx"], key="bulk_file")
+    if bulk_file:
+        from oonce import bulk_import
+        head = bulk_import.preview(bulk_file, bulk_file.name)
+        st.dataframe(head, use_container_width=True, hide_index=True)
+        columns = [""] + list(head.columns)
+        guess = bulk_import.guess_mapping(head.columns, bulk_kind)
+        mapping = {}
+        map_cols = st.columns(4)
+        for i, target in enumerate(bulk_import.TARGETS[bulk_kind]):
+            with map_cols[i % 4]:
+                label = target.replace("_", " ").title() if target != "party" else entity_label(bulk_mode)
+                choice = st.selectbox(label, columns, index=columns.index(guess.get(target, "")), key=f"bulk_map_{bulk_kind}_{bulk_file.name}_{target}")
+                if choice: mapping[target] = choice
+        allow_dup_bulk = st.checkbox("Allow Duplicates", value=False, key="dup_bulk")
+        if st.button("Import", key="btn_bulk"):
+            with st.status("Importing...", expanded=False) as status:
+                try:
+                    stats = bulk_import.import_file(
+                        bulk_file, bulk_mode, mapping, bulk_kind, fx=fx, ledger=ws.ledger(bulk_mode),
+                        allow_duplicates=allow_dup_bulk, name=bulk_file.name,
+                        on_progress=lambda s: status.update(label=f"Importing... {s['read']:,} rows read, {s['rows']:,} written"))
+                    status.update(label=f"✅ 写入 {stats['rows']:,} 行 | 重复跳过 {stats['skipped']:,} | 失败 {stats['failed']:,}", state="complete")
+                except ValueError as e:
+                    status.update(label=f"⚠️ {e}", state="error")
+
+st.write("")
+
+# 板块 4: REPORTS (查询按月分区的 Parquet 快照，只读需要的列和月份)
+with st.container(border=True):
+    st.markdown("### 📈 Reports")
+    if st.toggle("Show reports", key="show_reports"):
+        from oonce import analytics  # pyarrow 只在打开报表时加载
+        today = datetime.date.today()
+        r1, r2 = st.columns([3, 1])
+        with r1: date_range = st.date_input("Date Range", (today.replace(month=1, day=1), today), key="report_range")
+        with r2: period_months = st.selectbox("VAT Period", [1, 2], format_func=lambda m: "Monthly" if m == 1 else "Bi-monthly", key="vat_period")
+
+        if len(date_range) == 2:
+            start, end = date_range
+            with st.spinner("Refreshing snapshots..."):
+                refresh_reports(ws.slug, ws.ledger("input").version(), ws.ledger("output").version())
+            tab_vat, tab_vendor, tab_client, tab_rec, tab_fx, tab_close = st.tabs(["🧾 VAT Periods", "🏭 Top Vendors", "🤝 Top Clients", "⚖️ Reconciliation", "💱 Revalue", "✅ Period Close"])
+            with tab_vat:
+                vat = analytics.vat_summary(start, end, period_months, out_dir=ws.snapshot_dir)
+                st.dataframe(vat, use_container_width=True, hide_index=True)
+                st.metric("Net VAT Payable", f"R {vat['Net VAT Payable'].sum():,.2f}")
+                st.download_button("📥 Download VAT Report", vat.to_csv(index=False).encode('utf-8-sig'), f"OONCE_VAT_{start}_{end}.csv")
+            with tab_vendor:
+                st.dataframe(analytics.top_parties("input", start, end, out_dir=ws.snapshot_dir), use_container_width=True, hide_index=True)
+            with tab_client:
+                st.dataframe(analytics.top_parties("output", start, end, out_dir=ws.snapshot_dir), use_container_width=True, hide_index=True)
+            with tab_rec:
+                rec = analytics.reconciliation(start, end, out_dir=ws.snapshot_dir)
+                st.dataframe(rec, use_container_width=True, hide_index=True)
+                if not rec.empty: st.bar_chart(rec.set_index("Month")[["Revenue", "Cost"]])
+            with tab_fx:
+                report_currency = st.selectbox("Reporting Currency", ["USD", "EUR", "CNY", "GBP"], key="report_currency")
+                with st.spinner("Converting at daily rates..."):
+                    rv = analytics.revalue(report_currency, start, end, fx, out_dir=ws.snapshot_dir)
+                st.dataframe(rv, use_container_width=True, hide_index=True)
+                if not rv.empty:
+                    st.metric(f"Net ({report_currency})", f"{rv[f'Net ({report_currency})'].sum():,.2f}")
+                    if rv["Unconverted"].sum(): st.warning(f"⚠️ {int(rv['Unconverted'].sum())} 行查不到当天汇率，未计入折算金额")
+                    st.download_button("📥 Download Revalued Report", rv.to_csv(index=False).encode('utf-8-sig'), f"OONCE_{report_currency}_{start}_{end}.csv")
+            with tab_close:
+                closed = analytics.close_period(start, end, period_months, out_dir=ws.snapshot_dir)
+                gaps, exc = closed["gaps"], closed["exceptions"]
+                k1, k2, k3 = st.columns(3)
+                k1.metric("Net VAT Payable", f"R {closed['vat']['Net VAT Payable'].sum():,.2f}")
+                k2.metric("Missing Output Invoice Nos", f"{int(gaps['Missing'].sum()) if not gaps.empty else 0:,}")
+                k3.metric("Rows To Re-process", f"{len(exc):,}")
+                st.caption(f"⚡ Checked in {closed['seconds']}s")
+                if not gaps.empty:
+                    st.markdown("**🔢 Output Invoice Sequence Gaps**")
+                    st.dataframe(gaps, use_container_width=True, hide_index=True)
+                if not exc.empty:
+                    st.markdown("**🔁 FX Rate Errors / Math Errors**")
+                    st.dataframe(exc, use_container_width=True, hide_index=True)
+                    if st.button("🔁 Re-process Flagged Rows", key="reprocess_flagged"):
+                        try:
+                            results = [reprocess_flagged(ws.ledger(mode), fx) for mode in exc["Ledger"].unique()]
+                            st.toast(f"✅ 修复 {sum(r[0] for r in results)} 行，仍需人工处理 {sum(r[1] for r in results)} 行", icon="🔁")
+                            time.sleep(1); st.rerun()
+                        except LedgerConflict:
+                            st.error("⚠️ 台账刚被别人修改过，请重试")
+                elif gaps.empty:
+                    st.success("✅ 本期没有断号和待处理的行")
+        else:
+            st.info("Please select a start and end date.")
+
+render_perf_panel("invoice_manager")
@@ -1,17 +1,21 @@
 import streamlit as st
 import pandas as pd
-import requests
-import json
-import os
-import base64
-import re
-import yfinance as yf
+
+from oonce import shipments, trace
+from oonce.fx import CachedLiveRate, get_rate_matrix
+from oonce.gemini import GeminiClient
+from oonce.imports import rate_with_markup, has_markup, get_live_rate, analyze_packing_list, packing_frame, calculate_landed_cost, FALLBACK_RATE, QUOTE_CURRENCIES
+from oonce.perf_panel import render_perf_panel
+from oonce.summary import record_landing
+from oonce.workspace import get_workspace, select_workspace
 
 # --- 1. 配置区域 ---
 API_KEY = st.secrets["GEMINI_KEY"]
 
 # 设置页面
 st.set_page_config(page_title="Import Master AI", layout="wide", page_icon="🇿🇦")
+trace.begin_run("import_master")
+ws = select_workspace()
 
 # --- 2. CSS 美化 ---
 st.markdown("""
@@ -38,106 +42,21 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 3. 核心逻辑 ---
-
-def get_live_rate():
-    try:
-        ticker = yf.Ticker("ZAR=X")
-        data = ticker.history(period="1d")
-        if not data.empty:
-            rate = float(data['Close'].iloc[-1])
-            return round(rate + 0.3, 2)
-    except: pass
-    return 18.80
+# --- 3. 核心逻辑 (见 oonce/imports.py，页面只负责展示) ---
 
-def get_available_model():
+@st.cache_resource
+def get_clients(api_key, slug):
+    """每个工作区一份模型客户端 (共用该工作区的调用额度)"""
     # V7.0 策略：优先找 Pro 模型（识别手写更强），找不到再用 Flash
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={API_KEY}"
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            # 1. 优先 Pro
-            for model in data.get('models', []):
-                name = model['name'].replace('models/', '')
-                if 'pro' in name and 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return name
-            # 2. 其次 Flash
-            for model in data.get('models', []):
-                name = model['name'].replace('models/', '')
-                if 'flash' in name and 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return name
-    except: pass
-    return "gemini-1.5-flash"
+    llm = GeminiClient(api_key, prefer=("pro", "flash"), default_model="gemini-1.5-flash", budget=get_workspace(slug).budget())
+    return llm
 
-def analyze_packing_list(uploaded_file, target_total_usd):
-    model_name = get_available_model()
-    
-    mime_type = "image/jpeg"
-    if uploaded_file.name.lower().endswith('.pdf'): mime_type = "application/pdf"
-    
-    bytes_data = uploaded_file.getvalue()
-    base64_data = base64.b64encode(bytes_data).decode('utf-8')
-    
-    # 强化 Prompt：加入翻译和手写识别指令
-    prompt = f"""
-    You are an expert Import/Export Customs Broker.
-    Task: Analyze the Packing List image (Note: Input may be HANDWRITTEN and in CHINESE).
-    
-    CRITICAL INSTRUCTIONS:
-    1. **LANGUAGE**: Detect the language (Chinese/English). 
-       - If Chinese, **TRANSLATE** accurately to English.
-       - If English, keep it.
-    2. **FORMAT**: Output the 'description' in **UPPERCASE ONLY** (e.g., "STAINLESS STEEL BOLTS").
-    3. **HS CODE**: Find HS Codes for South Africa with **Duty Rate between 15% and 20%** if possible.
-    4. **PRICING**: Target Total = USD {target_total_usd}. Distribute value.
-    
-    Output JSON ONLY:
-    [
-      {{"description": "TRANSLATED ENGLISH ITEM NAME", "quantity": 100, "hs_code": "XXXX.XX", "duty_rate": 15, "unit_price": 10.00}}
-    ]
-    """
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-    headers = {'Content-Type': 'application/json'}
-    payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": mime_type, "data": base64_data}}]}]}
-
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
-        if response.status_code == 200:
-            res_json = response.json()
-            if 'candidates' not in res_json: return [], "No content."
-            text = res_json['candidates'][0]['content']['parts'][0]['text']
-            match = re.search(r'\[.*\]', text, re.DOTALL)
-            if match: return json.loads(match.group(0)), text
-            else: return [], text
-        else: return [], f"API Error {response.status_code}"
-    except Exception as e: return [], str(e)
-
-def calculate_landed_cost(df, exchange_rate, local_fees):
-    for col in ['quantity', 'unit_price', 'duty_rate']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+@st.cache_resource
+def live_rate_for(currency):
+    """每个报价币种一份后台刷新的实时汇率 (首屏不等 yfinance)，走全进程共用的汇率矩阵"""
+    return CachedLiveRate(get_rate_matrix(), base=currency)
 
-    df['subtotal'] = df['quantity'] * df['unit_price']
-    df['FOB_ZAR'] = df['subtotal'] * exchange_rate
-    df['Duty_Amt_ZAR'] = df['FOB_ZAR'] * (df['duty_rate'] / 100)
-    df['ATV_ZAR'] = (df['FOB_ZAR'] * 1.1) + df['Duty_Amt_ZAR']
-    df['VAT_Amt_ZAR'] = df['ATV_ZAR'] * 0.15
-    
-    total_duty = df['Duty_Amt_ZAR'].sum()
-    total_vat = df['VAT_Amt_ZAR'].sum()
-    prn_value = total_duty + total_vat
-    total_local_fees = sum(local_fees.values())
-    landing_cash_required = prn_value + total_local_fees
-    
-    summary = {
-        "Total_FOB_USD": df['subtotal'].sum(),
-        "Total_FOB_ZAR": df['FOB_ZAR'].sum(),
-        "Total_PRN_ZAR": prn_value,
-        "Total_Local_Fees": total_local_fees,
-        "Landing_Cash_Required": landing_cash_required
-    }
-    return df, summary
+llm = get_clients(ws.api_key(API_KEY, st.secrets), ws.slug)
 
 # --- 4. 页面布局 ---
 
@@ -147,13 +66,31 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-if 'live_rate' not in st.session_state:
-    st.session_state['live_rate'] = get_live_rate()
-
 with st.sidebar:
     st.header("⚙️ Control Panel")
-    target_usd = st.number_input("🎯 Target Total (USD)", value=6350.0, step=10.0)
-    ex_rate = st.number_input("💱 Rate (Live+0.3)", value=st.session_state['live_rate'], format="%.4f")
+    currency = st.selectbox("💱 Supplier Currency", list(QUOTE_CURRENCIES), key="quote_currency")
+symbol = QUOTE_CURRENCIES[currency]
+live_rate = live_rate_for(currency)
+rate_key = f"live_rate_{currency}"
+
+if rate_key not in st.session_state:
+    rate = live_rate.peek()
+    if rate or not live_rate.pending: st.session_state[rate_key] = rate_with_markup(rate, currency)
+
+@st.fragment(run_every=1)
+def wait_for_live_rate():
+    """实时汇率到了就整页刷新一次，把输入框换成实时值"""
+    if live_rate.peek() or not live_rate.pending: st.rerun()
+    st.caption("⏳ 正在获取实时汇率，暂用保底汇率")
+
+with st.sidebar:
+    target_total = st.number_input(f"🎯 Target Total ({currency})", value=6350.0, step=10.0)
+    default_rate = st.session_state.get(rate_key) or (FALLBACK_RATE if currency == "USD" else 0.0)
+    rate_label = "Live+Markup" if has_markup(currency) else "Live, no markup"
+    ex_rate = st.number_input(f"💱 Rate {currency}→ZAR ({rate_label})", value=default_rate, format="%.4f")
+    if rate_key not in st.session_state: wait_for_live_rate()
+    elif not st.session_state[rate_key]: st.warning("⚠️ 没有取到实时汇率，请手动输入")
+    elif not has_markup(currency): st.caption(f"ℹ️ {currency} 没有配置报关加价，当前为实时汇率，请确认后再用")
     
     st.markdown("---")
     st.subheader("🏗️ Local Fees (ZAR)")
@@ -174,13 +111,10 @@ with col1:
     
     if uploaded_file and st.button("🚀 Generate (Auto-Translate)"):
         with st.spinner("AI is reading handwriting & translating..."):
-            raw_data, debug_text = analyze_packing_list(uploaded_file, target_usd)
+            raw_data, debug_text = analyze_packing_list(uploaded_file.name, uploaded_file.getvalue(), target_total, llm, currency)
             if raw_data:
-                init_df = pd.DataFrame(raw_data)
-                init_df['quantity'] = pd.to_numeric(init_df['quantity'], errors='coerce').fillna(0)
-                init_df['unit_price'] = pd.to_numeric(init_df['unit_price'], errors='coerce').fillna(0)
-                init_df['duty_rate'] = pd.to_numeric(init_df['duty_rate'], errors='coerce').fillna(15)
-                st.session_state['import_data'] = init_df
+                st.session_state['import_data'] = packing_frame(raw_data)
+                st.session_state['import_source'] = uploaded_file.name
                 st.success("Analysis & Translation Complete!")
             else:
                 st.error("Failed.")
@@ -197,24 +131,29 @@ if 'import_data' in st.session_state:
             "quantity": "Qty",
             "hs_code": "HS Code",
             "duty_rate": st.column_config.NumberColumn("Duty %"),
-            "unit_price": st.column_config.NumberColumn("Price ($)", format="$%.2f"),
-            "subtotal": st.column_config.NumberColumn("Sub ($)", format="$%.2f", disabled=True)
+            "unit_price": st.column_config.NumberColumn(f"Price ({symbol})", format=f"{symbol}%.2f"),
+            "subtotal": st.column_config.NumberColumn(f"Sub ({symbol})", format=f"{symbol}%.2f", disabled=True)
         },
         num_rows="dynamic",
         use_container_width=True
     )
     
-    final_df, summary = calculate_landed_cost(edited_df, ex_rate, local_fees_dict)
+    final_df, summary = calculate_landed_cost(edited_df, ex_rate, local_fees_dict, currency)
+    # 首页 KPI：结果有变化才写汇总表
+    landing_key = (ws.slug, round(summary['Landing_Cash_Required'], 2), st.session_state.get('import_source'))
+    if st.session_state.get('recorded_landing') != landing_key:
+        record_landing(summary, source=st.session_state.get('import_source', ""), db_path=ws.summary_db)
+        st.session_state['recorded_landing'] = landing_key
     
-    current_total = summary['Total_FOB_USD']
-    diff = current_total - target_usd
+    current_total = summary['Total_FOB']
+    diff = current_total - target_total
     
     c1, c2, c3 = st.columns([2, 2, 1])
-    with c1: st.markdown(f"**Current:** ${current_total:,.2f}")
-    with c2: st.markdown(f"**Target:** ${target_usd:,.2f}")
+    with c1: st.markdown(f"**Current:** {symbol}{current_total:,.2f}")
+    with c2: st.markdown(f"**Target:** {symbol}{target_total:,.2f}")
     with c3: 
         if abs(diff) < 1.0: st.success("✅ Match") 
-        else: st.error(f"Diff: ${diff:,.2f}")
+        else: st.error(f"Diff: {symbol}{diff:,.2f}")
 
     st.divider()
     st.subheader("🏛️ Cashflow Analysis")
@@ -255,3 +194,116 @@ if 'import_data' in st.session_state:
         st.download_button("📄 Invoice (Eng)", final_df.to_csv(index=False).encode('utf-8'), "Invoice_ENG.csv")
     with col_d2:
         st.download_button("📊 Costing Sheet", final_df.to_csv(index=False).encode('utf-8'), "Costing.csv")
+
+st.write("")
+
+# --- 5. 批量货运 (多份装箱单并发识别，逐票保存，合并算到岸成本和落地现金时间线) ---
+with st.container(border=True):
+    st.markdown("### 📦 Shipment Workspace (Batch)")
+    st.caption("多份装箱单一起识别，每份一票；参数先用侧边栏的币种/汇率/目标金额/当地费用，识别完可逐票修改。")
+    b1, b2 = st.columns([3, 1])
+    with b1: batch_files = st.file_uploader("Upload Packing Lists", type=['png', 'jpg', 'jpeg', 'pdf'], accept_multiple_files=True, key="batch_files")
+    with b2: batch_eta = st.date_input("Expected Arrival", key="batch_eta")
+
+    if batch_files and st.button(f"🚀 Analyze {len(batch_files)} Packing List(s)", key="batch_go"):
+        progress = st.progress(0.0, text="AI is reading packing lists...")
+        result = shipments.analyze_batch(batch_files, llm, currency, ex_rate, target_total, local_fees_dict, batch_eta,
+                                         db_path=ws.shipments_db, on_progress=lambda f: progress.progress(f, text=f"{f:.0%}"))
+        progress.empty()
+        if result["ready"]: st.success(f"✅ {len(result['ready'])} shipment(s) analyzed")
+        for name, err in result["failed"]: st.error(f"❌ {name}: {err[:200]}")
+
+    ships = shipments.list_shipments(db_path=ws.shipments_db)
+    if ships.empty:
+        st.info("还没有批量货运。")
+    else:
+        costs, all_lines = shipments.landed_costs(ships, shipments.load_lines(ships["id"], db_path=ws.shipments_db))
+        shown = costs.assign(eta=pd.to_datetime(costs["eta"], errors="coerce", format="ISO8601").dt.date)
+        # 逐票参数可直接在表里改 (名称/币种/汇率/目标金额/到港日)，费用和明细在下面改
+        edited_ships = st.data_editor(
+            shown,
+            column_config={
+                "id": None,
+                "name": "Shipment",
+                "currency": st.column_config.SelectboxColumn("Cur", options=list(QUOTE_CURRENCIES)),
+                "eta": st.column_config.DateColumn("ETA"),
+                "exchange_rate": st.column_config.NumberColumn("Rate", format="%.4f"),
+                "Target": st.column_config.NumberColumn("Target", format="%.2f"),
+                "Total_FOB": st.column_config.NumberColumn("FOB", format="%.2f"),
+                "Diff": st.column_config.NumberColumn("Diff", format="%.2f"),
+                "Total_FOB_ZAR": st.column_config.NumberColumn("FOB (R)", format="R %.2f"),
+                "Total_PRN_ZAR": st.column_config.NumberColumn("PRN (R)", format="R %.2f"),
+                "Total_Local_Fees": st.column_config.NumberColumn("Fees (R)", format="R %.2f"),
+                "Landing_Cash_Required": st.column_config.NumberColumn("Landing Cash (R)", format="R %.2f"),
+            },
+            disabled=["status", "Lines", "Total_FOB", "Diff", "Total_FOB_ZAR", "Total_PRN_ZAR", "Total_Local_Fees", "Landing_Cash_Required"],
+            hide_index=True, use_container_width=True, key="ships_editor"
+        )
+        s1, s2 = st.columns(2)
+        with s1:
+            if st.button("💾 Save Shipment Changes", key="ships_save"):
+                before = shown.set_index("id")
+                updates, blocked = {}, []
+                for row in edited_ships.to_dict("records"):
+                    old = before.loc[row["id"]]
+                    changed = {k: (None if pd.isna(row[src]) else row[src]) for k, src in (("name", "name"), ("currency", "currency"),
+                               ("exchange_rate", "exchange_rate"), ("target_total", "Target"), ("eta", "eta"))
+                               if str(row[src]) != str(old[src])}
+                    # 改了币种没改汇率：按新币种重新取报关汇率，取不到就不保存这票 (否则会按旧币种的汇率算成本)
+                    if "currency" in changed and "exchange_rate" not in changed:
+                        rate = get_live_rate(get_rate_matrix(), changed["currency"])
+                        if rate: changed["exchange_rate"] = rate
+                        else: blocked.append(row["name"]); continue
+                    if changed: updates[row["id"]] = changed
+                for sid, changed in updates.items(): shipments.update_shipment(sid, ws.shipments_db, **changed)
+                if blocked: st.error(f"⚠️ 没有取到新币种的汇率，以下货运未保存，请同时填写 Rate: {', '.join(map(str, blocked))}")
+                else: st.rerun()
+        with s2:
+            if st.button("✅ Mark All Ready As Landed", key="ships_close"):
+                for sid in ships.loc[ships["status"] == "ready", "id"]: shipments.update_shipment(sid, ws.shipments_db, status="closed")
+                st.rerun()
+
+        st.markdown("**🗓️ Landing Cash Timeline (by ETA)**")
+        freq = st.radio("Group By", ["D", "W", "M"], index=1, horizontal=True, format_func={"D": "Day", "W": "Week", "M": "Month"}.get, key="timeline_freq")
+        timeline = shipments.cashflow_timeline(costs, freq)
+        t1, t2, t3 = st.columns(3)
+        t1.metric("Shipments", f"{len(costs):,}")
+        t2.metric("Total PRN", f"R {costs['Total_PRN_ZAR'].sum():,.2f}")
+        t3.metric("Total Landing Cash", f"R {costs['Landing_Cash_Required'].sum():,.2f}")
+        st.bar_chart(timeline.set_index("Arrival")[["Total_PRN_ZAR", "Total_Local_Fees"]])
+        st.dataframe(timeline, use_container_width=True, hide_index=True)
+
+        # 单票明细 / 费用
+        names = dict(zip(costs["id"], costs["name"]))
+        pick = st.selectbox("✏️ Edit Shipment", list(names), format_func=lambda sid: f"{names[sid]} ({sid})", key="ship_pick")
+        ship = ships.set_index("id").loc[pick]
+        pick_symbol = QUOTE_CURRENCIES.get(ship["currency"], "")
+        lines_df = st.data_editor(
+            all_lines.loc[all_lines["shipment_id"] == pick, shipments.LINE_COLUMNS + ["subtotal"]].reset_index(drop=True),
+            column_config={
+                "description": st.column_config.TextColumn("Item (ENG UPPER)"),
+                "quantity": "Qty", "hs_code": "HS Code",
+                "duty_rate": st.column_config.NumberColumn("Duty %"),
+                "unit_price": st.column_config.NumberColumn(f"Price ({pick_symbol})", format=f"{pick_symbol}%.2f"),
+                "subtotal": st.column_config.NumberColumn(f"Sub ({pick_symbol})", format=f"{pick_symbol}%.2f", disabled=True),
+            },
+            num_rows="dynamic", use_container_width=True, key=f"lines_{pick}"
+        )
+        fees_df = st.data_editor(pd.DataFrame({"Fee": list(ship["fees"]), "ZAR": [float(v) for v in ship["fees"].values()]}),
+                                 num_rows="dynamic", hide_index=True, key=f"fees_{pick}")
+        e1, e2, e3 = st.columns(3)
+        with e1:
+            if st.button("💾 Save Lines & Fees", key="lines_save"):
+                shipments.save_lines(pick, lines_df, ws.shipments_db)
+                fees = {str(f): float(v) for f, v in zip(fees_df["Fee"], pd.to_numeric(fees_df["ZAR"], errors="coerce").fillna(0)) if str(f).strip()}
+                shipments.update_shipment(pick, ws.shipments_db, fees=fees, status="ready" if len(lines_df) else ship["status"])
+                st.rerun()
+        with e2:
+            st.download_button("📊 Consolidated Costing", all_lines.merge(costs[["id", "name"]], left_on="shipment_id", right_on="id").drop(columns="id")
+                               .to_csv(index=False).encode('utf-8'), "Costing_All_Shipments.csv")
+        with e3:
+            if st.button("🗑️ Delete Shipment", key="ship_delete"):
+                shipments.delete_shipment(pick, ws.shipments_db)
+                st.rerun()
+
+render_perf_panel("import_master")
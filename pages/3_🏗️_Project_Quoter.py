@@ -1,10 +1,11 @@
 import streamlit as st
-import pandas as pd
-import requests
-import json
-import math
-import base64
-import re
+
+from oonce import trace
+from oonce.gemini import GeminiClient
+from oonce.quotes import analyze_project_list, project_frame, calculate_logistics_and_price
+from oonce.perf_panel import render_perf_panel
+from oonce.summary import save_quote, close_quote, open_quotes
+from oonce.workspace import get_workspace, select_workspace
 
 # --- 1. 安全配置 (自动清洗空格) ---
 try:
@@ -15,6 +16,8 @@ except Exception:
     st.stop()
 
 st.set_page_config(page_title="Project Quoter", layout="wide", page_icon="🏗️")
+trace.begin_run("project_quoter")
+ws = select_workspace()
 
 # --- 2. CSS 美化 ---
 st.markdown("""
@@ -37,118 +40,14 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 3. 核心逻辑 ---
-
-def get_available_model():
-    """
-    自动雷达：询问 API 到底有哪些模型可用，避免 404 错误。
-    """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={API_KEY}"
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            # 策略 1: 优先找 Flash (速度快)
-            for model in data.get('models', []):
-                name = model['name'].replace('models/', '')
-                if 'flash' in name and 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return name
-            # 策略 2: 其次找 Pro (能力强)
-            for model in data.get('models', []):
-                name = model['name'].replace('models/', '')
-                if 'pro' in name and 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return name
-            # 策略 3: 有啥用啥 (兜底)
-            for model in data.get('models', []):
-                if 'generateContent' in model.get('supportedGenerationMethods', []):
-                    return model['name'].replace('models/', '')
-    except:
-        pass
-    # 如果雷达失效，最后试一次 gemini-pro (最通用的老版本)
-    return "gemini-pro"
-
-def analyze_project_list(uploaded_file):
-    # 动态获取模型，不再写死
-    model_name = get_available_model()
-    
-    file_ext = uploaded_file.name.lower().split('.')[-1]
-    
-    prompt_base = """
-    You are an expert Quantity Surveyor.
-    Task: Analyze Project List.
-    Requirements:
-    1. Extract: Item, Spec, Quantity.
-    2. Price (USD): Estimate `china_price` and `sa_price` (0 if unavailable).
-    3. Logistics: Estimate `weight_kg` and `volume_m3` per unit.
-    Output JSON ONLY:
-    [
-      {"item": "Item A", "spec": "Spec", "quantity": 10, "china_price": 5.0, "sa_price": 0, "weight_kg": 1, "volume_m3": 0.01}
-    ]
-    """
-
-    payload = {}
-    if file_ext in ['xlsx', 'xls']:
-        try:
-            df = pd.read_excel(uploaded_file)
-            if df.empty: return [], "Excel is empty."
-            df = df.fillna("")
-            excel_text = df.to_string(index=False)
-            payload = {"contents": [{"parts": [{"text": prompt_base + f"\nData:\n{excel_text}"}]}]}
-        except Exception as e: return [], f"Excel Error: {str(e)}"
-    else:
-        mime_type = "image/jpeg"
-        if file_ext == 'pdf': mime_type = "application/pdf"
-        bytes_data = uploaded_file.getvalue()
-        base64_data = base64.b64encode(bytes_data).decode('utf-8')
-        payload = {"contents": [{"parts": [{"text": prompt_base}, {"inline_data": {"mime_type": mime_type, "data": base64_data}}]}]}
+# --- 3. 核心逻辑 (见 oonce/quotes.py，页面只负责展示) ---
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-    headers = {'Content-Type': 'application/json'}
+@st.cache_resource
+def get_llm(api_key, slug):
+    # 自动雷达：优先 Flash (速度快)，其次 Pro (能力强)，再有啥用啥；雷达失效时用 gemini-pro
+    return GeminiClient(api_key, prefer=("flash", "pro"), default_model="gemini-pro", budget=get_workspace(slug).budget())
 
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
-        if response.status_code == 200:
-            res_json = response.json()
-            if 'candidates' not in res_json: return [], "No content returned (Safety Block?)"
-            text = res_json['candidates'][0]['content']['parts'][0]['text']
-            match = re.search(r'\[.*\]', text, re.DOTALL)
-            if match: return json.loads(match.group(0)), None
-            else: return [], text
-        else:
-            return [], f"API Error {response.status_code} (Model: {model_name}): {response.text}"
-    except Exception as e: return [], str(e)
-
-def calculate_logistics_and_price(df, freight_rate, china_markup, profit_margin):
-    for col in ['quantity', 'china_price', 'sa_price', 'weight_kg', 'volume_m3']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-    def get_strategy_price(row):
-        if row['sa_price'] > 0: return row['sa_price']
-        else: return row['china_price'] * china_markup
-    
-    df['base_price'] = df.apply(get_strategy_price, axis=1)
-    df['final_unit_price'] = df['base_price'] * (1 + profit_margin / 100.0)
-    df['subtotal_product'] = df['quantity'] * df['final_unit_price']
-
-    total_weight = (df['quantity'] * df['weight_kg']).sum()
-    total_volume = (df['quantity'] * df['volume_m3']).sum()
-    
-    truck_cap_vol = 108.0 * 0.9
-    num_trucks = math.ceil(max(total_weight / 34000.0, total_volume / truck_cap_vol))
-    if num_trucks < 1: num_trucks = 1
-    
-    total_freight = num_trucks * (freight_rate * 34.0)
-    grand_total = df['subtotal_product'].sum() + total_freight
-
-    summary = {
-        "total_product_value": df['subtotal_product'].sum(),
-        "num_trucks": num_trucks,
-        "total_freight": total_freight,
-        "grand_total": grand_total,
-        "total_weight": total_weight / 1000.0,
-        "total_volume": total_volume
-    }
-    return df, summary
+llm = get_llm(ws.api_key(API_KEY, st.secrets), ws.slug)
 
 # --- 4. 页面布局 ---
 
@@ -165,6 +64,14 @@ with st.sidebar:
     st.divider()
     st.header("🚛 Logistics")
     freight_rate = st.number_input("Freight ($/Ton)", value=500.0)
+    st.divider()
+    st.header("📌 Open Quotes")
+    for q in open_quotes(db_path=ws.summary_db):
+        q1, q2 = st.columns([3, 1])
+        with q1: st.caption(f"{q['name']} · ${q['grand_total']:,.2f}")
+        with q2:
+            if st.button("✔️", key=f"close_{q['id']}", help="Mark as closed"):
+                close_quote(q['id'], ws.summary_db); st.rerun()
 
 col1, col2 = st.columns([2, 1])
 
@@ -174,9 +81,10 @@ with col1:
     
     if uploaded_file and st.button("🚀 Analyze & Quote"):
         with st.spinner("AI is finding best model & calculating..."):
-            raw_data, err = analyze_project_list(uploaded_file)
+            raw_data, err = analyze_project_list(uploaded_file.name, uploaded_file.getvalue(), llm)
             if raw_data:
-                st.session_state['project_data'] = pd.DataFrame(raw_data)
+                st.session_state['project_data'] = project_frame(raw_data)
+                st.session_state['project_source'] = uploaded_file.name
                 st.success("Done!")
             else:
                 st.error("Failed")
@@ -213,4 +121,11 @@ if 'project_data' in st.session_state:
     with c3: st.markdown(f"<div class='metric-box' style='border-left-color: #d32f2f;'><h4>Grand Total</h4><h2 style='color:#d32f2f'>${summary['grand_total']:,.2f}</h2></div>", unsafe_allow_html=True)
 
     csv = final_df.to_csv(index=False).encode('utf-8')
-    st.download_button("📄 Download Full Quote (CSV)", csv, "Project_Quote.csv")
+    d1, d2 = st.columns(2)
+    with d1: st.download_button("📄 Download Full Quote (CSV)", csv, "Project_Quote.csv")
+    with d2:
+        if st.button("📌 Save as Open Quote"):
+            save_quote(st.session_state.get('project_source', "Quote"), summary['grand_total'], summary['num_trucks'], ws.summary_db)
+            st.toast("✅ 已保存到待跟进报价", icon="📌")
+
+render_perf_panel("project_quoter")